@@ -109,17 +109,17 @@ class SensorAnalyzer:
         for reading in readings:
             # Analyze temperature
             all_insights.extend(
-                SensorAnalyzer.analyze_temperature(reading.temperature, reading.sensor_id)
+                SensorAnalyzer.analyze_temperature(reading.temperature, reading.node_id)
             )
 
             # Analyze soil moisture
             all_insights.extend(
-                SensorAnalyzer.analyze_soil_moisture(reading.soil_moisture, reading.sensor_id)
+                SensorAnalyzer.analyze_soil_moisture(reading.soil_moisture, reading.node_id)
             )
 
             # Analyze humidity
             all_insights.extend(
-                SensorAnalyzer.analyze_humidity(reading.humidity, reading.sensor_id)
+                SensorAnalyzer.analyze_humidity(reading.humidity, reading.node_id)
             )
 
         # If no issues found, provide positive feedback
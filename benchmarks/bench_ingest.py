@@ -0,0 +1,148 @@
+"""Benchmark the sensor ingest path against SQLite.
+
+Compares the legacy ingest sequence (route-level gateway upsert, a second
+gateway upsert inside create_reading, a third inside register_or_update_node,
+each with its own commit, then a commit + refresh for the reading) with the
+single-transaction SensorService.create_reading and the batch path.
+
+Reports per-request latency (mean/p50/p95) and the maximum sustained
+readings/sec a single worker can store.
+
+Usage:
+    python benchmarks/bench_ingest.py [--readings 2000] [--nodes 20] [--batch-size 100]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Point the app at a throwaway database before any model import
+_tmp_dir = tempfile.mkdtemp(prefix="bench_ingest_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.database import SessionLocal, SensorReading, init_db  # noqa: E402
+from models.schemas import SensorDataInput  # noqa: E402
+from services.gateway_service import GatewayService  # noqa: E402
+from services.sensor_service import SensorService  # noqa: E402
+
+
+def make_payloads(count, nodes, start):
+    """Build distinct payloads spread round-robin over the nodes, 10s apart per node."""
+    payloads = []
+    for i in range(count):
+        payloads.append(SensorDataInput(
+            nodeId=f"node-{i % nodes:03d}",
+            gatewayId=f"gateway-{i % 3:02d}",
+            temperature=20.0 + (i % 50) / 10,
+            humidity=55.0,
+            soilMoisture=40.0,
+            timestamp=start + (i // nodes) * 10,
+            localIp="192.168.8.20",
+        ))
+    return payloads
+
+
+def legacy_ingest(db, sensor_data):
+    """The pre-single-transaction request path: four commits per reading."""
+    gateway_id = sensor_data.get_gateway_id()
+    node_id = sensor_data.get_sensor_id()
+    GatewayService.register_or_update_gateway(db, gateway_id, local_ip="192.168.8.20", client_ip="10.0.0.2")
+    timestamp = SensorService.resolve_timestamp(sensor_data)
+    if SensorService.check_duplicate(db, node_id, gateway_id, timestamp):
+        return
+    GatewayService.register_or_update_gateway(db, gateway_id)
+    GatewayService.register_or_update_node(db, node_id, gateway_id)
+    reading = SensorReading(
+        node_id=node_id,
+        gateway_id=gateway_id,
+        temperature=sensor_data.temperature,
+        humidity=sensor_data.humidity,
+        soil_moisture=sensor_data.get_soil_moisture(),
+        timestamp=timestamp,
+    )
+    db.add(reading)
+    db.commit()
+    db.refresh(reading)
+
+
+def single_transaction_ingest(db, sensor_data):
+    """The current request path: one commit per reading."""
+    timestamp = SensorService.resolve_timestamp(sensor_data)
+    if SensorService.check_duplicate(db, sensor_data.get_sensor_id(), sensor_data.get_gateway_id(), timestamp):
+        return
+    SensorService.create_reading(
+        db, sensor_data, reading_timestamp=timestamp, local_ip="192.168.8.20", client_ip="10.0.0.2"
+    )
+
+
+def run_per_reading(name, ingest, payloads):
+    db = SessionLocal()
+    latencies = []
+    try:
+        started = time.perf_counter()
+        for sensor_data in payloads:
+            t0 = time.perf_counter()
+            ingest(db, sensor_data)
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    report(name, latencies, len(payloads), elapsed)
+
+
+def run_batch(payloads, batch_size):
+    db = SessionLocal()
+    latencies = []
+    try:
+        started = time.perf_counter()
+        for offset in range(0, len(payloads), batch_size):
+            chunk = payloads[offset:offset + batch_size]
+            t0 = time.perf_counter()
+            SensorService.create_readings_batch(
+                db,
+                [(data, SensorService.resolve_timestamp(data)) for data in chunk],
+                client_ip="10.0.0.2",
+            )
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    report(f"batch ({batch_size}/request)", latencies, len(payloads), elapsed)
+
+
+def report(name, latencies, readings, elapsed):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(
+        f"{name:<28} mean {statistics.mean(latencies) * 1000:8.3f} ms  "
+        f"p50 {statistics.median(latencies) * 1000:8.3f} ms  "
+        f"p95 {p95 * 1000:8.3f} ms  "
+        f"{readings / elapsed:10.1f} readings/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=2000, help="Readings per scenario")
+    parser.add_argument("--nodes", type=int, default=20, help="Distinct node IDs")
+    parser.add_argument("--batch-size", type=int, default=100, help="Items per batch request")
+    args = parser.parse_args()
+
+    init_db()
+    print(f"SQLite database: {os.environ['DATABASE_URL']}")
+    print(f"{args.readings} readings over {args.nodes} nodes per scenario\n")
+
+    # Each scenario gets its own time range so nothing is deduplicated
+    base = int(time.time()) - 20 * 3600
+    span = (args.readings // args.nodes + 1) * 10 + 60
+    run_per_reading("legacy (4 commits/reading)", legacy_ingest, make_payloads(args.readings, args.nodes, base))
+    run_per_reading("single transaction", single_transaction_ingest,
+                    make_payloads(args.readings, args.nodes, base + span))
+    run_batch(make_payloads(args.readings, args.nodes, base + 2 * span), args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Benchmark the per-request overhead of the request logging middleware.
+
+Drives a minimal FastAPI app with a JSON POST endpoint (shaped like sensor
+ingest) and a GET endpoint directly through ASGI, so no HTTP client or
+network cost is measured, and compares:
+
+- no logging middleware
+- the previous @app.middleware("http") log_requests (buffers and json-parses
+  every POST body, then patches request._receive)
+- RequestLoggingMiddleware (pure ASGI, bounded scan of the first body chunk)
+
+Log records are formatted with the application's format and written to
+os.devnull. Reports mean/p50/p95 latency per request and the overhead of
+each middleware relative to the bare app.
+
+Usage:
+    python benchmarks/bench_request_logging.py [--requests 20000] [--body-bytes 200]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request  # noqa: E402
+from middleware.request_logging import RequestLoggingMiddleware  # noqa: E402
+
+
+class _GatewayIdFormatter(logging.Formatter):
+    def format(self, record):
+        if not hasattr(record, "gateway_id"):
+            record.gateway_id = "unknown"
+        return super().format(record)
+
+
+def configure_logging():
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.setFormatter(_GatewayIdFormatter(
+        fmt="%(asctime)s - %(name)s - %(levelname)s - [gateway_id=%(gateway_id)s] - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    ))
+    logging.basicConfig(level=logging.INFO, handlers=[handler], force=True)
+
+
+def build_app():
+    app = FastAPI()
+
+    @app.post("/api/sensors/data")
+    async def receive(request: Request):
+        payload = await request.json()
+        return {"status": "accepted", "node_id": payload.get("nodeId")}
+
+    @app.get("/api/sensors/latest")
+    async def latest():
+        return {"node_id": "node-001", "temperature": 24.5}
+
+    return app
+
+
+def add_legacy_middleware(app):
+    """The previous log_requests middleware from main.py."""
+    logger = logging.getLogger("main")
+
+    @app.middleware("http")
+    async def log_requests(request: Request, call_next):
+        start_time = time.time()
+        gateway_id = request.query_params.get("gateway_id", "unknown")
+        if request.method == "POST" and "application/json" in request.headers.get("content-type", ""):
+            try:
+                body = await request.body()
+                if body:
+                    try:
+                        body_json = json.loads(body)
+                        gateway_id = body_json.get("gatewayId") or body_json.get("gateway_id") or gateway_id
+                    except Exception:
+                        pass
+
+                async def receive():
+                    return body
+                request._receive = receive
+            except Exception:
+                pass
+        logger.info(f"{request.method} {request.url.path}", extra={"gateway_id": gateway_id})
+        response = await call_next(request)
+        process_time = time.time() - start_time
+        logger.info(
+            f"{request.method} {request.url.path} - {response.status_code} ({process_time:.3f}s)",
+            extra={"gateway_id": gateway_id}
+        )
+        return response
+    return app
+
+
+def make_body(size):
+    payload = {
+        "nodeId": "node-001",
+        "gatewayId": "gateway-01",
+        "temperature": 24.5,
+        "humidity": 61.2,
+        "soilMoisture": 40.1,
+        "timestamp": 1700000000,
+        "localIp": "192.168.8.20",
+    }
+    body = json.dumps(payload)
+    if len(body) < size:
+        payload["padding"] = "x" * (size - len(body) - 15)
+    return json.dumps(payload).encode()
+
+
+def make_scope(method, path, headers):
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("10.0.0.2", 50000),
+        "server": ("testserver", 80),
+    }
+
+
+async def call(app, scope, body):
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def run_scenario(name, app, method, path, body, requests):
+    headers = [(b"host", b"testserver")]
+    if body:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = make_scope(method, path, headers)
+    # Warm up routing and middleware stack construction
+    for _ in range(200):
+        await call(app, dict(scope), body)
+    latencies = []
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        await call(app, dict(scope), body)
+        latencies.append(time.perf_counter() - t0)
+    ordered = sorted(latencies)
+    return name, statistics.mean(latencies), statistics.median(latencies), ordered[int(len(ordered) * 0.95)]
+
+
+def report(results):
+    baseline = results[0][1]
+    for name, mean, p50, p95 in results:
+        print(
+            f"{name:<34} mean {mean * 1e6:8.1f} us  p50 {p50 * 1e6:8.1f} us  "
+            f"p95 {p95 * 1e6:8.1f} us  overhead {(mean - baseline) * 1e6:+8.1f} us"
+        )
+
+
+async def main_async(args):
+    body = make_body(args.body_bytes)
+    apps = [
+        ("no middleware", build_app()),
+        ("legacy log_requests", add_legacy_middleware(build_app())),
+        ("RequestLoggingMiddleware", build_app()),
+    ]
+    apps[2][1].add_middleware(RequestLoggingMiddleware)
+
+    print(f"POST /api/sensors/data ({len(body)} byte JSON body), {args.requests} requests")
+    report([
+        await run_scenario(name, app, "POST", "/api/sensors/data", body, args.requests)
+        for name, app in apps
+    ])
+    print(f"\nGET /api/sensors/latest, {args.requests} requests")
+    report([
+        await run_scenario(name, app, "GET", "/api/sensors/latest", b"", args.requests)
+        for name, app in apps
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000, help="Requests per scenario")
+    parser.add_argument("--body-bytes", type=int, default=200, help="Approximate POST body size")
+    args = parser.parse_args()
+    configure_logging()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
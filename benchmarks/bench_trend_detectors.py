@@ -0,0 +1,137 @@
+"""Benchmark the trend detectors behind GET /api/ai/insights.
+
+Compares the legacy path (ORM objects from get_recent_readings, Python lists
+rebuilt per detector, statistics.mean/stdev) with the current one
+(ReadingWindow column arrays from a Core select, NumPy reductions) on one
+node's 24-hour window of 10k, 100k and 1M readings.
+
+Reports load (query + materialisation), detector and total time per path.
+
+Usage:
+    python benchmarks/bench_trend_detectors.py [--sizes 10000 100000 1000000] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a throwaway database before any model import
+_tmp_dir = tempfile.mkdtemp(prefix="bench_trends_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, insert  # noqa: E402
+from models.database import SessionLocal, SensorReading, init_db  # noqa: E402
+from services.trend_insights_service import TrendInsightService  # noqa: E402
+
+WINDOW_MINUTES = 1440
+
+
+def populate(db, count):
+    """Replace the table contents with `count` readings of one node spread over the window."""
+    db.execute(delete(SensorReading))
+    now = datetime.utcnow()
+    step = (WINDOW_MINUTES * 60 - 60) / count
+    rows = []
+    for i in range(count):
+        rows.append({
+            "node_id": "node-001",
+            "gateway_id": "gateway-01",
+            "temperature": 22.0 + (i % 100) / 50,
+            "humidity": 60.0 + (i % 30) / 10,
+            "soil_moisture": 45.0 - i / count * 5,
+            "timestamp": now - timedelta(seconds=60 + (count - i) * step),
+        })
+        if len(rows) == 50000:
+            db.execute(insert(SensorReading), rows)
+            rows = []
+    if rows:
+        db.execute(insert(SensorReading), rows)
+    db.commit()
+
+
+def legacy_detectors(readings):
+    """The data work of the pre-NumPy detectors: a list per detector and statistics.*."""
+    # detect_drought_risk
+    soil_values = [r.soil_moisture for r in readings if r.soil_moisture is not None]
+    (soil_values[0] - soil_values[-1]) / ((readings[-1].timestamp - readings[0].timestamp).total_seconds() / 3600)
+    # detect_overwatering_risk
+    soil_values = [r.soil_moisture for r in readings if r.soil_moisture is not None]
+    statistics.mean(soil_values)
+    # detect_temperature_stress
+    temp_values = [r.temperature for r in readings if r.temperature is not None]
+    max(temp_values), min(temp_values), statistics.mean(temp_values)
+    # detect_sensor_failure
+    temp_values = [r.temperature for r in readings if r.temperature is not None]
+    soil_values = [r.soil_moisture for r in readings if r.soil_moisture is not None]
+    statistics.stdev(temp_values), statistics.stdev(soil_values)
+
+
+def current_detectors(window):
+    TrendInsightService.detect_drought_risk(window)
+    TrendInsightService.detect_overwatering_risk(window)
+    TrendInsightService.detect_temperature_stress(window)
+    TrendInsightService.detect_sensor_failure(window, "node-001")
+
+
+def measure(load, detect, repeat):
+    """Best-of-N load and detector times in seconds."""
+    load_times, detect_times = [], []
+    for _ in range(repeat):
+        db = SessionLocal()
+        try:
+            t0 = time.perf_counter()
+            data = load(db)
+            t1 = time.perf_counter()
+            detect(data)
+            t2 = time.perf_counter()
+        finally:
+            db.close()
+        load_times.append(t1 - t0)
+        detect_times.append(t2 - t1)
+    return min(load_times), min(detect_times)
+
+
+def report(name, load_s, detect_s):
+    print(
+        f"  {name:<22} load {load_s * 1000:10.1f} ms  detect {detect_s * 1000:10.1f} ms  "
+        f"total {(load_s + detect_s) * 1000:10.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Readings per window")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per path (best is reported)")
+    args = parser.parse_args()
+
+    init_db()
+    print(f"SQLite database: {os.environ['DATABASE_URL']}\n")
+
+    for size in args.sizes:
+        db = SessionLocal()
+        try:
+            populate(db, size)
+        finally:
+            db.close()
+        print(f"{size} readings in a {WINDOW_MINUTES}-minute window")
+        legacy = measure(
+            lambda db: TrendInsightService.get_recent_readings(db, "node-001", WINDOW_MINUTES),
+            legacy_detectors,
+            args.repeat,
+        )
+        current = measure(
+            lambda db: TrendInsightService.load_window(db, "node-001", WINDOW_MINUTES),
+            current_detectors,
+            args.repeat,
+        )
+        report("legacy (ORM + lists)", *legacy)
+        report("ReadingWindow (NumPy)", *current)
+        print(f"  speedup {sum(legacy) / sum(current):.1f}x\n")
+
+
+if __name__ == "__main__":
+    main()
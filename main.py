@@ -1,45 +1,123 @@
 """Main FastAPI application entry point."""
 import logging
 from datetime import datetime
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from contextlib import asynccontextmanager
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from models.database import init_db
+import asyncio
+from sqlalchemy.pool import QueuePool
+from models.database import (
+    SQLITE_WAL_CHECKPOINT_INTERVAL_SECONDS, TimedQueuePool, checkpoint_wal, engine, get_sqlite_settings, init_db
+)
+from middleware.request_logging import RequestLoggingMiddleware
 from routes import sensors, insights, ai, gateway
-
-# Configure logging with custom formatter to handle missing gateway_id
-class GatewayIdFormatter(logging.Formatter):
-    """Custom formatter that handles missing gateway_id gracefully."""
-    def format(self, record):
-        # Ensure gateway_id exists in record
-        if not hasattr(record, 'gateway_id'):
-            record.gateway_id = 'unknown'
-        return super().format(record)
-
-# Configure logging
-handler = logging.StreamHandler()
-handler.setFormatter(GatewayIdFormatter(
-    fmt='%(asctime)s - %(name)s - %(levelname)s - [gateway_id=%(gateway_id)s] - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-))
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[handler]
+from services.background import run_periodic, stop_tasks
+from services.http_client import create_gateway_client
+from services.logging_config import configure_logging
+from services.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, callback_metric, db_pool_checkout_seconds,
+    registry as metrics_registry
+)
+from services.gateway_poller import GATEWAY_POLL_ENABLED, gateway_poller
+from services.ingest_queue import INGEST_QUEUE_ENABLED, ingest_queue
+from services.registry import REGISTRY_FLUSH_INTERVAL_SECONDS, flush_registry, load_registry
+from services.shared_state import release_leases, shared_lease
+from services.dedup_index import seed_dedup_index
+from services.latest_snapshot import load_latest_snapshot
+from services.system_stats import seed_system_stats
+from services.rollup_service import plan_rollup_backfill, run_rollup_backfill
+from services.trend_engine import TREND_ENGINE_ENABLED, seed_trend_engine
+from services.trend_insights_service import shutdown_fleet_pool
+from services.insight_scheduler import (
+    INSIGHT_PRECOMPUTE_INTERVAL_SECONDS, insight_scheduler, run_insight_precompute
 )
+from services.retention import (
+    RETENTION_ENABLED, RETENTION_INTERVAL_SECONDS, enable_incremental_vacuum, run_retention
+)
+
+# Configure logging (queue-backed handler, per-route sampling, LOG_FORMAT=text|json)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# Database pool metrics (models/ stays free of service imports)
+TimedQueuePool.checkout_observer = db_pool_checkout_seconds.observe
+if isinstance(engine.pool, QueuePool):
+    callback_metric(
+        "greenhouse_db_pool_checked_out_connections",
+        "Database connections currently checked out of the pool",
+        lambda: engine.pool.checkedout()
+    )
+
+
+# Longest a worker may take to create/migrate the schema and plan the rollup backfill
+# before another worker stops waiting for it
+_STARTUP_LEASE_SECONDS = 600
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown events."""
-    # Startup: Initialize database
-    init_db()
+    # Startup: Initialize database (one worker at a time when workers share state,
+    # so concurrent create_all runs do not collide on a new database)
+    startup_lease = shared_lease("startup", ttl_seconds=_STARTUP_LEASE_SECONDS)
+    await asyncio.to_thread(startup_lease.wait)
+    try:
+        # Only a new (empty) database is switched here, so retention can be enabled
+        # later without a conversion; existing ones are converted offline
+        enable_incremental_vacuum()
+        init_db()
+        # Before this worker ingests anything; the readings are folded in the background
+        plan_rollup_backfill()
+    finally:
+        startup_lease.release()
+    load_registry()
+    seed_dedup_index()
+    load_latest_snapshot()
+    seed_system_stats()
+    if TREND_ENGINE_ENABLED:
+        seed_trend_engine()
+    sqlite_settings = get_sqlite_settings()
+    if sqlite_settings:
+        logger.info("SQLite settings: " + ", ".join(f"{k}={v}" for k, v in sqlite_settings.items()))
     logger.info("Backend online - Database initialized")
+    
+    # Shared HTTP client for gateway requests (keep-alive across polls)
+    app.state.gateway_client = create_gateway_client()
+    
+    # Background tasks (with workers sharing state, retention, the gateway poller
+    # and registry writes run in the worker holding their lease only)
+    if INGEST_QUEUE_ENABLED:
+        await ingest_queue.start()
+    tasks = [
+        asyncio.create_task(run_periodic("registry-flush", REGISTRY_FLUSH_INTERVAL_SECONDS, flush_registry)),
+        asyncio.create_task(run_rollup_backfill()),
+    ]
+    if sqlite_settings.get("journal_mode") == "wal" and SQLITE_WAL_CHECKPOINT_INTERVAL_SECONDS > 0:
+        tasks.append(asyncio.create_task(
+            run_periodic("wal-checkpoint", SQLITE_WAL_CHECKPOINT_INTERVAL_SECONDS, checkpoint_wal)
+        ))
+    if RETENTION_ENABLED:
+        tasks.append(asyncio.create_task(
+            run_periodic("retention", RETENTION_INTERVAL_SECONDS, run_retention, single_instance=True)
+        ))
+    if GATEWAY_POLL_ENABLED:
+        tasks.append(asyncio.create_task(gateway_poller.run(app.state.gateway_client)))
+    if insight_scheduler.enabled:
+        tasks.append(asyncio.create_task(
+            run_periodic("insight-precompute", INSIGHT_PRECOMPUTE_INTERVAL_SECONDS, run_insight_precompute)
+        ))
     yield
-    # Shutdown: Cleanup if needed
+    # Shutdown: Write queued readings, stop background tasks and persist in-memory state
+    await ingest_queue.stop()
+    await stop_tasks(tasks)
+    shutdown_fleet_pool()
+    await app.state.gateway_client.aclose()
+    flush_registry()
+    release_leases()
     logger.info("Backend shutting down")
 
 
@@ -65,50 +143,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Middleware for logging requests with gateway_id
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    """Log all requests with gateway_id and timestamp."""
-    import time
-    start_time = time.time()
-    
-    # Extract gateway_id from query params or body if available
-    gateway_id = request.query_params.get("gateway_id", "unknown")
-    
-    # Try to extract from JSON body for POST requests (non-blocking)
-    if request.method == "POST" and "application/json" in request.headers.get("content-type", ""):
-        try:
-            body = await request.body()
-            if body:
-                import json
-                try:
-                    body_json = json.loads(body)
-                    gateway_id = body_json.get("gatewayId") or body_json.get("gateway_id") or gateway_id
-                except:
-                    pass
-            # Recreate request with body for downstream handlers
-            async def receive():
-                return body
-            request._receive = receive
-        except:
-            pass
-    
-    # Log request
-    logger.info(
-        f"{request.method} {request.url.path}",
-        extra={"gateway_id": gateway_id}
-    )
-    
-    response = await call_next(request)
-    
-    # Log response
-    process_time = time.time() - start_time
-    logger.info(
-        f"{request.method} {request.url.path} - {response.status_code} ({process_time:.3f}s)",
-        extra={"gateway_id": gateway_id}
-    )
-    
-    return response
+# Log every request with its gateway_id (pure ASGI, leaves the body stream alone)
+app.add_middleware(RequestLoggingMiddleware)
 
 # Include routers
 # Note: Routers have their own prefixes defined. For v1, we maintain backward compatibility
@@ -161,6 +197,12 @@ async def health_check():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics: ingest stages, status queries, detectors, gateway probes, DB pool."""
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/status")
 async def status_endpoint():
     """
@@ -7,10 +7,14 @@ This module defines the database schema for the greenhouse monitoring system:
 
 The system is designed to work with both real and simulated data interchangeably.
 """
-from sqlalchemy import create_engine, Column, Integer, Float, DateTime, String, ForeignKey, Boolean, text
+from sqlalchemy import create_engine, event, Column, Integer, Float, DateTime, String, ForeignKey, Boolean, Index, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
+from time import perf_counter
+from typing import Callable, Optional
 import os
 import logging
 
@@ -19,11 +23,118 @@ logger = logging.getLogger(__name__)
 # Database URL - can be overridden by environment variable
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./greenhouse.db")
 
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports how long each checkout waits for a connection.
+    
+    checkout_observer is called with the wait in seconds; it is set by the
+    application (see main.py) and left unset here.
+    """
+    checkout_observer: Optional[Callable[[float], None]] = None
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            observer = TimedQueuePool.checkout_observer
+            if observer is not None:
+                observer(perf_counter() - started)
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:")
+
+
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+    # In-memory SQLite keeps its default single-connection pool
+    poolclass=None if _is_memory_sqlite(DATABASE_URL) else TimedQueuePool
 )
 
+# SQLite pragma profile applied to every new connection (ignored for other databases).
+# WAL lets readers run alongside the ingest writer; synchronous=NORMAL is durable
+# across application crashes in WAL mode and only fsyncs at checkpoints.
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negative = KiB (64 MiB)
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY").upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# How often the WAL is checkpointed into the main database file (0 disables)
+SQLITE_WAL_CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("SQLITE_WAL_CHECKPOINT_INTERVAL_SECONDS", "300"))
+
+_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+_TEMP_STORE_MODES = {"DEFAULT", "FILE", "MEMORY"}
+
+IS_SQLITE = engine.dialect.name == "sqlite"
+
+
+def _sqlite_pragmas() -> list:
+    """Build the pragma statements for the configured SQLite profile."""
+    if SQLITE_JOURNAL_MODE not in _JOURNAL_MODES:
+        raise ValueError(f"Invalid SQLITE_JOURNAL_MODE: {SQLITE_JOURNAL_MODE}")
+    if SQLITE_SYNCHRONOUS not in _SYNCHRONOUS_MODES:
+        raise ValueError(f"Invalid SQLITE_SYNCHRONOUS: {SQLITE_SYNCHRONOUS}")
+    if SQLITE_TEMP_STORE not in _TEMP_STORE_MODES:
+        raise ValueError(f"Invalid SQLITE_TEMP_STORE: {SQLITE_TEMP_STORE}")
+    return [
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA cache_size={SQLITE_CACHE_SIZE}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA temp_store={SQLITE_TEMP_STORE}",
+    ]
+
+
+if IS_SQLITE:
+    _SQLITE_PRAGMAS = _sqlite_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in _SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def get_sqlite_settings() -> dict:
+    """Read back the pragma values active on a pooled connection.
+    
+    Returns:
+        Pragma name -> value, or an empty dict when not using SQLite
+    """
+    if not IS_SQLITE:
+        return {}
+    settings = {}
+    with engine.connect() as conn:
+        for name in ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout"):
+            settings[name] = conn.execute(text(f"PRAGMA {name}")).scalar()
+    # SQLite reports these two as integers
+    settings["synchronous"] = ("OFF", "NORMAL", "FULL", "EXTRA")[settings["synchronous"]]
+    settings["temp_store"] = ("DEFAULT", "FILE", "MEMORY")[settings["temp_store"]]
+    return settings
+
+
+def checkpoint_wal() -> None:
+    """Copy committed WAL frames into the database file without blocking writers.
+    
+    SQLite auto-checkpoints every 1000 pages, but only when a write commits and
+    never past an active reader; a periodic PASSIVE checkpoint keeps the WAL
+    from growing during long read-heavy periods.
+    """
+    if not IS_SQLITE or SQLITE_JOURNAL_MODE != "WAL":
+        return
+    with engine.connect() as conn:
+        busy, log_frames, checkpointed = conn.execute(text("PRAGMA wal_checkpoint(PASSIVE)")).one()
+    logger.debug(f"WAL checkpoint: {checkpointed}/{log_frames} frames checkpointed (busy={busy})")
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -116,11 +227,84 @@ class SensorReading(Base):
     # Relationships
     gateway = relationship("Gateway", back_populates="readings")
     sensor_node = relationship("SensorNode", back_populates="readings")
+    
+    # Per-node time range scans (duplicate checks, history, trends)
+    __table_args__ = (
+        Index("ix_sensor_readings_node_id_timestamp", "node_id", "timestamp"),
+    )
 
     def __repr__(self):
         return f"<SensorReading(id={self.id}, node_id={self.node_id}, temp={self.temperature})>"
 
 
+class SensorRollup(Base):
+    """Pre-aggregated sensor readings per node and time bucket.
+    
+    Maintained incrementally in the same transaction as the raw readings
+    (see services/rollup_service.py) at 1-minute, 1-hour and 1-day
+    resolutions, so aggregate queries (averages, first/last values, chart
+    buckets) read a few rows per bucket instead of every raw reading.
+    """
+    __tablename__ = "sensor_rollups"
+
+    node_id = Column(String, primary_key=True)
+    bucket_seconds = Column(Integer, primary_key=True)  # 60, 3600 or 86400
+    bucket_start = Column(DateTime, primary_key=True)
+    
+    count = Column(Integer, nullable=False)
+    first_ts = Column(DateTime, nullable=False)  # Timestamp of the earliest reading in the bucket
+    last_ts = Column(DateTime, nullable=False)  # Timestamp of the latest reading in the bucket
+    
+    temperature_sum = Column(Float, nullable=False)
+    temperature_min = Column(Float, nullable=False)
+    temperature_max = Column(Float, nullable=False)
+    temperature_first = Column(Float, nullable=False)
+    temperature_last = Column(Float, nullable=False)
+    
+    humidity_sum = Column(Float, nullable=False)
+    humidity_min = Column(Float, nullable=False)
+    humidity_max = Column(Float, nullable=False)
+    humidity_first = Column(Float, nullable=False)
+    humidity_last = Column(Float, nullable=False)
+    
+    soil_moisture_sum = Column(Float, nullable=False)
+    soil_moisture_min = Column(Float, nullable=False)
+    soil_moisture_max = Column(Float, nullable=False)
+    soil_moisture_first = Column(Float, nullable=False)
+    soil_moisture_last = Column(Float, nullable=False)
+    
+    light_level_count = Column(Integer, default=0, nullable=False)  # readings with a light level
+    light_level_sum = Column(Float, nullable=True)
+    light_level_min = Column(Float, nullable=True)
+    light_level_max = Column(Float, nullable=True)
+
+    def __repr__(self):
+        return (
+            f"<SensorRollup(node_id={self.node_id}, bucket_seconds={self.bucket_seconds}, "
+            f"bucket_start={self.bucket_start}, count={self.count})>"
+        )
+
+
+class RollupBackfill(Base):
+    """Progress of folding readings stored before rollups existed into sensor_rollups.
+    
+    A single row, written once at startup: readings with ids up to
+    end_reading_id predate rollup maintenance and are folded in chunks by a
+    background task (see services/rollup_service.py), which advances
+    last_reading_id in the same transaction as each chunk.
+    """
+    __tablename__ = "rollup_backfill"
+
+    id = Column(Integer, primary_key=True)
+    last_reading_id = Column(Integer, nullable=False, default=0)  # highest reading id folded so far
+    end_reading_id = Column(Integer, nullable=False)  # highest reading id to fold
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<RollupBackfill(last_reading_id={self.last_reading_id}, end_reading_id={self.end_reading_id})>"
+
+
 def init_db():
     """Initialize the database by creating all tables and migrating if needed.
     
@@ -128,7 +312,9 @@ def init_db():
     1. Creates all tables if they don't exist
     2. Migrates existing sensor_readings table to add gateway_id and node_id
     3. Adds IP address columns to gateways table (local_ip, client_ip)
-    4. Handles backward compatibility with existing data
+    4. Adds the composite (node_id, timestamp) index to sensor_readings
+       (the sensor_rollups table is created by create_all and backfilled in the background)
+    5. Handles backward compatibility with existing data
     """
     Base.metadata.create_all(bind=engine)
     
@@ -220,6 +406,16 @@ def init_db():
                         conn.commit()
                     except Exception:
                         pass
+            
+            # Composite index for per-node time range queries (created by create_all on new databases)
+            try:
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_sensor_readings_node_id_timestamp "
+                    "ON sensor_readings (node_id, timestamp)"
+                ))
+                conn.commit()
+            except Exception as e:
+                logger.warning(f"Could not create ix_sensor_readings_node_id_timestamp index: {e}")
     
     # Migration: Add IP address columns to gateways table
     with engine.connect() as conn:
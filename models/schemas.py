@@ -1,7 +1,7 @@
 """Pydantic models for request/response validation."""
 from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 
 class SensorDataInput(BaseModel):
@@ -112,6 +112,64 @@ class SensorReadingResponse(BaseModel):
         }
 
 
+class IngestAcceptedResponse(BaseModel):
+    """202 response of POST /api/sensors/data when the reading was queued.
+    
+    The reading is stored by the background writer shortly after; it can be
+    dropped from the gateway buffer once this response is received.
+    """
+    status: str = Field(..., description="Always accepted")
+    node_id: str
+    gateway_id: str
+    timestamp: datetime = Field(..., description="Resolved reading timestamp")
+    queue_depth: int = Field(..., description="Queued readings after this one was added")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": "accepted",
+                "node_id": "node-01",
+                "gateway_id": "gateway-01",
+                "timestamp": "2024-01-15T10:30:00",
+                "queue_depth": 3
+            }
+        }
+
+
+class BatchItemResult(BaseModel):
+    """Per-item result for POST /api/sensors/data/batch."""
+    index: int = Field(..., description="Position of the item in the submitted array")
+    status: str = Field(..., description="created, duplicate, or invalid")
+    id: Optional[int] = Field(None, description="Stored reading ID (existing reading for duplicates)")
+    error: Optional[str] = Field(None, description="Validation error for invalid items")
+
+
+class BatchIngestResponse(BaseModel):
+    """Response model for POST /api/sensors/data/batch endpoint.
+    
+    Every item with status created or duplicate is stored and can be dropped from
+    the gateway buffer. Invalid items will never be accepted and should be dropped too.
+    """
+    results: List[BatchItemResult]
+    created: int = Field(..., description="Number of new readings stored")
+    duplicates: int = Field(..., description="Number of items matching an existing reading")
+    invalid: int = Field(..., description="Number of items that failed validation")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "results": [
+                    {"index": 0, "status": "created", "id": 101, "error": None},
+                    {"index": 1, "status": "duplicate", "id": 87, "error": None},
+                    {"index": 2, "status": "invalid", "id": None, "error": "temperature: Input should be less than or equal to 100"}
+                ],
+                "created": 1,
+                "duplicates": 1,
+                "invalid": 1
+            }
+        }
+
+
 class LatestReadingsResponse(BaseModel):
     """Response model for GET /api/sensors/latest endpoint."""
     readings: List[SensorReadingResponse]
@@ -280,6 +338,61 @@ class HistoryResponse(BaseModel):
         }
 
 
+class HistoryBucket(BaseModel):
+    """Aggregated readings of one node over one time bucket."""
+    node_id: str = Field(..., description="Sensor node identifier")
+    bucket_start: datetime = Field(..., description="Start of the time bucket (UTC)")
+    count: int = Field(..., description="Number of raw readings in the bucket")
+    temperature_min: float
+    temperature_avg: float
+    temperature_max: float
+    humidity_min: float
+    humidity_avg: float
+    humidity_max: float
+    soil_moisture_min: float
+    soil_moisture_avg: float
+    soil_moisture_max: float
+    light_level_min: Optional[float] = None
+    light_level_avg: Optional[float] = None
+    light_level_max: Optional[float] = None
+
+
+class BucketedHistoryResponse(BaseModel):
+    """Response model for GET /api/sensors/history with resolution/max_points."""
+    buckets: List[HistoryBucket]
+    count: int
+    hours: int = Field(..., description="Number of hours of history requested")
+    resolution_seconds: int = Field(..., description="Width of each time bucket in seconds")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "buckets": [
+                    {
+                        "node_id": "node-01",
+                        "bucket_start": "2024-01-15T10:30:00",
+                        "count": 12,
+                        "temperature_min": 25.1,
+                        "temperature_avg": 25.5,
+                        "temperature_max": 25.9,
+                        "humidity_min": 64.0,
+                        "humidity_avg": 65.0,
+                        "humidity_max": 66.2,
+                        "soil_moisture_min": 44.8,
+                        "soil_moisture_avg": 45.0,
+                        "soil_moisture_max": 45.3,
+                        "light_level_min": None,
+                        "light_level_avg": None,
+                        "light_level_max": None
+                    }
+                ],
+                "count": 1,
+                "hours": 24,
+                "resolution_seconds": 300
+            }
+        }
+
+
 class NodeMetrics(BaseModel):
     """Metrics model for node insights."""
     avg_temp_24h: Optional[float] = Field(None, description="Average temperature over last 24 hours (°C)")
@@ -297,6 +410,7 @@ class NodeInsightsResponse(BaseModel):
     risk_level: str = Field(..., description="Overall risk level: low, medium, or high")
     recommendations: List[str] = Field(..., description="List of actionable recommendations")
     metrics: NodeMetrics = Field(..., description="Calculated historical metrics")
+    computed_at: Optional[datetime] = Field(None, description="When the analysis was computed (UTC)")
 
     class Config:
         json_schema_extra = {
@@ -348,6 +462,7 @@ class TrendInsightsResponse(BaseModel):
     analysis_period_minutes: int = Field(..., description="Number of minutes of data analyzed")
     readings_analyzed: int = Field(..., description="Number of sensor readings analyzed")
     node_id: Optional[str] = Field(None, description="Node ID if filtered to specific node")
+    computed_at: Optional[datetime] = Field(None, description="When the analysis was computed (UTC)")
 
     class Config:
         json_schema_extra = {
@@ -373,3 +488,13 @@ class TrendInsightsResponse(BaseModel):
                 "node_id": "node-01"
             }
         }
+
+
+class FleetInsightsResponse(BaseModel):
+    """Response model for GET /api/ai/fleet/insights endpoint."""
+    nodes: Dict[str, TrendInsightsResponse] = Field(..., description="Trend analysis per node ID")
+    node_count: int = Field(..., description="Number of nodes analyzed")
+    overall_risk_level: str = Field(..., description="Highest risk level across all nodes: LOW, MEDIUM, or HIGH")
+    analysis_period_minutes: int = Field(..., description="Number of minutes of data analyzed per node")
+    readings_analyzed: int = Field(..., description="Number of sensor readings analyzed across all nodes")
+    computed_at: Optional[datetime] = Field(None, description="When the analysis was computed (UTC)")
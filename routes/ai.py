@@ -4,15 +4,33 @@ from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import List, Optional
 from models.database import get_db
-from models.schemas import AIInsightsResponse, NodeInsightsResponse, TrendInsightsResponse, InsightDetail
+from models.schemas import (
+    AIInsightsResponse, FleetInsightsResponse, NodeInsightsResponse, TrendInsightsResponse, InsightDetail
+)
 from services.sensor_service import SensorService
 from services.ai_insights import AIInsightsService
-from services.trend_insights_service import TrendInsightService
+from services.insight_cache import insight_cache
+from services.insight_scheduler import NODE_INSIGHTS, TREND_INSIGHTS, insight_scheduler
+from services.trend_insights_service import RiskLevel, TrendInsightService
 from ai.ai_insights_analyzer import AIInsightsAnalyzer
 
 router = APIRouter(prefix="/api/ai", tags=["ai"])
 
 
+def _trend_response(analysis_result: dict, computed_at: datetime) -> TrendInsightsResponse:
+    """Convert a TrendInsightService analysis result to its response model."""
+    return TrendInsightsResponse(
+        # Convert insight dictionaries to InsightDetail models
+        insights=[InsightDetail(**insight) for insight in analysis_result["insights"]],
+        overall_risk_level=analysis_result["overall_risk_level"],
+        summary=analysis_result["summary"],
+        analysis_period_minutes=analysis_result["analysis_period_minutes"],
+        readings_analyzed=analysis_result["readings_analyzed"],
+        node_id=analysis_result["node_id"],
+        computed_at=computed_at
+    )
+
+
 @router.get("/insights", response_model=TrendInsightsResponse)
 async def get_ai_insights(
     node_id: Optional[str] = Query(None, description="Filter insights for specific node ID"),
@@ -65,32 +83,98 @@ async def get_ai_insights(
     
     **Note:** This is a rule-based system designed to be ML-ready. The analysis logic can be 
     replaced with machine learning models while maintaining the same API interface.
+    
+    Node-filtered results for precomputed window lengths are served from the background
+    scheduler's latest snapshot; `computed_at` tells when it was computed.
     """
-    try:
+    if node_id and insight_scheduler.enabled:
+        # Latest snapshot from the background scheduler, if this window is precomputed
+        snapshot = insight_scheduler.get(TREND_INSIGHTS, node_id, minutes)
+        if snapshot is not None:
+            return _trend_response(*snapshot)
+    
+    def compute():
         # Use comprehensive trend analysis service
         analysis_result = TrendInsightService.analyze_trends(
             db=db,
             node_id=node_id,
             minutes=minutes
         )
+        return _trend_response(analysis_result, datetime.utcnow())
+    
+    try:
+        return await insight_cache.get_or_compute(("insights", node_id, minutes), node_id, compute)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating AI insights: {str(e)}"
+        )
+
+
+@router.get("/fleet/insights", response_model=FleetInsightsResponse)
+async def get_fleet_insights(
+    minutes: int = Query(60, ge=5, le=1440, description="Number of minutes of data to analyze per node (5-1440, default: 60)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Get trend insights for every node in one response.
+    
+    Runs the same detectors as `GET /api/ai/insights?node_id=` on each node's own
+    window, so rates are never computed across a mix of nodes. All windows are
+    loaded with a single query (or served from the in-memory trend engine),
+    replacing one request per node.
+    
+    Nodes known to the registry but without readings in the window are included
+    and reported by the sensor failure detector (`no_data`).
+    
+    **Example Response:**
+    ```json
+    {
+        "nodes": {
+            "node-01": {
+                "insights": [],
+                "overall_risk_level": "LOW",
+                "summary": "All systems operating normally. No significant risks detected in the analyzed period.",
+                "analysis_period_minutes": 60,
+                "readings_analyzed": 12,
+                "node_id": "node-01"
+            }
+        },
+        "node_count": 1,
+        "overall_risk_level": "LOW",
+        "analysis_period_minutes": 60,
+        "readings_analyzed": 12
+    }
+    ```
+    """
+    def compute():
+        results = TrendInsightService.analyze_fleet(db, minutes)
         
-        # Convert insight dictionaries to InsightDetail models
-        insight_details = [
-            InsightDetail(**insight) for insight in analysis_result["insights"]
-        ]
+        computed_at = datetime.utcnow()
+        nodes = {node_id: _trend_response(result, computed_at) for node_id, result in results.items()}
         
-        return TrendInsightsResponse(
-            insights=insight_details,
-            overall_risk_level=analysis_result["overall_risk_level"],
-            summary=analysis_result["summary"],
-            analysis_period_minutes=analysis_result["analysis_period_minutes"],
-            readings_analyzed=analysis_result["readings_analyzed"],
-            node_id=analysis_result["node_id"]
+        risk_levels = {result["overall_risk_level"] for result in results.values()}
+        overall_risk_level = RiskLevel.LOW.value
+        if RiskLevel.HIGH.value in risk_levels:
+            overall_risk_level = RiskLevel.HIGH.value
+        elif RiskLevel.MEDIUM.value in risk_levels:
+            overall_risk_level = RiskLevel.MEDIUM.value
+        
+        return FleetInsightsResponse(
+            nodes=nodes,
+            node_count=len(nodes),
+            overall_risk_level=overall_risk_level,
+            analysis_period_minutes=minutes,
+            readings_analyzed=sum(result["readings_analyzed"] for result in results.values()),
+            computed_at=computed_at
         )
+    
+    try:
+        return await insight_cache.get_or_compute(("fleet_insights", None, minutes), None, compute)
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Error generating AI insights: {str(e)}"
+            detail=f"Error generating fleet insights: {str(e)}"
         )
 
 
@@ -147,16 +231,51 @@ async def get_node_insights(
     - Returns appropriate message if node has no data
     - Returns message if insufficient data for analysis (< 24 hours)
     - All metrics are optional and will be null if insufficient data
+    
+    Results are served from the background scheduler's latest snapshot when available;
+    `computed_at` tells when the analysis was computed.
     """
-    try:
+    if insight_scheduler.enabled:
+        # Latest snapshot from the background scheduler
+        snapshot = insight_scheduler.get(NODE_INSIGHTS, node_id)
+        if snapshot is not None:
+            analysis_result, computed_at = snapshot
+            return NodeInsightsResponse(**analysis_result, computed_at=computed_at)
+    
+    def compute():
         # Perform analysis
         analysis_result = AIInsightsService.analyze_node(db, node_id)
         
         # Convert to response model
-        return NodeInsightsResponse(**analysis_result)
+        return NodeInsightsResponse(**analysis_result, computed_at=datetime.utcnow())
+    
+    try:
+        return await insight_cache.get_or_compute(("node_insights", node_id, None), node_id, compute)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error generating node insights: {str(e)}"
         )
 
+
+@router.get("/cache/stats")
+async def get_insight_cache_stats():
+    """
+    Get hit/miss counters and size of the AI insight result cache.
+    
+    Responses of `/api/ai/insights`, `/api/ai/insights/{node_id}` and
+    `/api/ai/fleet/insights` are cached until a reading for the node is
+    ingested or the TTL expires.
+    """
+    return insight_cache.stats()
+
+
+@router.get("/precompute/stats")
+async def get_insight_precompute_stats():
+    """
+    Get the state of the background insight precomputation scheduler.
+    
+    Includes the configured interval and concurrency, number of stored
+    snapshots and pending (dirty) nodes, and run counts and durations.
+    """
+    return insight_scheduler.stats()
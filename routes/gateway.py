@@ -1,19 +1,20 @@
 """API routes for gateway endpoints."""
+import httpx
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 from typing import Optional, List
-from datetime import datetime
 from models.database import get_db
 from services.gateway_service import GatewayService
+from services.gateway_poller import gateway_poller
+from services.gateway_state import gateway_status_cache, merge_gateway_status, remember_gateway_ip
+from services.shared_state import run_shared
+from services.http_client import gateway_client_stats, get_gateway_client
 from pydantic import BaseModel
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/gateway", tags=["gateway"])
 
-# In-memory cache for gateway status (active node count, network mode, etc.)
-# Key: gateway_id, Value: dict with status info
-_gateway_status_cache: dict[str, dict] = {}
 
 
 @router.get("/status")
@@ -63,8 +64,8 @@ async def get_gateway_status(
             )
         
         # Add cached status info if available
-        if gateway_id in _gateway_status_cache:
-            cached = _gateway_status_cache[gateway_id]
+        cached = await run_shared(gateway_status_cache.get, gateway_id)
+        if cached is not None:
             status["active_node_count"] = cached.get("active_node_count", 0)
             status["network_mode"] = cached.get("network_mode", "UNKNOWN")
         
@@ -112,31 +113,27 @@ async def update_gateway_status(
         client_ip = request.client.host if request.client else None
         
         # Update gateway with IP addresses
-        GatewayService.register_or_update_gateway(
-            db, 
-            gateway_id,
-            local_ip=local_ip,
-            client_ip=client_ip
-        )
+        GatewayService.touch_gateway(db, gateway_id, local_ip=local_ip, client_ip=client_ip)
+        db.commit()
         
         # Update cache with local IP if provided
         if local_ip and local_ip != "0.0.0.0":
-            _esp32_ip_cache[gateway_id] = local_ip
-            logger.info(f"Gateway {gateway_id} local IP updated: {local_ip}")
+            await remember_gateway_ip(gateway_id, local_ip)
+            logger.info("Gateway %s local IP updated: %s", gateway_id, local_ip)
         
-        # Cache the gateway status
-        _gateway_status_cache[gateway_id] = {
-            "active_node_count": data.get("activeNodeCount", 0),
-            "network_mode": data.get("networkMode", "UNKNOWN"),
-            "backend_reachable": data.get("backendReachable", False),
-            "last_updated": datetime.utcnow().isoformat()
-        }
+        # Cache the gateway status (merged with the poller's fields)
+        await run_shared(
+            merge_gateway_status,
+            gateway_id,
+            active_node_count=data.get("activeNodeCount", 0),
+            network_mode=data.get("networkMode", "UNKNOWN"),
+            backend_reachable=data.get("backendReachable", False)
+        )
         
         logger.info(
-            f"Gateway status updated: {gateway_id}, "
-            f"active_nodes={data.get('activeNodeCount', 0)}, "
-            f"mode={data.get('networkMode', 'UNKNOWN')}, "
-            f"local_ip={local_ip or 'not provided'}"
+            "Gateway status updated: %s, active_nodes=%s, mode=%s, local_ip=%s",
+            gateway_id, data.get("activeNodeCount", 0), data.get("networkMode", "UNKNOWN"),
+            local_ip or "not provided"
         )
         
         return {
@@ -165,13 +162,14 @@ async def list_gateways(db: Session = Depends(get_db)):
     try:
         gateways = GatewayService.get_all_gateways(db)
         
+        statuses = await run_shared(gateway_status_cache.snapshot)
         result = []
         for gateway in gateways:
             status = GatewayService.get_gateway_status(db, gateway.gateway_id)
             if status:
                 # Add cached status info if available
-                if gateway.gateway_id in _gateway_status_cache:
-                    cached = _gateway_status_cache[gateway.gateway_id]
+                if gateway.gateway_id in statuses:
+                    cached = statuses[gateway.gateway_id]
                     status["active_node_count"] = cached.get("active_node_count", 0)
                     status["network_mode"] = cached.get("network_mode", "UNKNOWN")
                 result.append(status)
@@ -186,3 +184,14 @@ async def list_gateways(db: Session = Depends(get_db)):
             detail=f"Error listing gateways: {str(e)}"
         )
 
+
+@router.get("/http/stats")
+async def get_gateway_http_stats(client: httpx.AsyncClient = Depends(get_gateway_client)):
+    """
+    Get the shared gateway HTTP client's pool limits and per-host connection reuse.
+    
+    For each gateway host: requests sent, new TCP connections opened, requests
+    served on a kept-alive connection and the resulting reuse ratio. `polling`
+    shows each gateway's consecutive poll failures and time to its next poll.
+    """
+    return {**gateway_client_stats(client), "polling": gateway_poller.stats()}
@@ -45,7 +45,7 @@ async def get_insights(db: Session = Depends(get_db)):
     """
     try:
         # Get latest reading from each sensor
-        latest_readings = SensorService.get_latest_per_sensor(db)
+        latest_readings = SensorService.get_latest_per_node(db)
         
         if not latest_readings:
             raise HTTPException(
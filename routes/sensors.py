@@ -1,26 +1,41 @@
 """API routes for sensor data endpoints."""
-import asyncio
+import csv
+import io
+import json
 import logging
-import httpx
-from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Any, Dict, List, Optional, Union
 from datetime import datetime, timedelta
+from time import perf_counter
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-from models.database import get_db
+from models.database import SessionLocal, get_db
 from models.schemas import (
     SensorDataInput,
     SensorReadingResponse,
     LatestReadingsResponse,
     LatestReadingResponse,
     SystemStatusResponse,
-    HistoryResponse
+    HistoryResponse,
+    BucketedHistoryResponse,
+    BatchItemResult,
+    BatchIngestResponse,
+    IngestAcceptedResponse
 )
-from services.sensor_service import SensorService
+from services.sensor_service import SensorService, DUPLICATE_WINDOW_SECONDS, HISTORY_COLUMNS
 from services.gateway_service import GatewayService
-from services.system_stats import get_system_stats, increment_message_count, fetch_gateway_active_nodes
-from routes.gateway import _gateway_status_cache
+from services.gateway_poller import gateway_poller
+from services.gateway_probe import clear_unreachable
+from services.gateway_state import get_active_node_count, get_network_status, remember_gateway_ip
+from services.shared_state import run_shared
+from services.system_stats import get_system_stats
+from services.ingest_queue import ingest_queue, IngestQueueFull, INGEST_RETRY_AFTER_SECONDS
+from services.retention import retention_stats
+from services.metrics import ingest_readings_total, ingest_stage_seconds
 
 logger = logging.getLogger(__name__)
 # Router with both v1 and legacy support
@@ -28,12 +43,31 @@ router = APIRouter(prefix="/api/sensors", tags=["sensors"])
 # Note: V1 API uses /api/v1/sensors (can be added separately if needed)
 limiter = Limiter(key_func=get_remote_address)
 
-# Simple in-memory cache to store ESP32 IP addresses by gateway_id
-# This is updated when ESP32 sends sensor data
-_esp32_ip_cache: dict[str, str] = {}
+# Rows encoded per chunk of a streamed history export
+HISTORY_STREAM_CHUNK_ROWS = 500
 
+# Seconds per unit suffix accepted by the history `resolution` parameter
+_RESOLUTION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
 
-@router.post("/data", response_model=SensorReadingResponse, status_code=201)
+# Maximum number of readings accepted by POST /data/batch
+MAX_BATCH_SIZE = 500
+
+# Ingest metric series, bound once
+_VALIDATION_STAGE = ingest_stage_seconds.labels("validation")
+_DEDUP_STAGE = ingest_stage_seconds.labels("dedup")
+_INVALID_READINGS = ingest_readings_total.labels("invalid")
+_DUPLICATE_READINGS = ingest_readings_total.labels("duplicate")
+
+
+@router.post(
+    "/data",
+    response_model=SensorReadingResponse,
+    status_code=201,
+    responses={
+        202: {"model": IngestAcceptedResponse, "description": "Reading queued for the background writer"},
+        503: {"description": "Ingest queue is full; retry after the Retry-After header"}
+    }
+)
 @limiter.limit("100/minute")  # Rate limit: 100 requests per minute per IP
 async def receive_sensor_data(
     request: Request,
@@ -46,6 +80,13 @@ async def receive_sensor_data(
     This endpoint accepts sensor readings from ESP32 devices and stores them in the database.
     Handles duplicate and late data gracefully.
     
+    With the ingest queue enabled (default) the reading is validated, queued and
+    acknowledged with **202 Accepted**; a background writer stores it within
+    milliseconds. If the queue is full the endpoint returns **503** with a
+    `Retry-After` header and the gateway should keep the reading buffered.
+    With `INGEST_QUEUE_ENABLED=false` the reading is stored before responding
+    (201, response below).
+    
     **Example Request:**
     ```json
     {
@@ -57,7 +98,18 @@ async def receive_sensor_data(
     }
     ```
     
-    **Example Response:**
+    **Example Response (202, queued):**
+    ```json
+    {
+        "status": "accepted",
+        "node_id": "ESP32_001",
+        "gateway_id": "gateway-01",
+        "timestamp": "2024-01-15T10:30:00",
+        "queue_depth": 3
+    }
+    ```
+    
+    **Example Response (201, synchronous):**
     ```json
     {
         "id": 1,
@@ -80,24 +132,20 @@ async def receive_sensor_data(
     
     # Store ESP32's actual local IP (source of truth)
     if local_ip and local_ip != "0.0.0.0":
-        _esp32_ip_cache[gateway_id] = local_ip
-        logger.info(f"ESP32 {gateway_id} reports local IP: {local_ip} (backend sees client IP: {client_ip})")
+        await remember_gateway_ip(gateway_id, local_ip)
+        # The gateway is evidently up at this address again
+        clear_unreachable(local_ip)
+        logger.info("ESP32 %s reports local IP: %s (backend sees client IP: %s)", gateway_id, local_ip, client_ip)
     elif client_ip:
         # Fallback: use client IP if ESP32 didn't send local_ip (legacy support)
-        _esp32_ip_cache[gateway_id] = client_ip
+        await remember_gateway_ip(gateway_id, client_ip)
         logger.warning(f"ESP32 {gateway_id} didn't send local_ip, using client IP: {client_ip}")
     
     try:
-        # Register/update gateway with IP addresses
-        GatewayService.register_or_update_gateway(
-            db, 
-            gateway_id,
-            local_ip=local_ip,
-            client_ip=client_ip
-        )
-        
+        started = perf_counter()
         # Strict validation of sensor payload
         if sensor_data.temperature < -50 or sensor_data.temperature > 100:
+            _INVALID_READINGS.inc()
             logger.warning(
                 f"Invalid temperature: {sensor_data.temperature}",
                 extra={"gateway_id": gateway_id, "node_id": node_id}
@@ -108,6 +156,7 @@ async def receive_sensor_data(
             )
         
         if sensor_data.humidity < 0 or sensor_data.humidity > 100:
+            _INVALID_READINGS.inc()
             logger.warning(
                 f"Invalid humidity: {sensor_data.humidity}",
                 extra={"gateway_id": gateway_id, "node_id": node_id}
@@ -118,50 +167,64 @@ async def receive_sensor_data(
             )
         
         # Check for duplicate/late data
-        reading_timestamp = datetime.utcnow()
-        if sensor_data.timestamp:
+        reading_timestamp = SensorService.resolve_timestamp(sensor_data)
+        started = _VALIDATION_STAGE.observe_since(started)
+        
+        # Queue for the background writer (duplicates are detected when the batch is written)
+        if ingest_queue.is_running:
             try:
-                reading_timestamp = datetime.fromtimestamp(sensor_data.timestamp)
-                # Check if data is too old (more than 24 hours)
-                age = datetime.utcnow() - reading_timestamp
-                if age > timedelta(hours=24):
-                    logger.warning(
-                        f"Late data received: {age.total_seconds() / 3600:.1f} hours old",
-                        extra={"gateway_id": gateway_id, "node_id": node_id}
-                    )
-                    # Still accept it but log warning
-                elif age < timedelta(seconds=-60):
-                    logger.warning(
-                        f"Future timestamp detected: {abs(age.total_seconds())} seconds in future",
-                        extra={"gateway_id": gateway_id, "node_id": node_id}
-                    )
-                    # Use current time instead
-                    reading_timestamp = datetime.utcnow()
-            except (ValueError, OSError) as e:
+                queue_depth = ingest_queue.submit(sensor_data, reading_timestamp, client_ip)
+            except IngestQueueFull:
                 logger.warning(
-                    f"Invalid timestamp: {sensor_data.timestamp}, using current time",
+                    f"Ingest queue full ({ingest_queue.depth} readings), rejecting reading",
                     extra={"gateway_id": gateway_id, "node_id": node_id}
                 )
-                reading_timestamp = datetime.utcnow()
+                raise HTTPException(
+                    status_code=503,
+                    detail="Ingest queue is full, retry later",
+                    headers={"Retry-After": str(INGEST_RETRY_AFTER_SECONDS)}
+                )
+            logger.info(
+                "Sensor data queued: node_id=%s, temp=%.1f°C, humidity=%.1f%%, timestamp=%s",
+                node_id, sensor_data.temperature, sensor_data.humidity, reading_timestamp,
+                extra={"gateway_id": gateway_id, "node_id": node_id}
+            )
+            accepted = IngestAcceptedResponse(
+                status="accepted",
+                node_id=node_id,
+                gateway_id=gateway_id,
+                timestamp=reading_timestamp,
+                queue_depth=queue_depth
+            )
+            return JSONResponse(status_code=202, content=accepted.model_dump(mode="json"))
         
         # Check for duplicate (same node_id, similar timestamp within 5 seconds)
         recent_reading = SensorService.check_duplicate(
-            db, node_id, gateway_id, reading_timestamp, window_seconds=5
+            db, node_id, gateway_id, reading_timestamp, window_seconds=DUPLICATE_WINDOW_SECONDS
         )
+        _DEDUP_STAGE.observe_since(started)
         if recent_reading:
+            _DUPLICATE_READINGS.inc()
             logger.info(
-                f"Duplicate data detected (within 5s window), returning existing reading",
+                "Duplicate data detected (within 5s window), returning existing reading",
                 extra={"gateway_id": gateway_id, "node_id": node_id}
             )
+            # The gateway is still alive, so keep its last_seen/IPs current
+            GatewayService.touch_gateway(db, gateway_id, local_ip=local_ip, client_ip=client_ip)
+            db.commit()
             return SensorReadingResponse.model_validate(recent_reading)
         
-        # Create new reading
-        reading = SensorService.create_reading(db, sensor_data)
-        increment_message_count()
-        
+        # Register gateway/node and store the reading in one transaction
+        reading = SensorService.create_reading(
+            db,
+            sensor_data,
+            reading_timestamp=reading_timestamp,
+            local_ip=local_ip,
+            client_ip=client_ip
+        )
         logger.info(
-            f"Sensor data received: node_id={node_id}, temp={sensor_data.temperature:.1f}°C, "
-            f"humidity={sensor_data.humidity:.1f}%, timestamp={reading_timestamp.isoformat()}",
+            "Sensor data received: node_id=%s, temp=%.1f°C, humidity=%.1f%%, timestamp=%s",
+            node_id, sensor_data.temperature, sensor_data.humidity, reading_timestamp,
             extra={"gateway_id": gateway_id, "node_id": node_id}
         )
         
@@ -177,6 +240,180 @@ async def receive_sensor_data(
         raise HTTPException(status_code=500, detail=f"Error storing sensor data: {str(e)}")
 
 
+@router.post("/data/batch", response_model=BatchIngestResponse)
+@limiter.limit("60/minute")
+async def receive_sensor_data_batch(
+    request: Request,
+    payload: List[Any] = Body(..., description="Array of sensor data payloads"),
+    db: Session = Depends(get_db)
+):
+    """
+    Receive a batch of buffered sensor readings from an ESP32 gateway.
+    
+    Gateways that buffered readings while offline can replay them in one request
+    instead of one POST per reading. Each item uses the same format as
+    `POST /api/sensors/data`. Items are validated individually, checked for
+    duplicates with a single range query and stored in one transaction.
+    
+    **Item status values:**
+    - `created`: Reading stored (`id` is the new reading)
+    - `duplicate`: A reading within 5 seconds already exists (`id` is the existing reading)
+    - `invalid`: Item failed validation or is not a JSON object (`error` explains why)
+    
+    All three statuses mean the item can be dropped from the gateway buffer.
+    The whole request fails with 5xx if the batch could not be stored.
+    
+    **Example Request:**
+    ```json
+    [
+        {"nodeId": "node-01", "gatewayId": "gateway-01", "temperature": 25.5,
+         "humidity": 65.0, "soilMoisture": 45.0, "timestamp": 1705314600},
+        {"nodeId": "node-02", "gatewayId": "gateway-01", "temperature": 24.9,
+         "humidity": 63.0, "soilMoisture": 51.0, "timestamp": 1705314605}
+    ]
+    ```
+    """
+    if len(payload) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(payload)} items (maximum {MAX_BATCH_SIZE})"
+        )
+    
+    client_ip = request.client.host if request.client else None
+    results: List[Optional[BatchItemResult]] = [None] * len(payload)
+    valid_items = []
+    valid_positions = []
+    local_ips: Dict[str, str] = {}
+    
+    # Validate all items up front so one bad reading doesn't reject the batch
+    started = perf_counter()
+    for position, raw_item in enumerate(payload):
+        if not isinstance(raw_item, dict):
+            results[position] = BatchItemResult(index=position, status="invalid", error="body: Item must be a JSON object")
+            continue
+        try:
+            sensor_data = SensorDataInput.model_validate(raw_item)
+        except ValidationError as e:
+            error = "; ".join(
+                f"{'.'.join(str(part) for part in err['loc']) or 'body'}: {err['msg']}"
+                for err in e.errors()
+            )
+            results[position] = BatchItemResult(index=position, status="invalid", error=error)
+            continue
+        valid_items.append((sensor_data, SensorService.resolve_timestamp(sensor_data)))
+        valid_positions.append(position)
+        local_ip = sensor_data.get_local_ip()
+        if local_ip and local_ip != "0.0.0.0":
+            local_ips[sensor_data.get_gateway_id()] = local_ip
+    _VALIDATION_STAGE.observe_since(started)
+    _INVALID_READINGS.inc(len(payload) - len(valid_items))
+    
+    gateway_ids = {sensor_data.get_gateway_id() for sensor_data, _ in valid_items}
+    for gateway_id in gateway_ids:
+        if gateway_id in local_ips:
+            await remember_gateway_ip(gateway_id, local_ips[gateway_id])
+            clear_unreachable(local_ips[gateway_id])
+        elif client_ip:
+            await remember_gateway_ip(gateway_id, client_ip)
+    
+    try:
+        # Run the transaction in a worker thread so the event loop keeps serving requests
+        outcomes = await run_in_threadpool(
+            SensorService.create_readings_batch,
+            db,
+            valid_items,
+            local_ips=local_ips,
+            client_ip=client_ip
+        )
+    except Exception as e:
+        db.rollback()
+        logger.error(
+            f"Error storing sensor data batch: {str(e)}",
+            extra={"gateway_id": ",".join(sorted(gateway_ids)) or "unknown"},
+            exc_info=True
+        )
+        raise HTTPException(status_code=500, detail=f"Error storing sensor data batch: {str(e)}")
+    
+    for position, (status, reading_id) in zip(valid_positions, outcomes):
+        results[position] = BatchItemResult(index=position, status=status, id=reading_id)
+    
+    created = sum(1 for r in results if r.status == "created")
+    duplicates = sum(1 for r in results if r.status == "duplicate")
+    invalid = len(results) - created - duplicates
+    
+    logger.info(
+        "Sensor data batch received: %d items, %d created, %d duplicates, %d invalid",
+        len(payload), created, duplicates, invalid,
+        extra={"gateway_id": ",".join(sorted(gateway_ids)) or "unknown"}
+    )
+    
+    return BatchIngestResponse(
+        results=results,
+        created=created,
+        duplicates=duplicates,
+        invalid=invalid
+    )
+
+
+@router.get("/retention/stats")
+async def get_retention_stats():
+    """
+    Get the data retention policy and the result of its last run.
+    
+    **Example Response:**
+    ```json
+    {
+        "enabled": true,
+        "raw_days": 14,
+        "minute_rollup_days": 365,
+        "hourly_rollup_days": 0,
+        "interval_seconds": 3600,
+        "last_run": {
+            "finished_at": "2024-01-15T10:30:00",
+            "duration_seconds": 0.84,
+            "raw_rows_removed": 17280,
+            "minute_rollups_removed": 0,
+            "hourly_rollups_removed": 0,
+            "bytes_reclaimed": 1626112
+        }
+    }
+    ```
+    """
+    return retention_stats()
+
+
+@router.get("/ingest/stats")
+async def get_ingest_stats():
+    """
+    Get ingest queue metrics.
+    
+    Returns queue depth and capacity, counters for queued, rejected (503),
+    written and duplicate readings, write retries, readings spilled to
+    INGEST_SPILL_PATH, and writer flush latency.
+    
+    **Example Response:**
+    ```json
+    {
+        "enabled": true,
+        "queue_depth": 0,
+        "queue_max_size": 10000,
+        "enqueued_total": 1520,
+        "rejected_total": 0,
+        "written_total": 1498,
+        "duplicates_total": 22,
+        "retries_total": 0,
+        "spilled_total": 0,
+        "batches_total": 310,
+        "last_batch_size": 4,
+        "last_flush_ms": 3.412,
+        "avg_flush_ms": 4.105,
+        "max_flush_ms": 48.221
+    }
+    ```
+    """
+    return ingest_queue.stats()
+
+
 @router.head("/data")
 async def check_connectivity():
     """
@@ -265,6 +502,8 @@ async def get_system_status(db: Session = Depends(get_db)):
     
     Returns backend status, last data received time, total messages,
     active nodes count (synced with gateway if available), and system uptime.
+    The gateway's node count comes from the gateway status cache, so this
+    endpoint never waits on a gateway.
     
     **Example Response:**
     ```json
@@ -280,55 +519,82 @@ async def get_system_status(db: Session = Depends(get_db)):
     try:
         stats = get_system_stats(db)
         
-        # First, try to get active nodes from gateway status cache (sent by gateway via POST /api/gateway/status)
-        gateway_id = None
-        if _esp32_ip_cache:
-            gateway_id = list(_esp32_ip_cache.keys())[0]
-        
-        # Check gateway status cache first (most reliable - sent by gateway)
-        if gateway_id and gateway_id in _gateway_status_cache:
-            cached_status = _gateway_status_cache[gateway_id]
-            cached_active_nodes = cached_status.get("active_node_count")
-            if cached_active_nodes is not None:
-                stats["nodes_active"] = cached_active_nodes
-                logger.info(
-                    f"Using cached gateway active nodes count from gateway status: {cached_active_nodes} "
-                    f"(gateway_id={gateway_id}, cache={_gateway_status_cache})"
-                )
-                return SystemStatusResponse(**stats)
-        
-        # Fallback: Try to fetch active nodes from gateway directly (if cache not available)
-        gateway_ip = None
-        if gateway_id:
-            gateway_ip = _esp32_ip_cache.get(gateway_id)
-        
-        # Fetch active nodes from gateway if available (non-blocking, fast timeout)
-        # Use asyncio.wait_for with short timeout to avoid blocking the response
-        try:
-            gateway_active_nodes = await asyncio.wait_for(
-                fetch_gateway_active_nodes(gateway_ip),
-                timeout=0.5  # Very short timeout - don't block if gateway unreachable
+        # Active nodes from the gateway status cache: pushed by the gateway via
+        # POST /api/gateway/status or refreshed by the background gateway poller.
+        # The gateway itself is never called from this handler.
+        cached = await run_shared(get_active_node_count)
+        if cached is not None:
+            gateway_id, cached_active_nodes = cached
+            stats["nodes_active"] = cached_active_nodes
+            logger.info(
+                "Using cached gateway active nodes count from gateway status: %s (gateway_id=%s)",
+                cached_active_nodes, gateway_id
             )
-            if gateway_active_nodes is not None:
-                stats["nodes_active"] = gateway_active_nodes
-                logger.info(f"Using gateway active nodes count from direct fetch: {gateway_active_nodes}")
-        except asyncio.TimeoutError:
-            # Gateway not reachable quickly, use database count (already set in stats)
-            logger.debug("Gateway fetch timed out, using database node count")
-        except Exception as e:
-            # Gateway fetch failed, use database count (already set in stats)
-            logger.debug(f"Gateway fetch failed: {str(e)}, using database node count")
         
         return SystemStatusResponse(**stats)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching system status: {str(e)}")
 
 
-@router.get("/history", response_model=HistoryResponse)
+def _stream_history(export_format: str, hours: int, node_id: Optional[str], gateway_id: Optional[str]):
+    """Encode history rows as NDJSON or CSV chunks.
+    
+    Runs in the threadpool while the response is streamed. It opens its own
+    session because the request's session is closed before streaming starts.
+    """
+    timestamp_index = HISTORY_COLUMNS.index("timestamp")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n") if export_format == "csv" else None
+    if writer:
+        writer.writerow(HISTORY_COLUMNS)
+    
+    db = SessionLocal()
+    try:
+        rows = 0
+        for row in SensorService.iter_history_rows(db, hours=hours, node_id=node_id, gateway_id=gateway_id):
+            row = list(row)
+            row[timestamp_index] = row[timestamp_index].isoformat()
+            if writer:
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(dict(zip(HISTORY_COLUMNS, row))))
+                buffer.write("\n")
+            rows += 1
+            if rows % HISTORY_STREAM_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    except Exception as e:
+        # Headers are already sent; the client sees a truncated body
+        logger.error(f"Error streaming history export: {str(e)}", exc_info=True)
+        raise
+    finally:
+        db.close()
+
+
+def _parse_resolution(resolution: str) -> int:
+    """Convert a resolution such as "300", "5m" or "1h" to seconds."""
+    unit = resolution[-1]
+    if unit in _RESOLUTION_UNITS:
+        return int(resolution[:-1]) * _RESOLUTION_UNITS[unit]
+    return int(resolution)
+
+
+@router.get("/history", response_model=Union[HistoryResponse, BucketedHistoryResponse])
 async def get_sensor_history(
     hours: int = Query(24, ge=1, le=168, description="Number of hours of history (1-168)"),
     node_id: Optional[str] = Query(None, description="Filter by node ID"),
     gateway_id: Optional[str] = Query(None, description="Filter by gateway ID"),
+    format: str = Query("json", pattern="^(json|ndjson|csv)$", description="Response format: json, ndjson or csv"),
+    resolution: Optional[str] = Query(
+        None, pattern=r"^[1-9][0-9]*[smhd]?$", description="Bucket width, e.g. 300, 5m, 1h (returns min/avg/max buckets)"
+    ),
+    max_points: Optional[int] = Query(None, ge=10, le=10000, description="Maximum points per node"),
+    method: str = Query("buckets", pattern="^(buckets|lttb)$", description="Downsampling for max_points: buckets or lttb"),
+    metric: str = Query(
+        "temperature", pattern="^(temperature|humidity|soil_moisture)$", description="Metric whose shape LTTB preserves"
+    ),
     db: Session = Depends(get_db)
 ):
     """
@@ -341,6 +607,14 @@ async def get_sensor_history(
     - `hours`: Number of hours of history (default: 24, max: 168)
     - `node_id`: Optional filter by specific node ID
     - `gateway_id`: Optional filter by specific gateway ID
+    - `format`: `json` (default), or `ndjson` / `csv` to stream an export of
+      any size with flat memory use (one reading per line, columns as below)
+    - `resolution`: Return min/avg/max per node and time bucket of this width
+      (`300`, `5m`, `1h`, `1d`) instead of raw readings
+    - `max_points`: Return at most this many points per node. With
+      `method=buckets` (default) the bucket width is chosen to fit; with
+      `method=lttb` raw readings are picked by Largest-Triangle-Three-Buckets
+      on `metric` (default: temperature)
     
     **Example Response:**
     ```json
@@ -362,6 +636,43 @@ async def get_sensor_history(
     }
     ```
     """
+    if resolution is not None or max_points is not None:
+        if format != "json":
+            raise HTTPException(status_code=400, detail="resolution/max_points are only supported with format=json")
+        try:
+            if method == "lttb" and resolution is None:
+                readings = await run_in_threadpool(
+                    SensorService.get_history_lttb, db, hours, max_points,
+                    metric=metric, node_id=node_id, gateway_id=gateway_id
+                )
+                return HistoryResponse(readings=readings, count=len(readings), hours=hours)
+            
+            if resolution is not None:
+                resolution_seconds = _parse_resolution(resolution)
+            else:
+                # Aligned buckets can straddle both window edges, hence max_points - 1
+                resolution_seconds = -(-hours * 3600 // (max_points - 1))  # ceil
+            buckets = await run_in_threadpool(
+                SensorService.get_history_buckets, db, hours, resolution_seconds,
+                node_id=node_id, gateway_id=gateway_id
+            )
+            return BucketedHistoryResponse(
+                buckets=buckets,
+                count=len(buckets),
+                hours=hours,
+                resolution_seconds=resolution_seconds
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching history: {str(e)}")
+    
+    if format != "json":
+        media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+        return StreamingResponse(
+            _stream_history(format, hours, node_id, gateway_id),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="sensor_history_{hours}h.{format}"'}
+        )
+    
     try:
         readings = SensorService.get_history(db, hours=hours, node_id=node_id, gateway_id=gateway_id)
         return HistoryResponse(
@@ -384,10 +695,14 @@ async def get_gateway_network_status(
     This endpoint allows the mobile app to query the ESP32's network status
     through the backend, avoiding emulator network limitations.
     
-    The backend will try to discover the ESP32 by attempting:
-    - Cached IP from recent sensor data (if gateway_id is provided)
-    - Provided IP (if gateway_ip is provided)
-    - Common AP mode IP: 192.168.4.1
+    The network status of known gateways is refreshed in the background by the
+    gateway poller and served from its cache:
+    - The gateway with the given gateway_id, or the one last polled at gateway_ip
+    - Otherwise the first gateway with a polled status
+    
+    A gateway_ip the poller does not know yet is registered with it and
+    polled on its next tick; until then the response is OFFLINE. The handler
+    itself never calls a gateway.
     
     **Query Parameters:**
     - `gateway_ip`: Optional ESP32 IP address. If not provided, will try cached/common IPs.
@@ -413,44 +728,18 @@ async def get_gateway_network_status(
     }
     ```
     """
-    # IPs to try: cached IP, provided IP, common AP IP
-    ips_to_try = []
-    
-    # Try cached IP first (most reliable)
-    if gateway_id and gateway_id in _esp32_ip_cache:
-        cached_ip = _esp32_ip_cache[gateway_id]
-        ips_to_try.append(cached_ip)
-        logger.info(f"Using cached IP for gateway {gateway_id}: {cached_ip}")
-    
-    # Try provided IP
-    if gateway_ip:
-        if gateway_ip not in ips_to_try:  # Avoid duplicates
-            ips_to_try.append(gateway_ip)
-    
-    # Try common AP IP
-    if '192.168.4.1' not in ips_to_try:
-        ips_to_try.append('192.168.4.1')
-    
-    async with httpx.AsyncClient(timeout=httpx.Timeout(2.0)) as client:
-        for ip in ips_to_try:
-            try:
-                url = f"http://{ip}/api/system/network"
-                logger.info(f"Attempting to fetch network status from {url}")
-                response = await client.get(url)
-                
-                if response.status_code == 200:
-                    logger.info(f"Successfully fetched network status from {ip}")
-                    return response.json()
-            except (httpx.TimeoutException, httpx.ConnectError, httpx.RequestError) as e:
-                logger.debug(f"Failed to connect to {ip}: {str(e)}")
-                continue
-            except Exception as e:
-                logger.warning(f"Unexpected error querying {ip}: {str(e)}")
-                continue
-    
-    # If we get here, couldn't reach ESP32 - return a response indicating unreachable
-    # Instead of raising 503, return a valid JSON response that the app can handle
-    logger.warning("ESP32 gateway not reachable from any attempted IP addresses")
+    # Served from the gateway poller's cache
+    network_status = await run_shared(get_network_status, gateway_id, gateway_ip)
+    if network_status is not None:
+        return network_status
+    
+    # An explicitly supplied IP the poller does not know is polled from its next tick on
+    if gateway_ip and gateway_id is None and await run_shared(gateway_poller.register_ip, gateway_ip):
+        logger.info(f"Registered {gateway_ip} with the gateway poller, no network status yet")
+    else:
+        logger.warning("No polled network status for the requested ESP32 gateway")
+    
+    # Return a valid JSON response that the app can handle instead of raising 503
     return {
         "mode": "OFFLINE",
         "ip": "0.0.0.0",
@@ -4,10 +4,11 @@ This module provides deterministic, rule-based analysis of historical sensor dat
 to generate proactive insights and recommendations. No machine learning is used.
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import case, func, and_
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
-from models.database import SensorReading
+from models.database import SensorReading, SensorRollup
+from services.rollup_service import ROLLUPS_ENABLED, bucket_start
 
 
 class AIInsightsService:
@@ -43,21 +44,12 @@ class AIInsightsService:
         cutoff_24h = now - timedelta(hours=hours_24)
         cutoff_7d = now - timedelta(days=days_7)
         
-        # Get readings for 24 hours
-        readings_24h = db.query(SensorReading).filter(
-            and_(
-                SensorReading.node_id == node_id,
-                SensorReading.timestamp >= cutoff_24h
-            )
-        ).order_by(SensorReading.timestamp).all()
-        
-        # Get readings for 7 days
-        readings_7d = db.query(SensorReading).filter(
-            and_(
-                SensorReading.node_id == node_id,
-                SensorReading.timestamp >= cutoff_7d
-            )
-        ).order_by(SensorReading.timestamp).all()
+        if ROLLUPS_ENABLED:
+            (count_24h, temp_sum_24h, humidity_sum_24h, soil_sum_24h, count_7d, temp_sum_7d,
+             first, last) = AIInsightsService._rollup_aggregates(db, node_id, cutoff_24h, cutoff_7d)
+        else:
+            (count_24h, temp_sum_24h, humidity_sum_24h, soil_sum_24h, count_7d, temp_sum_7d,
+             first, last) = AIInsightsService._raw_aggregates(db, node_id, cutoff_24h, cutoff_7d)
         
         metrics = {
             "avg_temp_24h": None,
@@ -68,47 +60,87 @@ class AIInsightsService:
             "avg_soil_moisture_24h": None,
         }
         
-        # Calculate 24-hour average temperature
-        if readings_24h:
-            temps_24h = [r.temperature for r in readings_24h if r.temperature is not None]
-            if temps_24h:
-                metrics["avg_temp_24h"] = sum(temps_24h) / len(temps_24h)
-            
-            # Calculate temperature rate of change (°C per hour)
-            if len(readings_24h) >= 2:
-                first_temp = readings_24h[0].temperature
-                last_temp = readings_24h[-1].temperature
-                time_diff_hours = (readings_24h[-1].timestamp - readings_24h[0].timestamp).total_seconds() / 3600
-                if time_diff_hours > 0:
-                    metrics["temp_rate_per_hour"] = (last_temp - first_temp) / time_diff_hours
-            
-            # Calculate average humidity
-            humidities = [r.humidity for r in readings_24h if r.humidity is not None]
-            if humidities:
-                metrics["avg_humidity_24h"] = sum(humidities) / len(humidities)
-            
-            # Calculate average soil moisture
-            soil_moistures = [r.soil_moisture for r in readings_24h if r.soil_moisture is not None]
-            if soil_moistures:
-                metrics["avg_soil_moisture_24h"] = sum(soil_moistures) / len(soil_moistures)
+        # Calculate 24-hour averages
+        if count_24h:
+            metrics["avg_temp_24h"] = temp_sum_24h / count_24h
+            metrics["avg_humidity_24h"] = humidity_sum_24h / count_24h
+            metrics["avg_soil_moisture_24h"] = soil_sum_24h / count_24h
         
         # Calculate 7-day average temperature
-        if readings_7d:
-            temps_7d = [r.temperature for r in readings_7d if r.temperature is not None]
-            if temps_7d:
-                metrics["avg_temp_7d"] = sum(temps_7d) / len(temps_7d)
-        
-        # Calculate soil moisture drop rate per day
-        if readings_24h and len(readings_24h) >= 2:
-            # Get first and last soil moisture readings
-            first_moisture = readings_24h[0].soil_moisture
-            last_moisture = readings_24h[-1].soil_moisture
-            time_diff_days = (readings_24h[-1].timestamp - readings_24h[0].timestamp).total_seconds() / 86400
-            if time_diff_days > 0 and first_moisture is not None and last_moisture is not None:
-                metrics["soil_moisture_drop_per_day"] = (first_moisture - last_moisture) / time_diff_days
+        if count_7d:
+            metrics["avg_temp_7d"] = temp_sum_7d / count_7d
+        
+        # Rates of change between the first and last reading of the 24-hour window
+        if count_24h and count_24h >= 2:
+            first_ts, first_temp, first_moisture = first
+            last_ts, last_temp, last_moisture = last
+            time_diff_seconds = (last_ts - first_ts).total_seconds()
+            if time_diff_seconds > 0:
+                # Temperature rate of change (°C per hour)
+                metrics["temp_rate_per_hour"] = (last_temp - first_temp) / (time_diff_seconds / 3600)
+                # Soil moisture drop rate per day
+                metrics["soil_moisture_drop_per_day"] = (first_moisture - last_moisture) / (time_diff_seconds / 86400)
         
         return metrics
     
+    @staticmethod
+    def _rollup_aggregates(db: Session, node_id: str, cutoff_24h: datetime, cutoff_7d: datetime) -> tuple:
+        """24h/7d counts and sums plus the first/last 24h reading, from the 1-minute rollups."""
+        # Windows start at the minute containing the cutoff. The 24h window is
+        # a sub-range of the 7d one, so a single scan of the 7d buckets
+        # computes both with conditional aggregation.
+        in_node = and_(SensorRollup.node_id == node_id, SensorRollup.bucket_seconds == 60)
+        start_24h = bucket_start(cutoff_24h, 60)
+        in_24h = and_(in_node, SensorRollup.bucket_start >= start_24h)
+        in_7d = and_(in_node, SensorRollup.bucket_start >= bucket_start(cutoff_7d, 60))
+        
+        def sum_24h(column):
+            return func.sum(case((SensorRollup.bucket_start >= start_24h, column)))
+        
+        sums = db.query(
+            sum_24h(SensorRollup.count),
+            sum_24h(SensorRollup.temperature_sum),
+            sum_24h(SensorRollup.humidity_sum),
+            sum_24h(SensorRollup.soil_moisture_sum),
+            func.sum(SensorRollup.count),
+            func.sum(SensorRollup.temperature_sum)
+        ).filter(in_7d).one()
+        first = last = None
+        if sums[0] and sums[0] >= 2:
+            # First and last reading: one row each, found through the rollup primary key
+            first = db.query(
+                SensorRollup.first_ts, SensorRollup.temperature_first, SensorRollup.soil_moisture_first
+            ).filter(in_24h).order_by(SensorRollup.bucket_start).first()
+            last = db.query(
+                SensorRollup.last_ts, SensorRollup.temperature_last, SensorRollup.soil_moisture_last
+            ).filter(in_24h).order_by(SensorRollup.bucket_start.desc()).first()
+        return (*sums, first, last)
+    
+    @staticmethod
+    def _raw_aggregates(db: Session, node_id: str, cutoff_24h: datetime, cutoff_7d: datetime) -> tuple:
+        """Same values as _rollup_aggregates, from the raw readings (no rollups maintained)."""
+        in_node = SensorReading.node_id == node_id
+        in_24h = and_(in_node, SensorReading.timestamp >= cutoff_24h)
+        in_7d = and_(in_node, SensorReading.timestamp >= cutoff_7d)
+        
+        def sum_24h(column):
+            return func.sum(case((SensorReading.timestamp >= cutoff_24h, column)))
+        
+        sums = db.query(
+            sum_24h(1),
+            sum_24h(SensorReading.temperature),
+            sum_24h(SensorReading.humidity),
+            sum_24h(SensorReading.soil_moisture),
+            func.count(SensorReading.id),
+            func.sum(SensorReading.temperature)
+        ).filter(in_7d).one()
+        first = last = None
+        if sums[0] and sums[0] >= 2:
+            columns = (SensorReading.timestamp, SensorReading.temperature, SensorReading.soil_moisture)
+            first = db.query(*columns).filter(in_24h).order_by(SensorReading.timestamp).first()
+            last = db.query(*columns).filter(in_24h).order_by(SensorReading.timestamp.desc()).first()
+        return (*sums, first, last)
+    
     @staticmethod
     def detect_conditions(metrics: Dict[str, Optional[float]]) -> List[Tuple[str, str]]:
         """Detect conditions based on metrics.
@@ -326,7 +358,7 @@ class AIInsightsService:
             - metrics
         """
         # Check if node exists
-        node_exists = db.query(SensorReading).filter(
+        node_exists = db.query(SensorReading.id).filter(
             SensorReading.node_id == node_id
         ).first()
         
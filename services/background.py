@@ -0,0 +1,44 @@
+"""Helpers for background tasks started from the application lifespan."""
+import asyncio
+import logging
+from typing import Callable
+from services.shared_state import SHARED_STATE_LEASE_SECONDS, shared_lease
+
+logger = logging.getLogger(__name__)
+
+
+async def run_periodic(
+    name: str,
+    interval_seconds: float,
+    func: Callable[[], None],
+    single_instance: bool = False
+) -> None:
+    """Run a blocking function every interval_seconds in a worker thread.
+
+    Errors are logged and the loop keeps going; cancel the task to stop it.
+
+    Args:
+        name: Task name used in log messages
+        interval_seconds: Delay between runs
+        func: Blocking callable (typically does database work)
+        single_instance: Only run in the worker holding the task's lease when
+            workers share state (see shared_lease); the others keep checking
+            and take over if the holder stops renewing it
+    """
+    # Renewed before every run, so it outlives one interval plus a slow run
+    lease = shared_lease(name, interval_seconds * 2 + SHARED_STATE_LEASE_SECONDS) if single_instance else None
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            if lease is not None and not await asyncio.to_thread(lease.acquire):
+                continue
+            await asyncio.to_thread(func)
+        except Exception as e:
+            logger.error(f"Background task '{name}' failed: {str(e)}", exc_info=True)
+
+
+async def stop_tasks(tasks: list) -> None:
+    """Cancel background tasks and wait for them to finish."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
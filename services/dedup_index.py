@@ -0,0 +1,156 @@
+"""In-memory index of recently accepted reading timestamps for duplicate checks.
+
+check_duplicate and the batch ingest path look for an existing reading from
+the same node and gateway within a few seconds of the new one. Almost every
+reading is newer than anything stored for its node, so the index keeps, per
+node, a small sorted ring of the latest accepted (timestamp, gateway_id,
+reading_id) entries and answers most checks without a query.
+
+The ring for a node is complete above its `complete_since` timestamp: every
+stored reading for that node newer than it is in the ring. A check whose whole
+window lies above that point is answered from memory; anything older (late
+replays, nodes the index was never seeded with) falls back to the database.
+
+With a multi-process shared-state backend other workers insert readings this
+index never sees, so it can still confirm duplicates but not that a reading
+is new; those checks go to the database.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import bisect
+import logging
+import os
+import threading
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from models.database import SensorReading, SessionLocal
+from services.shared_state import PROCESS_LOCAL
+
+logger = logging.getLogger(__name__)
+
+# Recent timestamps kept per node
+DEDUP_RING_SIZE = int(os.getenv("DEDUP_RING_SIZE", "32"))
+
+# Lookup outcomes
+NEW = "new"
+DUPLICATE = "duplicate"
+UNKNOWN = "unknown"
+
+
+class _NodeRing:
+    __slots__ = ("entries", "complete_since")
+
+    def __init__(self, complete_since: datetime):
+        # Sorted by timestamp: (timestamp, gateway_id, reading_id)
+        self.entries: List[Tuple[datetime, str, int]] = []
+        self.complete_since = complete_since
+
+
+class RecentTimestampIndex:
+    """Thread-safe per-node ring of recently accepted reading timestamps."""
+
+    def __init__(self, ring_size: int = DEDUP_RING_SIZE, sees_all_writes: bool = PROCESS_LOCAL):
+        self.ring_size = ring_size
+        # False when other processes also insert readings: NEW cannot be trusted
+        self.sees_all_writes = sees_all_writes
+        self._lock = threading.Lock()
+        self._rings: Dict[str, _NodeRing] = {}
+        self._seeded = False
+        self.hits = 0
+        self.misses = 0
+
+    def seed(self, db: Session) -> None:
+        """Load the latest reading timestamp of every node.
+
+        After seeding, nodes without a ring are known to have no readings at all.
+        """
+        rows = db.execute(
+            select(SensorReading.node_id, func.max(SensorReading.timestamp))
+            .group_by(SensorReading.node_id)
+        ).all()
+        with self._lock:
+            for node_id, latest in rows:
+                if latest is None:
+                    continue
+                # Readings at or before `latest` may exist; none are newer
+                ring = self._rings.get(node_id)
+                if ring is None:
+                    self._rings[node_id] = _NodeRing(complete_since=latest)
+                else:
+                    ring.complete_since = min(ring.complete_since, latest)
+            self._seeded = True
+        logger.info(f"Duplicate index seeded with {len(rows)} nodes")
+
+    def lookup(
+        self,
+        node_id: str,
+        gateway_id: str,
+        timestamp: datetime,
+        window_seconds: int
+    ) -> Tuple[str, Optional[int]]:
+        """Check a reading against the index.
+
+        Returns:
+            (NEW, None) if no stored reading can be within the window,
+            (DUPLICATE, reading_id) if a stored reading is,
+            (UNKNOWN, None) if the database has to be asked
+        """
+        window = timedelta(seconds=window_seconds)
+        with self._lock:
+            ring = self._rings.get(node_id)
+            if ring is None:
+                if self._seeded and self.sees_all_writes:
+                    self.hits += 1
+                    return NEW, None
+                self.misses += 1
+                return UNKNOWN, None
+
+            entries = ring.entries
+            index = bisect.bisect_left(entries, (timestamp - window,))
+            while index < len(entries) and entries[index][0] <= timestamp + window:
+                _, entry_gateway, reading_id = entries[index]
+                if entry_gateway == gateway_id:
+                    self.hits += 1
+                    return DUPLICATE, reading_id
+                index += 1
+
+            if timestamp - window <= ring.complete_since or not self.sees_all_writes:
+                self.misses += 1
+                return UNKNOWN, None
+            self.hits += 1
+            return NEW, None
+
+    def record(self, node_id: str, gateway_id: str, timestamp: datetime, reading_id: int) -> None:
+        """Record a committed reading."""
+        with self._lock:
+            ring = self._rings.get(node_id)
+            if ring is None:
+                # Unseeded, the database may hold readings we know nothing about
+                ring = _NodeRing(complete_since=datetime.min if self._seeded else datetime.max)
+                self._rings[node_id] = ring
+            bisect.insort(ring.entries, (timestamp, gateway_id, reading_id))
+            if len(ring.entries) > self.ring_size:
+                dropped = ring.entries.pop(0)
+                ring.complete_since = max(ring.complete_since, dropped[0])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "seeded": self._seeded,
+                "nodes": len(self._rings),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Process-wide index used by SensorService
+recent_timestamps = RecentTimestampIndex()
+
+
+def seed_dedup_index() -> None:
+    """Seed the process-wide duplicate index from the database."""
+    db = SessionLocal()
+    try:
+        recent_timestamps.seed(db)
+    finally:
+        db.close()
@@ -0,0 +1,54 @@
+"""Visual downsampling of time series for charts."""
+from typing import List, Sequence, Tuple
+
+
+def lttb(points: Sequence[Tuple[float, float]], threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last point and, from each of threshold - 2 equal
+    buckets in between, the point forming the largest triangle with the
+    previously kept point and the average of the next bucket. The shape of
+    the series (peaks, dips) survives far better than with plain averaging.
+
+    Args:
+        points: (x, y) pairs sorted by x
+        threshold: Maximum number of points to keep (at least 3)
+
+    Returns:
+        Indices into points of the points to keep, in order
+    """
+    length = len(points)
+    if threshold >= length or threshold < 3:
+        return list(range(length))
+
+    selected = [0]
+    bucket_size = (length - 2) / (threshold - 2)
+    previous = 0
+
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        # Average of the next bucket (the last point for the final bucket)
+        next_start = end
+        next_end = min(int((bucket + 2) * bucket_size) + 1, length)
+        if next_start >= next_end:
+            next_start, next_end = length - 1, length
+        count = next_end - next_start
+        avg_x = sum(points[i][0] for i in range(next_start, next_end)) / count
+        avg_y = sum(points[i][1] for i in range(next_start, next_end)) / count
+
+        prev_x, prev_y = points[previous]
+        best_area = -1.0
+        best = start
+        for i in range(start, end):
+            x, y = points[i]
+            area = abs((prev_x - avg_x) * (y - prev_y) - (prev_x - x) * (avg_y - prev_y))
+            if area > best_area:
+                best_area = area
+                best = i
+        selected.append(best)
+        previous = best
+
+    selected.append(length - 1)
+    return selected
@@ -0,0 +1,232 @@
+"""Background health poller for ESP32 gateways.
+
+Status requests used to call the gateway from inside the request handler,
+so a flaky gateway stalled /api/sensors/status. The poller instead refreshes
+/nodes and /api/system/network of every known gateway on its own schedule
+and writes the results to gateway_status_cache; handlers only read the cache.
+
+Each gateway is polled every GATEWAY_POLL_INTERVAL_SECONDS, randomised by
+±GATEWAY_POLL_JITTER so gateways do not all fire together. After a failed
+poll the delay doubles per consecutive failure up to
+GATEWAY_POLL_MAX_BACKOFF_SECONDS, so dead gateways cost little.
+
+Addresses that GET /api/sensors/network is asked about but that belong to no
+known gateway are registered with register_ip and polled for their network
+status on the same schedule, until nobody has asked for them for
+GATEWAY_POLL_IP_TTL_SECONDS.
+
+With a multi-process shared-state backend only the worker holding the
+"gateway-poller" lease polls; results go to the shared caches every worker
+reads.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List
+import asyncio
+import ipaddress
+import logging
+import os
+import random
+import time
+import httpx
+from services.gateway_probe import DEFAULT_AP_IP, probe_first
+from services.gateway_state import esp32_ip_cache, gateway_status_cache, merge_gateway_status, polled_ip_cache
+from services.registry import device_registry
+from services.shared_state import run_shared, shared_lease
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+GATEWAY_POLL_ENABLED = os.getenv("GATEWAY_POLL_ENABLED", "true").lower() in ("1", "true", "yes")
+GATEWAY_POLL_INTERVAL_SECONDS = float(os.getenv("GATEWAY_POLL_INTERVAL_SECONDS", "15"))
+GATEWAY_POLL_JITTER = float(os.getenv("GATEWAY_POLL_JITTER", "0.2"))
+GATEWAY_POLL_MAX_BACKOFF_SECONDS = float(os.getenv("GATEWAY_POLL_MAX_BACKOFF_SECONDS", "300"))
+GATEWAY_POLL_TIMEOUT_SECONDS = float(os.getenv("GATEWAY_POLL_TIMEOUT_SECONDS", "2.0"))
+GATEWAY_POLL_IP_TTL_SECONDS = float(os.getenv("GATEWAY_POLL_IP_TTL_SECONDS", "3600"))
+
+# How often the scheduler checks which gateways are due
+_TICK_SECONDS = 1.0
+
+# Upper bound on registered addresses, so arbitrary query parameters cannot grow the poll set
+_MAX_POLLED_IPS = 64
+
+# Schedule key prefix of registered addresses (gateway IDs are used as is)
+_IP_TARGET = "ip:"
+
+
+class GatewayPoller:
+    """Per-gateway polling schedule with jitter and exponential backoff."""
+
+    def __init__(self):
+        self._next_due: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {}
+        # Monotonic time this process last refreshed each registered address
+        self._registered_at: Dict[str, float] = {}
+        # With workers sharing state only the lease holder polls
+        self._lease = shared_lease("gateway-poller")
+
+    def _delay(self, failures: int) -> float:
+        base = min(GATEWAY_POLL_INTERVAL_SECONDS * (2 ** failures), GATEWAY_POLL_MAX_BACKOFF_SECONDS)
+        return base * random.uniform(1 - GATEWAY_POLL_JITTER, 1 + GATEWAY_POLL_JITTER)
+
+    @staticmethod
+    def _candidate_ips(gateway_id: str) -> List[str]:
+        ips = []
+        if gateway_id in esp32_ip_cache:
+            ips.append(esp32_ip_cache[gateway_id])
+        gateway = device_registry.get_gateway(gateway_id)
+        if gateway and gateway.get("local_ip"):
+            ips.append(gateway["local_ip"])
+        # The AP address is only a guess for gateways that never reported an IP
+        return ips or [DEFAULT_AP_IP]
+
+    @staticmethod
+    def _known_gateways() -> List[str]:
+        return list(dict.fromkeys(device_registry.gateway_ids() + list(esp32_ip_cache)))
+
+    def register_ip(self, ip: str) -> bool:
+        """Ask the poller to fetch the network status at an address no known gateway uses.
+
+        The address is polled from the next scheduler tick on and its status
+        is served by get_network_status(gateway_ip=ip). Each call refreshes
+        its TTL, writing to shared state at most every tenth of the TTL.
+
+        Returns:
+            False if ip is not an IP address or too many addresses are registered
+        """
+        # An IPv4 address may carry a port, as gateways' local_ip can
+        host = ip.rsplit(":", 1)[0] if ip.count(":") == 1 else ip
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        registered_at = self._registered_at.get(ip)
+        if registered_at is not None and time.monotonic() - registered_at < GATEWAY_POLL_IP_TTL_SECONDS / 10:
+            return True
+        if ip not in polled_ip_cache and len(polled_ip_cache) >= _MAX_POLLED_IPS:
+            logger.warning(f"Not polling {ip}: {_MAX_POLLED_IPS} addresses are already registered")
+            return False
+        polled_ip_cache.merge(ip, {"requested_at": datetime.utcnow().isoformat()})
+        self._registered_at[ip] = time.monotonic()
+        return True
+
+    def _registered_ips(self) -> List[str]:
+        """Registered addresses, dropping those nobody asked for within the TTL."""
+        expired_before = (datetime.utcnow() - timedelta(seconds=GATEWAY_POLL_IP_TTL_SECONDS)).isoformat()
+        ips = []
+        for ip, entry in polled_ip_cache.snapshot().items():
+            if entry.get("requested_at", "") < expired_before:
+                polled_ip_cache.pop(ip, None)
+                self._next_due.pop(_IP_TARGET + ip, None)
+                self._failures.pop(_IP_TARGET + ip, None)
+                self._registered_at.pop(ip, None)
+            else:
+                ips.append(ip)
+        return ips
+
+    async def poll_ip(self, client: httpx.AsyncClient, ip: str) -> bool:
+        """Poll the network status at a registered address and cache it.
+
+        Returns:
+            True if the address answered
+        """
+        target = _IP_TARGET + ip
+        network = await probe_first(client, [ip], "/api/system/network", GATEWAY_POLL_TIMEOUT_SECONDS)
+        if not await run_shared(polled_ip_cache.__contains__, ip):
+            # Expired while the probe was in flight
+            return network is not None
+        if network is None:
+            failures = self._failures.get(target, 0) + 1
+            self._failures[target] = failures
+            await run_shared(polled_ip_cache.merge, ip, {"poll_failures": failures})
+            return False
+        self._failures[target] = 0
+        await run_shared(polled_ip_cache.merge, ip, {
+            "network": network[1], "poll_failures": 0, "last_polled": datetime.utcnow().isoformat()
+        })
+        return True
+
+    async def poll_gateway(self, client: httpx.AsyncClient, gateway_id: str) -> bool:
+        """Poll one gateway and update its cached status.
+
+        Returns:
+            True if the gateway answered at least one endpoint
+        """
+        ips = await run_shared(self._candidate_ips, gateway_id)
+        nodes, network = await asyncio.gather(
+            probe_first(
+                client, ips, "/nodes", GATEWAY_POLL_TIMEOUT_SECONDS,
+                parse=lambda response: response.json().get("active_nodes")
+            ),
+            probe_first(client, ips, "/api/system/network", GATEWAY_POLL_TIMEOUT_SECONDS),
+        )
+        if nodes is None and network is None:
+            failures = self._failures.get(gateway_id, 0) + 1
+            self._failures[gateway_id] = failures
+            await run_shared(self._record_failures, gateway_id, failures)
+            return False
+
+        self._failures[gateway_id] = 0
+        fields = {"poll_failures": 0, "last_polled": datetime.utcnow().isoformat()}
+        if nodes is not None:
+            fields["polled_ip"], fields["active_node_count"] = nodes
+        if network is not None:
+            fields["polled_ip"], fields["network"] = network
+        await run_shared(merge_gateway_status, gateway_id, **fields)
+        return True
+
+    @staticmethod
+    def _record_failures(gateway_id: str, failures: int) -> None:
+        if gateway_id in gateway_status_cache:
+            gateway_status_cache.merge(gateway_id, {"poll_failures": failures})
+
+    async def run_once(self, client: httpx.AsyncClient) -> None:
+        """Poll every gateway and registered address that is due."""
+        now = time.monotonic()
+        due = []
+        polls = []
+        for gateway_id in await run_shared(self._known_gateways):
+            # New gateways get a random first slot within one interval
+            next_due = self._next_due.setdefault(
+                gateway_id, now + random.uniform(0, GATEWAY_POLL_INTERVAL_SECONDS)
+            )
+            if next_due <= now:
+                due.append(gateway_id)
+                polls.append(self.poll_gateway(client, gateway_id))
+        for ip in await run_shared(self._registered_ips):
+            # Someone is waiting for this address, so it is polled on the next tick
+            if self._next_due.setdefault(_IP_TARGET + ip, now) <= now:
+                due.append(_IP_TARGET + ip)
+                polls.append(self.poll_ip(client, ip))
+        if not due:
+            return
+        results = await asyncio.gather(*polls, return_exceptions=True)
+        now = time.monotonic()
+        for target, result in zip(due, results):
+            if isinstance(result, Exception):
+                logger.error(f"Polling gateway {target} failed: {str(result)}", extra={"gateway_id": target})
+                self._failures[target] = self._failures.get(target, 0) + 1
+            self._next_due[target] = now + self._delay(self._failures.get(target, 0))
+
+    async def run(self, client: httpx.AsyncClient) -> None:
+        """Poll gateways until cancelled (lifespan task)."""
+        while True:
+            try:
+                if await asyncio.to_thread(self._lease.acquire):
+                    await self.run_once(client)
+            except Exception as e:
+                logger.error(f"Gateway poller iteration failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(_TICK_SECONDS)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            gateway_id: {
+                "consecutive_failures": self._failures.get(gateway_id, 0),
+                "next_poll_in_seconds": round(max(next_due - now, 0.0), 1),
+            }
+            for gateway_id, next_due in self._next_due.items()
+        }
+
+
+# Process-wide poller started from the application lifespan
+gateway_poller = GatewayPoller()
@@ -0,0 +1,141 @@
+"""Concurrent probing of candidate gateway IPs.
+
+A gateway may be reachable at its cached IP, a caller-supplied IP or the
+default AP address. Probing them one after another made an unreachable
+gateway cost one full timeout per candidate; here all candidates are probed
+at once, the first acceptable response wins and the remaining probes are
+cancelled.
+
+IPs that fail at the network level or time out are remembered for
+GATEWAY_PROBE_NEGATIVE_TTL_SECONDS and skipped meanwhile, so repeated status
+polls for an offline gateway fail fast instead of waiting on the timeout.
+"""
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+import httpx
+from services.http_client import gateway_get
+from services.metrics import gateway_probe_seconds
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+GATEWAY_PROBE_NEGATIVE_TTL_SECONDS = float(os.getenv("GATEWAY_PROBE_NEGATIVE_TTL_SECONDS", "30"))
+
+# Default IP of a gateway running in access point mode
+DEFAULT_AP_IP = "192.168.4.1"
+
+# ip -> monotonic time until which it is considered unreachable
+_unreachable: Dict[str, float] = {}
+_unreachable_lock = threading.Lock()
+
+
+def is_unreachable(ip: str) -> bool:
+    """True if a recent probe of ip failed at the network level or timed out."""
+    with _unreachable_lock:
+        expires_at = _unreachable.get(ip)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del _unreachable[ip]
+            return False
+        return True
+
+
+def mark_unreachable(ip: str) -> None:
+    if GATEWAY_PROBE_NEGATIVE_TTL_SECONDS > 0:
+        with _unreachable_lock:
+            _unreachable[ip] = time.monotonic() + GATEWAY_PROBE_NEGATIVE_TTL_SECONDS
+
+
+def clear_unreachable(ip: str) -> None:
+    """Forget a negative cache entry (e.g. the gateway just reported from this IP)."""
+    with _unreachable_lock:
+        _unreachable.pop(ip, None)
+
+
+async def _probe(
+    client: httpx.AsyncClient,
+    ip: str,
+    path: str,
+    timeout: float,
+    parse: Callable[[httpx.Response], Any]
+) -> Any:
+    # Probes cancelled because another candidate answered first are not recorded
+    started = time.perf_counter()
+    try:
+        response = await gateway_get(client, f"http://{ip}{path}", timeout=timeout)
+    except httpx.TimeoutException as e:
+        # Timeouts and connect/read failures: nothing is answering at this IP
+        mark_unreachable(ip)
+        _observe_probe(path, "timeout", started)
+        logger.debug("Gateway probe to %s failed: %s", ip, e)
+        return None
+    except httpx.NetworkError as e:
+        mark_unreachable(ip)
+        _observe_probe(path, "network_error", started)
+        logger.debug("Gateway probe to %s failed: %s", ip, e)
+        return None
+    except httpx.RequestError as e:
+        _observe_probe(path, "request_error", started)
+        logger.debug("Gateway probe to %s failed: %s", ip, e)
+        return None
+    if response.status_code != 200:
+        _observe_probe(path, "http_error", started)
+        return None
+    try:
+        result = parse(response)
+    except Exception as e:
+        _observe_probe(path, "invalid_response", started)
+        logger.debug("Unexpected response from gateway %s%s: %s", ip, path, e)
+        return None
+    _observe_probe(path, "ok" if result is not None else "invalid_response", started)
+    return result
+
+
+def _observe_probe(path: str, outcome: str, started: float) -> None:
+    gateway_probe_seconds.labels(path, outcome).observe(time.perf_counter() - started)
+
+
+async def probe_first(
+    client: httpx.AsyncClient,
+    ips: Iterable[str],
+    path: str,
+    timeout: float,
+    parse: Callable[[httpx.Response], Any] = lambda response: response.json()
+) -> Optional[Tuple[str, Any]]:
+    """Probe candidate gateway IPs concurrently and return the first success.
+
+    Args:
+        client: Shared gateway HTTP client
+        ips: Candidate IPs (duplicates and negatively cached IPs are skipped)
+        path: Request path on the gateway, e.g. "/nodes"
+        timeout: Per-probe timeout in seconds
+        parse: Turns a 200 response into a result; returning None (or raising)
+            rejects the response
+
+    Returns:
+        (ip, result) of the first accepted response, or None if no candidate answered
+    """
+    candidates = [ip for ip in dict.fromkeys(ips) if ip and not is_unreachable(ip)]
+    if not candidates:
+        return None
+
+    tasks = {asyncio.ensure_future(_probe(client, ip, path, timeout, parse)): ip for ip in candidates}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result is not None:
+                    return tasks[task], result
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
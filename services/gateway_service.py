@@ -11,6 +11,7 @@ from typing import List, Optional
 from datetime import datetime, timedelta
 import logging
 from models.database import Gateway, SensorNode
+from services.registry import device_registry
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +25,8 @@ class GatewayService:
         gateway_id: str,
         name: Optional[str] = None,
         local_ip: Optional[str] = None,
-        client_ip: Optional[str] = None
+        client_ip: Optional[str] = None,
+        commit: bool = True
     ) -> Gateway:
         """Register a new gateway or update existing gateway's last_seen timestamp.
         
@@ -34,6 +36,8 @@ class GatewayService:
             name: Optional human-readable name
             local_ip: ESP32's self-reported local IP address
             client_ip: IP address seen by backend (for diagnostics)
+            commit: Commit immediately. When False the change is only flushed so
+                the caller can commit it together with other writes.
             
         Returns:
             Gateway object (new or existing)
@@ -71,9 +75,15 @@ class GatewayService:
                 gateway = Gateway(**gateway_params)
                 db.add(gateway)
             
-            db.commit()
-            db.refresh(gateway)
+            if commit:
+                db.commit()
+                db.refresh(gateway)
+            else:
+                db.flush()
         except Exception as e:
+            if not commit:
+                # Rolling back here would discard the caller's pending writes
+                raise
             # If there's a database error (e.g., columns don't exist), rollback and retry without IP fields
             db.rollback()
             if not gateway:
@@ -96,6 +106,58 @@ class GatewayService:
         
         return gateway
     
+    @staticmethod
+    def touch_gateway(
+        db: Session,
+        gateway_id: str,
+        local_ip: Optional[str] = None,
+        client_ip: Optional[str] = None
+    ) -> None:
+        """Record that a gateway was seen, writing to the database only if it is new.
+        
+        Known gateways are updated in the in-process registry; their last_seen,
+        is_online and IP values reach the database on the next registry flush.
+        New gateways are inserted without committing, so the caller's commit
+        makes them durable together with the rest of its transaction.
+        
+        Args:
+            db: Database session
+            gateway_id: Unique gateway identifier
+            local_ip: ESP32's self-reported local IP address
+            client_ip: IP address seen by backend (for diagnostics)
+        """
+        if device_registry.touch_gateway(gateway_id, local_ip=local_ip, client_ip=client_ip):
+            return
+        gateway = GatewayService.register_or_update_gateway(
+            db, gateway_id, local_ip=local_ip, client_ip=client_ip, commit=False
+        )
+        device_registry.add_gateway_on_commit(db, gateway)
+
+    @staticmethod
+    def touch_node(
+        db: Session,
+        node_id: str,
+        gateway_id: str,
+        is_simulated: bool = False
+    ) -> None:
+        """Record that a node was seen, writing to the database only if it is new.
+        
+        Same semantics as touch_gateway. The parent gateway is not touched;
+        callers do that themselves.
+        
+        Args:
+            db: Database session
+            node_id: Unique node identifier
+            gateway_id: Gateway that this node belongs to
+            is_simulated: True if this is a simulated node (used for new nodes only)
+        """
+        if device_registry.touch_node(node_id, gateway_id):
+            return
+        node = GatewayService.register_or_update_node(
+            db, node_id, gateway_id, is_simulated=is_simulated, commit=False, ensure_gateway=False
+        )
+        device_registry.add_node_on_commit(db, node)
+
     @staticmethod
     def get_gateway(db: Session, gateway_id: str) -> Optional[Gateway]:
         """Get gateway object by ID.
@@ -115,7 +177,9 @@ class GatewayService:
         node_id: str,
         gateway_id: str,
         name: Optional[str] = None,
-        is_simulated: bool = False
+        is_simulated: bool = False,
+        commit: bool = True,
+        ensure_gateway: bool = True
     ) -> SensorNode:
         """Register a new sensor node or update existing node's last_seen timestamp.
         
@@ -125,12 +189,16 @@ class GatewayService:
             gateway_id: Gateway that this node belongs to
             name: Optional human-readable name
             is_simulated: True if this is a simulated node (for development)
+            commit: Commit immediately. When False the change is only flushed.
+            ensure_gateway: Register/update the parent gateway first. Callers that
+                already did so in the same session can skip it.
             
         Returns:
             SensorNode object (new or existing)
         """
         # Ensure gateway exists
-        GatewayService.register_or_update_gateway(db, gateway_id)
+        if ensure_gateway:
+            GatewayService.register_or_update_gateway(db, gateway_id, commit=commit)
         
         node = db.query(SensorNode).filter(SensorNode.node_id == node_id).first()
         
@@ -151,8 +219,11 @@ class GatewayService:
             )
             db.add(node)
         
-        db.commit()
-        db.refresh(node)
+        if commit:
+            db.commit()
+            db.refresh(node)
+        else:
+            db.flush()
         return node
 
     @staticmethod
@@ -171,8 +242,18 @@ class GatewayService:
         if not gateway:
             return None
         
+        # The registry holds last_seen/IPs that have not been flushed yet
+        live = device_registry.get_gateway(gateway_id)
+        last_seen = gateway.last_seen
+        local_ip = gateway.local_ip
+        client_ip = gateway.client_ip
+        if live and live["last_seen"] and live["last_seen"] > last_seen:
+            last_seen = live["last_seen"]
+            local_ip = live["local_ip"]
+            client_ip = live["client_ip"]
+        
         # Check if gateway is considered online (seen in last 5 minutes)
-        time_since_last_seen = (datetime.utcnow() - gateway.last_seen).total_seconds()
+        time_since_last_seen = (datetime.utcnow() - last_seen).total_seconds()
         is_online = time_since_last_seen < 300  # 5 minutes threshold
         
         # Update online status if changed
@@ -184,11 +265,11 @@ class GatewayService:
             "gateway_id": gateway.gateway_id,
             "name": gateway.name,
             "is_online": is_online,
-            "last_seen": gateway.last_seen.isoformat(),
+            "last_seen": last_seen.isoformat(),
             "last_seen_seconds_ago": int(time_since_last_seen),
             "created_at": gateway.created_at.isoformat(),
-            "local_ip": gateway.local_ip,  # ESP32's self-reported IP (source of truth)
-            "client_ip": gateway.client_ip  # IP seen by backend (for diagnostics)
+            "local_ip": local_ip,  # ESP32's self-reported IP (source of truth)
+            "client_ip": client_ip  # IP seen by backend (for diagnostics)
         }
 
     @staticmethod
@@ -0,0 +1,78 @@
+"""Gateway state shared by the routes and the gateway poller.
+
+- esp32_ip_cache: the IP each gateway last reported (or was seen from),
+  updated on ingest and gateway status pushes
+- gateway_status_cache: status per gateway, written by the gateway's own
+  POST /api/gateway/status pushes and by the background gateway poller
+  (active node count and network status); request handlers only read it
+- polled_ip_cache: addresses asked about via GET /api/sensors/network that
+  belong to no known gateway, with the network status the poller got there
+
+All live in the shared-state backend (see services/shared_state.py), so all
+worker processes see the same gateway state when it is not "memory". Async
+handlers go through run_shared() (or remember_gateway_ip()) so backend I/O
+stays off the event loop.
+"""
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import time
+from services.shared_state import SharedMap, run_shared, shared_map
+
+# Key: gateway_id, Value: IP address to reach the ESP32 at
+esp32_ip_cache: SharedMap = shared_map("esp32_ip")
+
+# Key: gateway_id, Value: dict with status info (active node count, network mode, etc.)
+gateway_status_cache: SharedMap = shared_map("gateway_status")
+
+# Key: IP address, Value: dict with last request time and polled network status
+polled_ip_cache: SharedMap = shared_map("polled_ip")
+
+# IP this process last stored per gateway and when: (ip, monotonic time).
+# Ingest reports the same IP on every request, so only changes are written;
+# an unchanged IP is still rewritten after _IP_REWRITE_SECONDS in case
+# another worker stored a different one meanwhile.
+_stored_ips: Dict[str, Tuple[str, float]] = {}
+_IP_REWRITE_SECONDS = 60.0
+
+
+async def remember_gateway_ip(gateway_id: str, ip: str) -> None:
+    """Record the IP a gateway reported or was seen from, writing only when it changed."""
+    stored = _stored_ips.get(gateway_id)
+    now = time.monotonic()
+    if stored is not None and stored[0] == ip and now - stored[1] < _IP_REWRITE_SECONDS:
+        return
+    await run_shared(esp32_ip_cache.__setitem__, gateway_id, ip)
+    _stored_ips[gateway_id] = (ip, now)
+
+
+def merge_gateway_status(gateway_id: str, **fields) -> dict:
+    """Merge fields into a gateway's cached status and return the entry."""
+    return gateway_status_cache.merge(gateway_id, {**fields, "last_updated": datetime.utcnow().isoformat()})
+
+
+def get_network_status(gateway_id: Optional[str] = None, gateway_ip: Optional[str] = None) -> Optional[dict]:
+    """Latest polled network status of a gateway, looked up by ID or IP.
+
+    Without either argument the first gateway with a polled status is used.
+    """
+    if gateway_id is not None:
+        return gateway_status_cache.get(gateway_id, {}).get("network")
+    ips = esp32_ip_cache.snapshot() if gateway_ip is not None else {}
+    for cached_id, entry in gateway_status_cache.snapshot().items():
+        network = entry.get("network")
+        if network is None:
+            continue
+        if gateway_ip is None or entry.get("polled_ip") == gateway_ip or ips.get(cached_id) == gateway_ip:
+            return network
+    if gateway_ip is not None:
+        return polled_ip_cache.get(gateway_ip, {}).get("network")
+    return None
+
+
+def get_active_node_count() -> Optional[Tuple[str, int]]:
+    """Active node count cached for the first known gateway, with its ID, if any."""
+    gateway_id = next(iter(esp32_ip_cache), None) or next(iter(gateway_status_cache), None)
+    if gateway_id is None:
+        return None
+    count = gateway_status_cache.get(gateway_id, {}).get("active_node_count")
+    return (gateway_id, count) if count is not None else None
@@ -0,0 +1,115 @@
+"""Shared HTTP client for requests to ESP32 gateways.
+
+One httpx.AsyncClient is created in the application lifespan and reused by
+every gateway probe, so keep-alive connections to a gateway survive between
+status polls instead of paying for client construction and a TCP handshake on
+each request. Limits favour many small gateways: a few connections per host,
+kept alive briefly (ESP32 web servers drop idle sockets quickly).
+
+Connection reuse is tracked per host through the httpcore "trace" request
+extension: a request that triggers connection.connect_tcp opened a new
+connection, any other request reused a pooled one.
+"""
+from collections import defaultdict
+from typing import Dict, Optional
+import os
+import threading
+import httpx
+from fastapi import Request
+
+# Configuration
+GATEWAY_HTTP_MAX_CONNECTIONS = int(os.getenv("GATEWAY_HTTP_MAX_CONNECTIONS", "64"))
+GATEWAY_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GATEWAY_HTTP_MAX_KEEPALIVE_CONNECTIONS", "32"))
+GATEWAY_HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("GATEWAY_HTTP_KEEPALIVE_EXPIRY_SECONDS", "5"))
+GATEWAY_HTTP_TIMEOUT_SECONDS = float(os.getenv("GATEWAY_HTTP_TIMEOUT_SECONDS", "2.0"))
+
+
+class ConnectionReuseStats:
+    """Per-host request and new-connection counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[str, int] = defaultdict(int)
+        self._connections: Dict[str, int] = defaultdict(int)
+
+    def trace_for(self, host: str):
+        """Build an httpcore trace callback that counts requests and new connections for host."""
+        async def trace(event_name: str, info: dict) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                with self._lock:
+                    self._connections[host] += 1
+            elif event_name.endswith(".send_request_headers.started"):
+                with self._lock:
+                    self._requests[host] += 1
+        return trace
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            result = {}
+            for host in sorted(set(self._requests) | set(self._connections)):
+                requests = self._requests[host]
+                connections = self._connections[host]
+                result[host] = {
+                    "requests": requests,
+                    "new_connections": connections,
+                    "reused_connections": max(requests - connections, 0),
+                    "reuse_ratio": round(max(requests - connections, 0) / requests, 4) if requests else None,
+                }
+            return result
+
+
+# Process-wide reuse counters for the shared gateway client
+connection_stats = ConnectionReuseStats()
+
+
+def create_gateway_client() -> httpx.AsyncClient:
+    """Create the pooled client shared by all gateway requests (closed in the lifespan)."""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(GATEWAY_HTTP_TIMEOUT_SECONDS),
+        limits=httpx.Limits(
+            max_connections=GATEWAY_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=GATEWAY_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=GATEWAY_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    )
+
+
+def get_gateway_client(request: Request) -> httpx.AsyncClient:
+    """FastAPI dependency returning the shared gateway client from app.state."""
+    return request.app.state.gateway_client
+
+
+async def gateway_get(
+    client: httpx.AsyncClient,
+    url: str,
+    timeout: Optional[float] = None
+) -> httpx.Response:
+    """GET a gateway URL on the shared client, recording connection reuse.
+
+    Args:
+        client: Shared gateway client
+        url: Full URL on the gateway
+        timeout: Optional per-request timeout in seconds (client default otherwise)
+
+    Returns:
+        The gateway's response
+    """
+    host = httpx.URL(url).host
+    kwargs = {"extensions": {"trace": connection_stats.trace_for(host)}}
+    if timeout is not None:
+        kwargs["timeout"] = httpx.Timeout(timeout)
+    return await client.get(url, **kwargs)
+
+
+def gateway_client_stats(client: Optional[httpx.AsyncClient] = None) -> dict:
+    """Pool limits and per-host connection reuse counters."""
+    return {
+        "limits": {
+            "max_connections": GATEWAY_HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": GATEWAY_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry_seconds": GATEWAY_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            "timeout_seconds": GATEWAY_HTTP_TIMEOUT_SECONDS,
+        },
+        "client_open": client is not None and not client.is_closed,
+        "hosts": connection_stats.snapshot(),
+    }
@@ -0,0 +1,293 @@
+"""Write-behind ingest queue for sensor readings.
+
+POST /api/sensors/data validates a reading, puts it on a bounded asyncio
+queue and returns 202 immediately. A dedicated writer task drains the queue
+in micro-batches and stores them with SensorService.create_readings_batch in
+a worker thread, so SQLite commits never run on the event loop.
+
+When the queue is full the endpoint answers 503 with Retry-After so gateways
+keep the reading buffered and retry later.
+
+Queued readings have already been acknowledged, so a batch that fails to
+write is never discarded. Transient errors (SQLAlchemy OperationalError, e.g.
+"database is locked") are retried with exponential backoff while the batch
+stays at the head of the line; the bounded queue and its 503 provide the
+backpressure meanwhile. A batch that keeps failing with any other error, or
+that still cannot be written at shutdown, is appended to INGEST_SPILL_PATH
+as NDJSON (one gateway-format reading per line, replayable through
+POST /api/sensors/data/batch).
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import time
+from sqlalchemy.exc import OperationalError
+from models.database import SessionLocal
+from models.schemas import SensorDataInput
+from services.metrics import callback_metric, histogram
+from services.sensor_service import SensorService
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+INGEST_QUEUE_ENABLED = os.getenv("INGEST_QUEUE_ENABLED", "true").lower() in ("1", "true", "yes")
+INGEST_QUEUE_MAX_SIZE = int(os.getenv("INGEST_QUEUE_MAX_SIZE", "10000"))
+INGEST_BATCH_MAX_SIZE = int(os.getenv("INGEST_BATCH_MAX_SIZE", "200"))
+INGEST_BATCH_MAX_WAIT_MS = float(os.getenv("INGEST_BATCH_MAX_WAIT_MS", "50"))
+INGEST_RETRY_AFTER_SECONDS = int(os.getenv("INGEST_RETRY_AFTER_SECONDS", "2"))
+INGEST_RETRY_MAX_BACKOFF_SECONDS = float(os.getenv("INGEST_RETRY_MAX_BACKOFF_SECONDS", "30"))
+INGEST_SPILL_PATH = os.getenv("INGEST_SPILL_PATH", "./ingest_spill.ndjson")
+
+# Attempts before a batch failing with a non-transient error (or at shutdown) is spilled
+_WRITE_ATTEMPTS = 3
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class IngestQueueFull(Exception):
+    """Raised when a reading is submitted while the queue is at capacity."""
+
+
+class IngestQueue:
+    """Bounded queue of validated readings drained by a single writer task."""
+
+    def __init__(self, max_size: int, batch_size: int, max_wait_ms: float):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._closing = False
+        # Metrics
+        self.enqueued_total = 0
+        self.rejected_total = 0
+        self.written_total = 0
+        self.duplicates_total = 0
+        self.retries_total = 0
+        self.spilled_total = 0
+        self.batches_total = 0
+        self.last_batch_size = 0
+        self.last_flush_ms: Optional[float] = None
+        self.max_flush_ms = 0.0
+        self._flush_ms_total = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._writer is not None and not self._writer.done()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        """Create the queue and start the writer task."""
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._closing = False
+        self._writer = asyncio.create_task(self._run())
+        logger.info(
+            f"Ingest queue started (max_size={self.max_size}, batch_size={self.batch_size}, "
+            f"max_wait={self.max_wait * 1000:.0f}ms)"
+        )
+
+    async def stop(self) -> None:
+        """Stop accepting readings, write everything still queued and stop the writer."""
+        if self._writer is None:
+            return
+        self._closing = True
+        remaining = self._queue.qsize()
+        # The writer keeps draining until every queued reading is written
+        await self._queue.join()
+        self._writer.cancel()
+        await asyncio.gather(self._writer, return_exceptions=True)
+        self._writer = None
+        logger.info(f"Ingest queue stopped ({remaining} queued readings written on shutdown)")
+
+    def submit(
+        self,
+        sensor_data: SensorDataInput,
+        reading_timestamp: datetime,
+        client_ip: Optional[str] = None
+    ) -> int:
+        """Queue a validated reading for writing.
+
+        Returns:
+            Queue depth after the reading was added
+
+        Raises:
+            IngestQueueFull: If the queue is at capacity or shutting down
+        """
+        if self._closing:
+            self.rejected_total += 1
+            raise IngestQueueFull()
+        try:
+            self._queue.put_nowait((sensor_data, reading_timestamp, client_ip))
+        except asyncio.QueueFull:
+            self.rejected_total += 1
+            raise IngestQueueFull()
+        self.enqueued_total += 1
+        return self._queue.qsize()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write_until_stored(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_until_stored(self, batch: List[Tuple[SensorDataInput, datetime, Optional[str]]]) -> None:
+        """Write a batch, retrying until it is stored or spilled to disk."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+                return
+            except OperationalError as e:
+                error, transient = e, True
+            except Exception as e:
+                error, transient = e, False
+            if attempt >= _WRITE_ATTEMPTS and (not transient or self._closing):
+                try:
+                    await asyncio.to_thread(self._spill, batch, error)
+                    return
+                except OSError as spill_error:
+                    logger.error(f"Could not spill {len(batch)} queued readings, retrying write: {str(spill_error)}")
+            self.retries_total += 1
+            delay = min(0.1 * (2 ** min(attempt - 1, 16)), INGEST_RETRY_MAX_BACKOFF_SECONDS)
+            logger.warning(
+                f"Ingest batch write failed (attempt {attempt}, {len(batch)} readings), "
+                f"retrying in {delay:.1f}s: {str(error)}"
+            )
+            await asyncio.sleep(delay)
+
+    def _spill(self, batch: List[Tuple[SensorDataInput, datetime, Optional[str]]], error: Exception) -> None:
+        """Append readings that cannot be stored to INGEST_SPILL_PATH and fsync it."""
+        spilled_at = datetime.utcnow().isoformat()
+        with open(INGEST_SPILL_PATH, "a", encoding="utf-8") as spill_file:
+            for sensor_data, reading_timestamp, client_ip in batch:
+                payload = sensor_data.model_dump(mode="json", by_alias=True, exclude_none=True)
+                # Keep the resolved timestamp (naive UTC, inverse of resolve_timestamp) so a
+                # replay stores the same reading on any host time zone
+                payload["timestamp"] = int((reading_timestamp - _EPOCH).total_seconds())
+                spill_file.write(json.dumps({
+                    "reading": payload,
+                    "client_ip": client_ip,
+                    "spilled_at": spilled_at,
+                    "error": str(error),
+                }) + "\n")
+            spill_file.flush()
+            os.fsync(spill_file.fileno())
+        self.spilled_total += len(batch)
+        logger.error(
+            f"Spilled {len(batch)} queued readings to {INGEST_SPILL_PATH} after failed writes: {str(error)}"
+        )
+
+    def _write_batch(self, batch: List[Tuple[SensorDataInput, datetime, Optional[str]]]) -> None:
+        """Store a batch once (raises on failure; retries are handled by the caller)."""
+        items = [(sensor_data, reading_timestamp) for sensor_data, reading_timestamp, _ in batch]
+        local_ips = {}
+        client_ips = {}
+        for sensor_data, _, client_ip in batch:
+            gateway_id = sensor_data.get_gateway_id()
+            local_ip = sensor_data.get_local_ip()
+            if local_ip and local_ip != "0.0.0.0":
+                local_ips[gateway_id] = local_ip
+            if client_ip:
+                client_ips[gateway_id] = client_ip
+
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            outcomes = SensorService.create_readings_batch(
+                db, items, local_ips=local_ips, client_ips=client_ips
+            )
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        flush_ms = (time.perf_counter() - started) * 1000
+        _flush_seconds.observe(flush_ms / 1000)
+
+        created = sum(1 for status, _ in outcomes if status == "created")
+        self.written_total += created
+        self.duplicates_total += len(outcomes) - created
+        self.batches_total += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = flush_ms
+        self.max_flush_ms = max(self.max_flush_ms, flush_ms)
+        self._flush_ms_total += flush_ms
+        logger.debug("Ingest batch written: %d readings, %d created, %.1fms", len(batch), created, flush_ms)
+
+    def stats(self) -> dict:
+        """Queue depth, throughput counters and flush latency."""
+        return {
+            "enabled": self.is_running,
+            "queue_depth": self.depth,
+            "queue_max_size": self.max_size,
+            "enqueued_total": self.enqueued_total,
+            "rejected_total": self.rejected_total,
+            "written_total": self.written_total,
+            "duplicates_total": self.duplicates_total,
+            "retries_total": self.retries_total,
+            "spilled_total": self.spilled_total,
+            "batches_total": self.batches_total,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 3) if self.last_flush_ms is not None else None,
+            "avg_flush_ms": round(self._flush_ms_total / self.batches_total, 3) if self.batches_total else None,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
+
+
+# Process-wide ingest queue, started from the application lifespan
+ingest_queue = IngestQueue(INGEST_QUEUE_MAX_SIZE, INGEST_BATCH_MAX_SIZE, INGEST_BATCH_MAX_WAIT_MS)
+
+# Metrics (the counters are the queue's own, read at scrape time)
+_flush_seconds = histogram(
+    "greenhouse_ingest_queue_flush_seconds",
+    "Time to write one queued batch (successful attempt)"
+)
+callback_metric(
+    "greenhouse_ingest_queue_depth",
+    "Readings waiting in the ingest queue",
+    lambda: ingest_queue.depth
+)
+callback_metric(
+    "greenhouse_ingest_queue_readings_total",
+    "Readings handled by the ingest queue by outcome",
+    lambda: {
+        ("enqueued",): ingest_queue.enqueued_total,
+        ("rejected",): ingest_queue.rejected_total,
+        ("written",): ingest_queue.written_total,
+        ("duplicate",): ingest_queue.duplicates_total,
+        ("spilled",): ingest_queue.spilled_total,
+    },
+    labelnames=("outcome",),
+    type_name="counter"
+)
+callback_metric(
+    "greenhouse_ingest_queue_batches_total",
+    "Batches written by the ingest queue",
+    lambda: ingest_queue.batches_total,
+    type_name="counter"
+)
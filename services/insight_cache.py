@@ -0,0 +1,147 @@
+"""Result cache for the AI insight endpoints.
+
+Insight responses are polled by every open dashboard, and each poll would
+recompute the same result from the same rows. Responses are cached per
+(endpoint, node_id, minutes) key with:
+
+- invalidation on ingest: every node has a generation counter that
+  SensorService bumps when a reading for it is committed; an entry is only
+  served while the generation it was computed at is current. Entries not tied
+  to one node (fleet-wide or unfiltered) follow a global generation that any
+  ingest bumps.
+- a TTL fallback, since insights also depend on the current time (stale data
+  detection)
+- an LRU bound on the number of entries
+- single-flight: concurrent requests for a key that is being computed await
+  the same computation instead of starting their own.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+import asyncio
+import os
+import threading
+import time
+from fastapi.concurrency import run_in_threadpool
+
+# Configuration
+INSIGHT_CACHE_ENABLED = os.getenv("INSIGHT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+INSIGHT_CACHE_TTL_SECONDS = float(os.getenv("INSIGHT_CACHE_TTL_SECONDS", "15"))
+INSIGHT_CACHE_MAX_ENTRIES = int(os.getenv("INSIGHT_CACHE_MAX_ENTRIES", "1024"))
+
+
+class InsightCache:
+    """LRU + TTL cache with per-node invalidation and single-flight computation."""
+
+    def __init__(self, max_entries: int = INSIGHT_CACHE_MAX_ENTRIES, ttl_seconds: float = INSIGHT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # key -> (value, expires_at, generation)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._global_generation = 0
+        # key -> task computing it (only touched on the event loop)
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _generation(self, node_id: Optional[str]) -> int:
+        if node_id is None:
+            return self._global_generation
+        return self._generations.get(node_id, 0)
+
+    def invalidate_nodes(self, node_ids: Iterable[str]) -> None:
+        """Mark cached results for these nodes (and fleet-wide results) as outdated."""
+        with self._lock:
+            for node_id in node_ids:
+                self._generations[node_id] = self._generations.get(node_id, 0) + 1
+            self._global_generation += 1
+            self.invalidations += 1
+
+    def get(self, key: Hashable, node_id: Optional[str]) -> Any:
+        """Cached value for key, or None if missing, expired or invalidated."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, generation = entry
+            if expires_at <= time.monotonic() or generation != self._generation(node_id):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any, generation: int) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds, generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def get_or_compute(self, key: Hashable, node_id: Optional[str], compute: Callable[[], Any]) -> Any:
+        """Return the cached result for key or compute it in the threadpool.
+
+        Args:
+            key: Cache key, e.g. (endpoint, node_id, minutes)
+            node_id: Node whose ingest invalidates the entry (None for fleet-wide results)
+            compute: Synchronous function producing the result
+
+        Returns:
+            The cached or freshly computed result
+        """
+        if not INSIGHT_CACHE_ENABLED:
+            return await run_in_threadpool(compute)
+
+        value = self.get(key, node_id)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            with self._lock:
+                self.coalesced += 1
+        else:
+            with self._lock:
+                self.misses += 1
+                # Captured before computing: an ingest during the computation
+                # leaves the stored entry already outdated
+                generation = self._generation(node_id)
+
+            async def run():
+                try:
+                    result = await run_in_threadpool(compute)
+                    self.put(key, result, generation)
+                    return result
+                finally:
+                    self._in_flight.pop(key, None)
+
+            task = self._in_flight[key] = asyncio.ensure_future(run())
+        # Shielded so one cancelled request does not cancel the shared computation
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "enabled": INSIGHT_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "in_flight": len(self._in_flight),
+            }
+
+
+# Process-wide cache for the /api/ai insight endpoints
+insight_cache = InsightCache()
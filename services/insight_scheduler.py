@@ -0,0 +1,162 @@
+"""Background precomputation of per-node insights.
+
+A periodic task recomputes the insights of every node that received readings
+since the previous run (plus nodes whose snapshot is older than
+INSIGHT_PRECOMPUTE_MAX_AGE_SECONDS, because stale-data detection depends on
+the clock) and stores them with their computed_at time. The insight endpoints
+serve these snapshots instead of computing during the request, falling back
+to on-request computation for nodes or window lengths without one.
+
+Snapshots are kept in memory: they are cheap to rebuild, and every node is
+recomputed on the first run after startup. With a multi-process shared-state
+backend a worker neither sees the other workers' readings (so cannot tell
+which nodes are dirty) nor serves their snapshots, so precomputation is off
+and the endpoints compute on request.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+import logging
+import os
+import threading
+import time
+from models.database import SessionLocal
+from services.ai_insights import AIInsightsService
+from services.registry import device_registry
+from services.shared_state import PROCESS_LOCAL
+from services.trend_insights_service import TrendInsightService
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+INSIGHT_PRECOMPUTE_ENABLED = os.getenv("INSIGHT_PRECOMPUTE_ENABLED", "true").lower() in ("1", "true", "yes")
+INSIGHT_PRECOMPUTE_INTERVAL_SECONDS = float(os.getenv("INSIGHT_PRECOMPUTE_INTERVAL_SECONDS", "30"))
+INSIGHT_PRECOMPUTE_CONCURRENCY = int(os.getenv("INSIGHT_PRECOMPUTE_CONCURRENCY", "4"))
+INSIGHT_PRECOMPUTE_MAX_AGE_SECONDS = float(os.getenv("INSIGHT_PRECOMPUTE_MAX_AGE_SECONDS", "300"))
+# Trend analysis window lengths (minutes) precomputed for every node
+INSIGHT_PRECOMPUTE_MINUTES = tuple(sorted({
+    int(minutes) for minutes in os.getenv("INSIGHT_PRECOMPUTE_MINUTES", "60").split(",")
+}))
+
+# Snapshot kinds
+TREND_INSIGHTS = "trend"
+NODE_INSIGHTS = "node"
+
+
+class InsightScheduler:
+    """Dirty-node tracking and the in-memory insight snapshot store."""
+
+    def __init__(self, sees_all_writes: bool = PROCESS_LOCAL):
+        # Snapshots are only served (and nodes tracked) when this process sees every reading
+        self.enabled = INSIGHT_PRECOMPUTE_ENABLED and sees_all_writes
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._dirty: Set[str] = set()
+        # (kind, node_id, minutes) -> (analysis result, computed_at)
+        self._snapshots: Dict[Tuple[str, str, Optional[int]], Tuple[dict, datetime]] = {}
+        self._computed_at: Dict[str, float] = {}  # node_id -> monotonic time of last computation
+        self.runs = 0
+        self.errors = 0
+        self.total_duration_seconds = 0.0
+        self.last_run: Optional[dict] = None
+
+    def mark_dirty(self, node_ids: Iterable[str]) -> None:
+        """Schedule nodes for recomputation on the next run."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._dirty.update(node_ids)
+
+    def get(self, kind: str, node_id: str, minutes: Optional[int] = None) -> Optional[Tuple[dict, datetime]]:
+        """Latest snapshot (result, computed_at) or None if not precomputed."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            return self._snapshots.get((kind, node_id, minutes))
+
+    def _compute_node(self, node_id: str) -> None:
+        db = SessionLocal()
+        try:
+            results = {
+                (NODE_INSIGHTS, node_id, None): AIInsightsService.analyze_node(db, node_id),
+            }
+            for minutes in INSIGHT_PRECOMPUTE_MINUTES:
+                results[(TREND_INSIGHTS, node_id, minutes)] = TrendInsightService.analyze_trends(
+                    db, node_id=node_id, minutes=minutes
+                )
+        finally:
+            db.close()
+        computed_at = datetime.utcnow()
+        with self._lock:
+            for key, result in results.items():
+                self._snapshots[key] = (result, computed_at)
+            self._computed_at[node_id] = time.monotonic()
+
+    def run(self) -> dict:
+        """Recompute dirty and expired nodes once.
+
+        Returns:
+            Run summary (nodes computed, failures, duration)
+        """
+        with self._run_lock:
+            started = time.perf_counter()
+            expired_before = time.monotonic() - INSIGHT_PRECOMPUTE_MAX_AGE_SECONDS
+            with self._lock:
+                nodes = self._dirty
+                self._dirty = set()
+                nodes.update(
+                    node_id for node_id in device_registry.node_ids()
+                    if self._computed_at.get(node_id, float("-inf")) < expired_before
+                )
+
+            failed = []
+            if nodes:
+                with ThreadPoolExecutor(max_workers=max(INSIGHT_PRECOMPUTE_CONCURRENCY, 1)) as pool:
+                    futures = {node_id: pool.submit(self._compute_node, node_id) for node_id in nodes}
+                for node_id, future in futures.items():
+                    error = future.exception()
+                    if error is not None:
+                        failed.append(node_id)
+                        logger.error(f"Insight precomputation failed for node {node_id}: {str(error)}")
+                if failed:
+                    # Retry on the next run
+                    self.mark_dirty(failed)
+
+            duration = time.perf_counter() - started
+            with self._lock:
+                self.runs += 1
+                self.errors += len(failed)
+                self.total_duration_seconds += duration
+                self.last_run = {
+                    "finished_at": datetime.utcnow().isoformat(),
+                    "duration_seconds": round(duration, 3),
+                    "nodes_computed": len(nodes) - len(failed),
+                    "nodes_failed": len(failed),
+                }
+            if nodes:
+                logger.debug(f"Precomputed insights for {len(nodes) - len(failed)} nodes in {duration:.3f}s")
+            return self.last_run
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "interval_seconds": INSIGHT_PRECOMPUTE_INTERVAL_SECONDS,
+                "concurrency": INSIGHT_PRECOMPUTE_CONCURRENCY,
+                "trend_window_minutes": list(INSIGHT_PRECOMPUTE_MINUTES),
+                "snapshots": len(self._snapshots),
+                "dirty_nodes": len(self._dirty),
+                "runs": self.runs,
+                "errors": self.errors,
+                "avg_duration_seconds": round(self.total_duration_seconds / self.runs, 3) if self.runs else None,
+                "last_run": self.last_run,
+            }
+
+
+# Process-wide scheduler fed by SensorService on ingest
+insight_scheduler = InsightScheduler()
+
+
+def run_insight_precompute() -> None:
+    """Recompute the insight snapshots of dirty nodes (periodic task body)."""
+    insight_scheduler.run()
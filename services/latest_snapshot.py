@@ -0,0 +1,99 @@
+"""In-memory snapshot of the latest reading per sensor node.
+
+Seeded once from the database at startup and updated as readings are
+committed, so fleet-wide "latest" lookups cost O(nodes) with no query.
+
+With a multi-process shared-state backend other workers commit readings this
+snapshot never sees, so it is not loaded and readers use the database.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+import threading
+from models.database import SensorReading, SessionLocal
+from services.shared_state import PROCESS_LOCAL
+
+logger = logging.getLogger(__name__)
+
+# Columns copied into the snapshot
+_COLUMNS = (
+    "id", "node_id", "gateway_id", "temperature", "humidity", "soil_moisture",
+    "light_level", "battery_level", "rssi", "timestamp",
+)
+
+
+class LatestReadingSnapshot:
+    """Thread-safe map of node_id -> latest reading values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[str, dict] = {}
+        self.loaded = False
+
+    def load(self, readings: List[SensorReading]) -> None:
+        """Seed the snapshot from ORM readings (one per node)."""
+        with self._lock:
+            for reading in readings:
+                self._update({column: getattr(reading, column) for column in _COLUMNS})
+            self.loaded = True
+
+    def update(self, row: dict) -> None:
+        """Record a committed reading if it is the newest for its node."""
+        if not self.loaded:
+            return
+        with self._lock:
+            self._update(row)
+
+    def _update(self, row: dict) -> None:
+        current = self._latest.get(row["node_id"])
+        if current is None or (row["timestamp"], row["id"]) >= (current["timestamp"], current["id"]):
+            self._latest[row["node_id"]] = {column: row.get(column) for column in _COLUMNS}
+
+    def prune(self, before: datetime) -> None:
+        """Forget nodes whose latest reading is older than before (deleted by retention)."""
+        with self._lock:
+            for node_id in [n for n, row in self._latest.items() if row["timestamp"] < before]:
+                del self._latest[node_id]
+
+    def get(self, node_id: str) -> Optional[SensorReading]:
+        """Latest reading for a node as a transient SensorReading (None if unknown)."""
+        with self._lock:
+            row = self._latest.get(node_id)
+        return SensorReading(**row) if row is not None else None
+
+    def latest_timestamp(self) -> Optional[datetime]:
+        """Timestamp of the newest reading across all nodes."""
+        with self._lock:
+            return max((row["timestamp"] for row in self._latest.values()), default=None)
+
+    def count_active_since(self, cutoff: datetime) -> int:
+        """Number of nodes whose latest reading is at or after cutoff."""
+        with self._lock:
+            return sum(1 for row in self._latest.values() if row["timestamp"] >= cutoff)
+
+    def all(self) -> List[SensorReading]:
+        """Latest reading of every node as transient SensorReading objects."""
+        with self._lock:
+            rows = list(self._latest.values())
+        return [SensorReading(**row) for row in rows]
+
+
+# Process-wide snapshot used by SensorService
+latest_readings = LatestReadingSnapshot()
+
+
+def load_latest_snapshot() -> None:
+    """Seed the process-wide snapshot from the database."""
+    if not PROCESS_LOCAL:
+        logger.info("Latest reading snapshot disabled: workers share state, latest readings come from the database")
+        return
+    # Imported here: sensor_service imports this module
+    from services.sensor_service import SensorService
+
+    db = SessionLocal()
+    try:
+        readings = SensorService.query_latest_per_node(db)
+        latest_readings.load(readings)
+        logger.info(f"Latest reading snapshot loaded for {len(readings)} nodes")
+    finally:
+        db.close()
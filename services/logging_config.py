@@ -0,0 +1,147 @@
+"""Application logging: queue-backed handler, per-route sampling, text or JSON lines.
+
+Every accepted reading logs several INFO lines. Records are put on a queue
+by a QueueHandler and formatted and written by a QueueListener thread, so
+the event loop no longer blocks on the stream.
+
+Success logs of busy routes can be sampled with LOG_SAMPLE_RATES, e.g.
+"/api/sensors/data=0.1". The request logging middleware decides once per
+request whether it is sampled (see sample_request), so all INFO lines of a
+request are kept or dropped together. WARNING and above are always kept.
+Dropped records are rejected before they are queued, so their messages are
+never formatted.
+
+LOG_FORMAT=json writes one JSON object per line instead of the text format.
+"""
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+# Configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE_ENABLED = os.getenv("LOG_QUEUE_ENABLED", "true").lower() in ("1", "true", "yes")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [gateway_id=%(gateway_id)s] - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Whether INFO/DEBUG records of the current request are kept
+_request_sampled: ContextVar[bool] = ContextVar("request_sampled", default=True)
+
+
+def _parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        path, rate = item.rsplit("=", 1)
+        rates[path.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+_sample_rates = _parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+def sample_request(path: str):
+    """Decide whether the success logs of a request to path are kept.
+
+    Returns:
+        A token for reset_request_sampling once the request is done
+    """
+    rate = _sample_rates.get(path)
+    sampled = rate is None or rate >= 1.0 or random.random() < rate
+    return _request_sampled.set(sampled)
+
+
+def reset_request_sampling(token) -> None:
+    _request_sampled.reset(token)
+
+
+class SamplingFilter(logging.Filter):
+    """Drop INFO/DEBUG records of requests that were not sampled."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or _request_sampled.get()
+
+
+class GatewayIdFormatter(logging.Formatter):
+    """Custom formatter that handles missing gateway_id gracefully."""
+    def format(self, record):
+        # Ensure gateway_id exists in record
+        if not hasattr(record, 'gateway_id'):
+            record.gateway_id = 'unknown'
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, logger, gateway_id, message."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "gateway_id": getattr(record, "gateway_id", "unknown"),
+            "message": record.getMessage(),
+        }
+        node_id = getattr(record, "node_id", None)
+        if node_id is not None:
+            entry["node_id"] = node_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves all layout to the listener's formatter.
+
+    The message and any traceback are rendered here, since args and
+    exception state may change after the call returns.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging() -> None:
+    """Install the root handler chain (called once from main.py at import).
+
+    With LOG_QUEUE_ENABLED the root logger only enqueues records; a
+    QueueListener thread writes them to stderr and is stopped at exit,
+    flushing whatever is still queued.
+    """
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = GatewayIdFormatter(fmt=TEXT_FORMAT, datefmt=DATE_FORMAT)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    if LOG_QUEUE_ENABLED:
+        log_queue = queue.SimpleQueue()
+        root_handler = _RecordQueueHandler(log_queue)
+        listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+    else:
+        root_handler = stream_handler
+    root_handler.addFilter(SamplingFilter())
+
+    logging.basicConfig(level=LOG_LEVEL, handlers=[root_handler])
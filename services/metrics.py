@@ -0,0 +1,310 @@
+"""In-process metrics registry exported in the Prometheus text format.
+
+Counters and latency histograms for the hot paths are defined here and
+served by GET /metrics; nothing is pushed to an external service. Recording
+is a bisect plus a few additions under a per-series lock, so instrumented
+code can call observe() on every request.
+
+Metrics are per process: with several uvicorn workers each one keeps its
+own registry and a scrape only sees the worker that answered. Detectors
+run in the fleet analysis process pool are not recorded.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+import math
+import threading
+
+# Latency buckets in seconds, from sub-millisecond in-memory paths to slow gateway calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _CounterSeries:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramSeries:
+    __slots__ = ("upper_bounds", "bucket_counts", "sum", "count", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        # One slot per bucket plus the +Inf bucket; made cumulative when rendered
+        self.bucket_counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def observe_since(self, started: float) -> float:
+        """Observe perf_counter() - started and return the new perf_counter()
+        reading, so consecutive stages can be timed with one clock read each."""
+        now = perf_counter()
+        self.observe(now - started)
+        return now
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of the with-block in seconds."""
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started)
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.bucket_counts), self.sum, self.count
+
+
+class _Metric:
+    """A named metric with zero or more labels; each label combination is a series."""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Series for the given label values (created on first use).
+
+        Hot paths should call this once at import and keep the result.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._series.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    type_name = "counter"
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, amount: float = 1) -> None:
+        """Increment the unlabelled series."""
+        self.labels().inc(amount)
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(series.value)}"
+            for key, series in self._items()
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies in seconds) over fixed buckets."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.upper_bounds = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _HistogramSeries(self.upper_bounds)
+
+    def observe(self, value: float) -> None:
+        """Observe a value on the unlabelled series."""
+        self.labels().observe(value)
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        bounds = self.upper_bounds + (math.inf,)
+        for key, series in self._items():
+            bucket_counts, total, count = series.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Gauge or counter whose value is read from a callback at scrape time.
+
+    The callback returns a number, or a dict mapping label value tuples to
+    numbers for labelled metrics. Used to export counters that other
+    components already keep (e.g. ingest queue stats) without double counting.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Union[float, Dict[Tuple[str, ...], float]]],
+        labelnames: Sequence[str] = (),
+        type_name: str = "gauge"
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.type_name = type_name
+
+    def _render_samples(self) -> List[str]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+            if value is not None
+        ]
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together by GET /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry served by GET /metrics
+registry = MetricsRegistry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def callback_metric(
+    name: str,
+    documentation: str,
+    callback: Callable[[], Union[float, Dict[Tuple[str, ...], float]]],
+    labelnames: Sequence[str] = (),
+    type_name: str = "gauge"
+) -> CallbackMetric:
+    return registry.register(CallbackMetric(name, documentation, callback, labelnames, type_name))
+
+
+# Hot-path metrics
+ingest_stage_seconds = histogram(
+    "greenhouse_ingest_stage_seconds",
+    "Time spent per ingest stage (validation, dedup, registry, insert, commit, post_commit)",
+    ("stage",)
+)
+ingest_readings_total = counter(
+    "greenhouse_ingest_readings_total",
+    "Readings processed by the ingest path by outcome",
+    ("outcome",)
+)
+system_stats_query_seconds = histogram(
+    "greenhouse_system_stats_query_seconds",
+    "Time per get_system_stats lookup, served from memory or the database",
+    ("query", "source")
+)
+trend_detector_seconds = histogram(
+    "greenhouse_trend_detector_seconds",
+    "Time per trend insight detector run",
+    ("detector",)
+)
+trend_detector_findings_total = counter(
+    "greenhouse_trend_detector_findings_total",
+    "Insights produced per trend detector",
+    ("detector",)
+)
+gateway_probe_seconds = histogram(
+    "greenhouse_gateway_probe_seconds",
+    "Outbound gateway probe latency by path and outcome",
+    ("path", "outcome")
+)
+db_pool_checkout_seconds = histogram(
+    "greenhouse_db_pool_checkout_seconds",
+    "Time spent waiting for a database connection from the pool"
+)
@@ -0,0 +1,151 @@
+"""Column-array view of a window of sensor readings for trend detection.
+
+The trend detectors only need per-metric summaries of a window (first, last,
+mean, standard deviation, min, max) plus its time range. ReadingWindow loads
+the window once with a Core select into NumPy arrays, so no ORM objects or
+per-detector Python lists are built, and every summary is a vectorised
+reduction.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import itertools
+import numpy as np
+from sqlalchemy import Float, cast, extract, func, select
+from sqlalchemy.orm import Session
+from models.database import IS_SQLITE, SensorReading
+
+# Metrics loaded into the window, in column order
+WINDOW_METRICS = ("temperature", "humidity", "soil_moisture")
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_seconds(column):
+    """SQL expression for the float Unix seconds of a naive UTC DateTime column.
+
+    Computing it in the database avoids parsing a datetime per row. SQLite
+    uses julianday (strftime('%s') would drop the fractional seconds); other
+    databases use EXTRACT(EPOCH FROM ...).
+    """
+    if IS_SQLITE:
+        return (func.julianday(column) - 2440587.5) * 86400.0
+    return cast(extract("epoch", column), Float)
+
+
+class ReadingWindow:
+    """Readings of a time window as NumPy column arrays, ordered by timestamp.
+
+    Timestamps are float seconds since the Unix epoch (UTC).
+    """
+
+    __slots__ = ("timestamps", "columns")
+
+    def __init__(self, timestamps: np.ndarray, columns: dict):
+        self.timestamps = timestamps
+        self.columns = columns
+
+    @classmethod
+    def from_array(cls, data: np.ndarray) -> "ReadingWindow":
+        """Build a window from an (n, 4) array of epoch seconds and WINDOW_METRICS columns."""
+        return cls(
+            np.ascontiguousarray(data[:, 0]),
+            {metric: np.ascontiguousarray(data[:, i + 1]) for i, metric in enumerate(WINDOW_METRICS)}
+        )
+
+    @classmethod
+    def empty(cls) -> "ReadingWindow":
+        """A window without readings."""
+        return cls.from_array(np.empty((0, 1 + len(WINDOW_METRICS))))
+
+    @classmethod
+    def load(cls, db: Session, node_id: Optional[str] = None, minutes: int = 60) -> "ReadingWindow":
+        """Load the readings of the last N minutes.
+
+        Args:
+            db: Database session
+            node_id: Optional filter by node ID
+            minutes: Window length in minutes
+
+        Returns:
+            ReadingWindow ordered by timestamp (oldest first)
+        """
+        cutoff_time = datetime.utcnow() - timedelta(minutes=minutes)
+        stmt = (
+            select(epoch_seconds(SensorReading.timestamp), *(getattr(SensorReading, metric) for metric in WINDOW_METRICS))
+            .where(SensorReading.timestamp >= cutoff_time)
+        )
+        if node_id:
+            stmt = stmt.where(SensorReading.node_id == node_id)
+        stmt = stmt.order_by(SensorReading.timestamp)
+        # A Core result on the session's connection yields plain rows that
+        # np.fromiter can consume without building an intermediate list
+        result = db.connection().execute(stmt)
+        values = np.fromiter(itertools.chain.from_iterable(result), dtype=np.float64)
+        return cls.from_array(values.reshape(-1, 1 + len(WINDOW_METRICS)))
+
+    @classmethod
+    def load_by_node(cls, db: Session, minutes: int = 60) -> Dict[str, "ReadingWindow"]:
+        """Load the readings of the last N minutes for every node in one query.
+
+        Args:
+            db: Database session
+            minutes: Window length in minutes
+
+        Returns:
+            ReadingWindow per node ID, each ordered by timestamp (oldest first)
+        """
+        cutoff_time = datetime.utcnow() - timedelta(minutes=minutes)
+        stmt = (
+            select(SensorReading.node_id, epoch_seconds(SensorReading.timestamp), *(getattr(SensorReading, metric) for metric in WINDOW_METRICS))
+            .where(SensorReading.timestamp >= cutoff_time)
+            .order_by(SensorReading.node_id, SensorReading.timestamp)
+        )
+        result = db.connection().execute(stmt)
+        windows = {}
+        # Rows arrive grouped by node, so each group is one contiguous window
+        for node_id, rows in itertools.groupby(result, key=lambda row: row[0]):
+            values = np.fromiter(
+                itertools.chain.from_iterable(row[1:] for row in rows), dtype=np.float64
+            )
+            windows[node_id] = cls.from_array(values.reshape(-1, 1 + len(WINDOW_METRICS)))
+        return windows
+
+    @property
+    def count(self) -> int:
+        return len(self.timestamps)
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def first_timestamp(self) -> datetime:
+        return _EPOCH + timedelta(seconds=float(self.timestamps[0]))
+
+    @property
+    def last_timestamp(self) -> datetime:
+        return _EPOCH + timedelta(seconds=float(self.timestamps[-1]))
+
+    @property
+    def span_hours(self) -> float:
+        """Hours between the first and last reading."""
+        return float(self.timestamps[-1] - self.timestamps[0]) / 3600
+
+    def first(self, metric: str) -> float:
+        return float(self.columns[metric][0])
+
+    def last(self, metric: str) -> float:
+        return float(self.columns[metric][-1])
+
+    def mean(self, metric: str) -> float:
+        return float(self.columns[metric].mean())
+
+    def stdev(self, metric: str) -> float:
+        """Sample standard deviation (0.0 for fewer than two readings)."""
+        values = self.columns[metric]
+        return float(values.std(ddof=1)) if len(values) > 1 else 0.0
+
+    def min(self, metric: str) -> float:
+        return float(self.columns[metric].min())
+
+    def max(self, metric: str) -> float:
+        return float(self.columns[metric].max())
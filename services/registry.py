@@ -0,0 +1,317 @@
+"""In-process registry of known gateways and sensor nodes.
+
+Every reading used to SELECT its gateway and node and write back last_seen.
+The registry answers "is this ID known?" from memory and keeps last_seen,
+is_online and the gateway IP addresses there. Changed entries are flushed to
+the gateways and sensor_nodes tables by a periodic background task
+(see flush_registry). Only IDs the registry has never seen go to the database
+synchronously, as part of the caller's transaction.
+
+With a multi-process shared-state backend only the worker holding the
+"registry-flush" lease writes to the database. The other workers hand their
+changed entries to it through the shared state, where the newest last_seen
+per gateway or node wins.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+import logging
+import os
+import threading
+from sqlalchemy import bindparam, event, select, update
+from sqlalchemy.orm import Session
+from models.database import Gateway, SensorNode, SessionLocal
+from services.shared_state import SHARED_STATE_LEASE_SECONDS, SharedMap, shared_lease, shared_map
+
+logger = logging.getLogger(__name__)
+
+# How often dirty last_seen/is_online/IP values are written to the database
+REGISTRY_FLUSH_INTERVAL_SECONDS = float(os.getenv("REGISTRY_FLUSH_INTERVAL_SECONDS", "10"))
+
+# Session.info key holding registrations that become visible once the session commits
+_PENDING_KEY = "device_registry_pending"
+
+# Changed entries handed off by workers not holding the flush lease, keyed
+# "gateway:<id>" or "node:<id>", with last_seen as an ISO string
+_handed_off: SharedMap = shared_map("registry_pending")
+
+_flush_lease = shared_lease("registry-flush", REGISTRY_FLUSH_INTERVAL_SECONDS * 2 + SHARED_STATE_LEASE_SECONDS)
+
+# Changed entries: ({gateway_id: entry}, {node_id: entry})
+_Changes = Tuple[Dict[str, dict], Dict[str, dict]]
+
+
+class DeviceRegistry:
+    """Thread-safe in-memory view of the gateways and sensor_nodes tables."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._gateways: Dict[str, dict] = {}
+        self._nodes: Dict[str, dict] = {}
+        self._dirty_gateways: Set[str] = set()
+        self._dirty_nodes: Set[str] = set()
+
+    def load(self, db: Session) -> None:
+        """Seed the registry with every gateway and node in the database."""
+        gateways = db.execute(
+            select(Gateway.gateway_id, Gateway.last_seen, Gateway.is_online, Gateway.local_ip, Gateway.client_ip)
+        ).all()
+        nodes = db.execute(select(SensorNode.node_id, SensorNode.gateway_id, SensorNode.last_seen)).all()
+        with self._lock:
+            for gateway_id, last_seen, is_online, local_ip, client_ip in gateways:
+                self._gateways.setdefault(gateway_id, {
+                    "last_seen": last_seen,
+                    "is_online": is_online,
+                    "local_ip": local_ip,
+                    "client_ip": client_ip,
+                })
+            for node_id, gateway_id, last_seen in nodes:
+                self._nodes.setdefault(node_id, {"gateway_id": gateway_id, "last_seen": last_seen})
+        logger.info(f"Device registry loaded: {len(gateways)} gateways, {len(nodes)} nodes")
+
+    def touch_gateway(
+        self,
+        gateway_id: str,
+        local_ip: Optional[str] = None,
+        client_ip: Optional[str] = None
+    ) -> bool:
+        """Mark a known gateway as seen now.
+
+        Returns:
+            True if the gateway is known (updated in memory), False if it must
+            be registered in the database first
+        """
+        with self._lock:
+            entry = self._gateways.get(gateway_id)
+            if entry is None:
+                return False
+            entry["last_seen"] = datetime.utcnow()
+            entry["is_online"] = True
+            if local_ip and local_ip != "0.0.0.0":
+                entry["local_ip"] = local_ip
+            if client_ip:
+                entry["client_ip"] = client_ip
+            self._dirty_gateways.add(gateway_id)
+            return True
+
+    def touch_node(self, node_id: str, gateway_id: str) -> bool:
+        """Mark a known node as seen now via the given gateway.
+
+        Returns:
+            True if the node is known (updated in memory), False if it must
+            be registered in the database first
+        """
+        with self._lock:
+            entry = self._nodes.get(node_id)
+            if entry is None:
+                return False
+            entry["last_seen"] = datetime.utcnow()
+            entry["gateway_id"] = gateway_id
+            self._dirty_nodes.add(node_id)
+            return True
+
+    def add_gateway_on_commit(self, db: Session, gateway: Gateway) -> None:
+        """Add a gateway written in the given session once that session commits."""
+        db.info.setdefault(_PENDING_KEY, []).append(("gateway", gateway.gateway_id, {
+            "last_seen": gateway.last_seen,
+            "is_online": gateway.is_online,
+            "local_ip": gateway.local_ip,
+            "client_ip": gateway.client_ip,
+        }))
+
+    def add_node_on_commit(self, db: Session, node: SensorNode) -> None:
+        """Add a node written in the given session once that session commits."""
+        db.info.setdefault(_PENDING_KEY, []).append(("node", node.node_id, {
+            "gateway_id": node.gateway_id,
+            "last_seen": node.last_seen,
+        }))
+
+    def _apply_pending(self, pending: list) -> None:
+        with self._lock:
+            for kind, key, entry in pending:
+                if kind == "gateway":
+                    self._gateways.setdefault(key, entry)
+                else:
+                    self._nodes.setdefault(key, entry)
+
+    def get_gateway(self, gateway_id: str) -> Optional[dict]:
+        """Get a copy of the in-memory state for a gateway (None if unknown)."""
+        with self._lock:
+            entry = self._gateways.get(gateway_id)
+            return dict(entry) if entry is not None else None
+
+    def gateway_ids(self) -> List[str]:
+        """IDs of every known gateway."""
+        with self._lock:
+            return list(self._gateways)
+
+    def node_ids(self) -> List[str]:
+        """IDs of every known sensor node."""
+        with self._lock:
+            return list(self._nodes)
+
+    def _take_dirty(self) -> _Changes:
+        """Copy the changed entries and mark them clean."""
+        with self._lock:
+            gateways = {gateway_id: dict(self._gateways[gateway_id]) for gateway_id in self._dirty_gateways}
+            nodes = {node_id: dict(self._nodes[node_id]) for node_id in self._dirty_nodes}
+            self._dirty_gateways.clear()
+            self._dirty_nodes.clear()
+        return gateways, nodes
+
+    def _restore_dirty(self, gateways: Dict[str, dict], nodes: Dict[str, dict]) -> None:
+        """Mark entries dirty again so the next flush retries them."""
+        with self._lock:
+            self._dirty_gateways.update(gateways)
+            self._dirty_nodes.update(nodes)
+
+    def hand_off(self, pending: SharedMap) -> Tuple[int, int]:
+        """Move changed entries to the shared map the flush lease holder writes from.
+
+        Returns:
+            (gateways_handed_off, nodes_handed_off)
+        """
+        gateways, nodes = self._take_dirty()
+        try:
+            _put_pending(pending, gateways, nodes)
+        except Exception:
+            self._restore_dirty(gateways, nodes)
+            raise
+        return len(gateways), len(nodes)
+
+    def flush(self, db: Session, pending: Optional[SharedMap] = None) -> Tuple[int, int]:
+        """Write changed gateway and node state to the database.
+
+        Args:
+            db: Database session
+            pending: Shared map of entries handed off by other workers, written
+                (and removed) along with this registry's own changes
+
+        Returns:
+            (gateways_written, nodes_written)
+        """
+        gateways, nodes = self._take_dirty()
+        handed_gateways, handed_nodes = _take_pending(pending) if pending is not None else ({}, {})
+        merged_gateways = _merge_newest(handed_gateways, gateways)
+        merged_nodes = _merge_newest(handed_nodes, nodes)
+        if not merged_gateways and not merged_nodes:
+            return 0, 0
+
+        # Bind names must not clash with the SET column names
+        gateway_rows = [
+            {"b_gateway_id": gateway_id, **{f"b_{k}": v for k, v in entry.items()}}
+            for gateway_id, entry in merged_gateways.items()
+        ]
+        node_rows = [
+            {"b_node_id": node_id, **{f"b_{k}": v for k, v in entry.items()}}
+            for node_id, entry in merged_nodes.items()
+        ]
+
+        try:
+            if gateway_rows:
+                db.execute(
+                    update(Gateway.__table__)
+                    .where(Gateway.__table__.c.gateway_id == bindparam("b_gateway_id"))
+                    .values(
+                        last_seen=bindparam("b_last_seen"),
+                        is_online=bindparam("b_is_online"),
+                        local_ip=bindparam("b_local_ip"),
+                        client_ip=bindparam("b_client_ip"),
+                    ),
+                    gateway_rows
+                )
+            if node_rows:
+                db.execute(
+                    update(SensorNode.__table__)
+                    .where(SensorNode.__table__.c.node_id == bindparam("b_node_id"))
+                    .values(last_seen=bindparam("b_last_seen"), gateway_id=bindparam("b_gateway_id")),
+                    node_rows
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Keep the entries dirty (or handed off) so the next flush retries them
+            self._restore_dirty(gateways, nodes)
+            if handed_gateways or handed_nodes:
+                _put_pending(pending, handed_gateways, handed_nodes)
+            raise
+        return len(gateway_rows), len(node_rows)
+
+
+def _merge_newest(*sources: Dict[str, dict]) -> Dict[str, dict]:
+    """Combine entries by ID, keeping the one with the latest last_seen."""
+    merged: Dict[str, dict] = {}
+    for entries in sources:
+        for key, entry in entries.items():
+            current = merged.get(key)
+            if current is None or (entry["last_seen"] or datetime.min) >= (current["last_seen"] or datetime.min):
+                merged[key] = entry
+    return merged
+
+
+def _put_pending(pending: SharedMap, gateways: Dict[str, dict], nodes: Dict[str, dict]) -> None:
+    for kind, entries in (("gateway", gateways), ("node", nodes)):
+        for key, entry in entries.items():
+            encoded = {**entry, "last_seen": entry["last_seen"].isoformat() if entry["last_seen"] else ""}
+
+            # ISO timestamps of the same format compare in time order
+            def newest(current: Optional[dict], encoded: dict = encoded) -> dict:
+                if current is None or encoded["last_seen"] >= current["last_seen"]:
+                    return encoded
+                return current
+            pending.update_item(f"{kind}:{key}", newest)
+
+
+def _take_pending(pending: SharedMap) -> _Changes:
+    changes: _Changes = ({}, {})
+    for pending_key in list(pending):
+        entry = pending.pop(pending_key, None)
+        if entry is None:
+            continue
+        kind, key = pending_key.split(":", 1)
+        entry["last_seen"] = datetime.fromisoformat(entry["last_seen"]) if entry["last_seen"] else None
+        changes[0 if kind == "gateway" else 1][key] = entry
+    return changes
+
+
+# Process-wide registry used by the service layer
+device_registry = DeviceRegistry()
+
+
+@event.listens_for(Session, "after_commit")
+def _registry_after_commit(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        device_registry._apply_pending(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _registry_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def load_registry() -> None:
+    """Seed the process-wide registry from the database."""
+    db = SessionLocal()
+    try:
+        device_registry.load(db)
+    finally:
+        db.close()
+
+
+def flush_registry() -> None:
+    """Flush the process-wide registry to the database.
+
+    Workers not holding the flush lease hand their changes off instead.
+    """
+    if not _flush_lease.acquire():
+        gateways, nodes = device_registry.hand_off(_handed_off)
+        if gateways or nodes:
+            logger.debug(f"Device registry handed off: {gateways} gateways, {nodes} nodes")
+        return
+    db = SessionLocal()
+    try:
+        gateways, nodes = device_registry.flush(db, pending=_handed_off)
+        if gateways or nodes:
+            logger.debug(f"Device registry flushed: {gateways} gateways, {nodes} nodes")
+    finally:
+        db.close()
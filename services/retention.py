@@ -0,0 +1,221 @@
+"""Retention policy for raw readings and rollups.
+
+Opt-in (RETENTION_ENABLED): once enabled, a periodic background task
+deletes data past its retention period:
+raw sensor_readings after RETENTION_RAW_DAYS, 1-minute rollups after
+RETENTION_MINUTE_ROLLUP_DAYS and hourly rollups after
+RETENTION_HOURLY_ROLLUP_DAYS (0 keeps them forever; daily rollups are always
+kept). Rows are deleted in bounded batches, each in its own short
+transaction, so the ingest writer never waits long for the write lock.
+Freed pages are then returned to the filesystem with incremental VACUUM.
+
+Incremental VACUUM needs auto_vacuum=INCREMENTAL. New databases get it at
+startup for free; an existing database has to be rewritten by a full VACUUM
+(blocking, exclusive, about 2x its size in free disk), which is left to a
+maintenance window:
+
+    python -m services.retention --convert-incremental-vacuum
+
+Until then retention still deletes rows but skips the incremental VACUUM.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+import argparse
+import logging
+import os
+import threading
+import time
+from sqlalchemy import DateTime, bindparam, text
+from models.database import IS_SQLITE, SensorReading, SensorRollup, SessionLocal, engine
+from services.latest_snapshot import latest_readings
+from services.rollup_service import RollupService
+from services.system_stats import increment_message_count
+
+logger = logging.getLogger(__name__)
+
+# Configuration (days; 0 disables deletion for that tier). Off by default:
+# enabling it permanently deletes data older than the configured periods
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "false").lower() in ("1", "true", "yes")
+RETENTION_RAW_DAYS = float(os.getenv("RETENTION_RAW_DAYS", "14"))
+RETENTION_MINUTE_ROLLUP_DAYS = float(os.getenv("RETENTION_MINUTE_ROLLUP_DAYS", "365"))
+RETENTION_HOURLY_ROLLUP_DAYS = float(os.getenv("RETENTION_HOURLY_ROLLUP_DAYS", "0"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_DELETE_BATCH_SIZE = int(os.getenv("RETENTION_DELETE_BATCH_SIZE", "5000"))
+# Pause between delete batches so queued ingest writes get the lock
+RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", "0.05"))
+
+_last_run: Optional[dict] = None
+_run_lock = threading.Lock()
+_vacuum_hint_logged = False
+
+
+def _database_size(conn) -> int:
+    page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+    page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+    return page_count * page_size
+
+
+def incremental_vacuum_enabled(conn) -> bool:
+    return conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2
+
+
+def enable_incremental_vacuum(convert_existing: bool = False) -> None:
+    """Switch the database to auto_vacuum=INCREMENTAL if it is not already.
+
+    The mode only takes effect after a full VACUUM. On a database without
+    tables (called before init_db) that is instant; an existing database is
+    only converted with convert_existing, since the VACUUM rewrites the whole
+    file under an exclusive lock.
+
+    Args:
+        convert_existing: Also convert a database that already holds data
+            (maintenance command only, never at application startup)
+    """
+    if not IS_SQLITE:
+        return
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if incremental_vacuum_enabled(conn):
+            return
+        is_empty = conn.exec_driver_sql("SELECT COUNT(*) FROM sqlite_master").scalar() == 0
+        if not is_empty and not convert_existing:
+            return
+        logger.info("Converting database to auto_vacuum=INCREMENTAL (one-time VACUUM)")
+        started = time.perf_counter()
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        logger.info(f"Database converted to incremental vacuum in {time.perf_counter() - started:.1f}s")
+
+
+def _delete_in_batches(table: str, key: str, where: str, params: dict) -> int:
+    """Delete matching rows about RETENTION_DELETE_BATCH_SIZE at a time, one transaction per batch.
+
+    Each batch deletes the matching rows whose key is at most the key of the
+    batch_size-th oldest match, found in a LIMIT subquery wrapped in a derived
+    table (portable across databases, unlike rowid or LIMIT inside IN). With a
+    non-unique key, rows sharing the boundary value go in the same batch.
+    """
+    statement = text(
+        f"DELETE FROM {table} WHERE {where} AND {key} <= "
+        f"(SELECT MAX({key}) FROM (SELECT {key} FROM {table} WHERE {where} "
+        f"ORDER BY {key} LIMIT :batch_size) AS oldest)"
+    ).bindparams(bindparam("cutoff", type_=DateTime))
+    removed = 0
+    while True:
+        db = SessionLocal()
+        try:
+            deleted = db.execute(statement, {**params, "batch_size": RETENTION_DELETE_BATCH_SIZE}).rowcount
+            db.commit()
+        finally:
+            db.close()
+        removed += deleted
+        if deleted < RETENTION_DELETE_BATCH_SIZE:
+            return removed
+        time.sleep(RETENTION_BATCH_PAUSE_SECONDS)
+
+
+def run_retention() -> dict:
+    """Apply the retention policy once.
+
+    Returns:
+        Rows removed per tier, bytes reclaimed and run duration
+    """
+    global _last_run, _vacuum_hint_logged
+    with _run_lock:
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        with engine.connect() as conn:
+            size_before = _database_size(conn) if IS_SQLITE else 0
+
+        raw_removed = 0
+        # Raw readings not yet folded into the rollups would be lost from them
+        db = SessionLocal()
+        try:
+            backfill_pending = RollupService.backfill_pending(db)
+        finally:
+            db.close()
+        if backfill_pending:
+            logger.info("Retention keeps raw readings until the rollup backfill has finished")
+        elif RETENTION_RAW_DAYS > 0:
+            raw_cutoff = now - timedelta(days=RETENTION_RAW_DAYS)
+            raw_removed = _delete_in_batches(
+                SensorReading.__tablename__, "id", "timestamp < :cutoff", {"cutoff": raw_cutoff}
+            )
+            if raw_removed:
+                # Keep the status counters and latest snapshot in line with the table
+                increment_message_count(-raw_removed)
+                latest_readings.prune(raw_cutoff)
+
+        rollups_removed = {}
+        for bucket_seconds, days in ((60, RETENTION_MINUTE_ROLLUP_DAYS), (3600, RETENTION_HOURLY_ROLLUP_DAYS)):
+            if days > 0:
+                rollups_removed[bucket_seconds] = _delete_in_batches(
+                    SensorRollup.__tablename__,
+                    "bucket_start",
+                    "bucket_seconds = :bucket_seconds AND bucket_start < :cutoff",
+                    {"bucket_seconds": bucket_seconds, "cutoff": now - timedelta(days=days)}
+                )
+
+        bytes_reclaimed = 0
+        vacuumed = False
+        if IS_SQLITE:
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                if incremental_vacuum_enabled(conn):
+                    # sqlite3's execute() steps the pragma once, freeing a single page;
+                    # executescript() runs it to completion
+                    conn.connection.driver_connection.executescript("PRAGMA incremental_vacuum;")
+                    bytes_reclaimed = max(size_before - _database_size(conn), 0)
+                    vacuumed = True
+                elif not _vacuum_hint_logged:
+                    _vacuum_hint_logged = True
+                    logger.info(
+                        "Retention skips incremental VACUUM: database is not in auto_vacuum=INCREMENTAL mode. "
+                        "Convert it in a maintenance window with "
+                        "`python -m services.retention --convert-incremental-vacuum`"
+                    )
+
+        _last_run = {
+            "finished_at": datetime.utcnow().isoformat(),
+            "duration_seconds": round(time.perf_counter() - started, 3),
+            "raw_rows_removed": raw_removed,
+            "minute_rollups_removed": rollups_removed.get(60, 0),
+            "hourly_rollups_removed": rollups_removed.get(3600, 0),
+            "bytes_reclaimed": bytes_reclaimed,
+            "incremental_vacuum": vacuumed,
+        }
+        if raw_removed or rollups_removed.get(60) or rollups_removed.get(3600) or bytes_reclaimed:
+            logger.info(
+                f"Retention removed {raw_removed} readings, {rollups_removed.get(60, 0)} minute rollups, "
+                f"{rollups_removed.get(3600, 0)} hourly rollups; reclaimed {bytes_reclaimed} bytes "
+                f"in {_last_run['duration_seconds']}s"
+            )
+        return _last_run
+
+
+def retention_stats() -> dict:
+    """Configured policy and the result of the last run."""
+    return {
+        "enabled": RETENTION_ENABLED,
+        "raw_days": RETENTION_RAW_DAYS,
+        "minute_rollup_days": RETENTION_MINUTE_ROLLUP_DAYS,
+        "hourly_rollup_days": RETENTION_HOURLY_ROLLUP_DAYS,
+        "interval_seconds": RETENTION_INTERVAL_SECONDS,
+        "last_run": _last_run,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retention maintenance tasks")
+    parser.add_argument(
+        "--convert-incremental-vacuum",
+        action="store_true",
+        help="Rewrite the database with a full VACUUM to enable auto_vacuum=INCREMENTAL "
+             "(blocks writers; needs free disk of about the database size)"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.convert_incremental_vacuum:
+        enable_incremental_vacuum(convert_existing=True)
+    else:
+        parser.print_help()
@@ -0,0 +1,347 @@
+"""Incremental maintenance of the sensor_rollups table.
+
+Every stored reading is folded into its 1-minute, 1-hour and 1-day bucket in
+the same transaction as the raw insert. Readings of one batch are first
+pre-aggregated in Python, then merged into the table with a single
+INSERT ... ON CONFLICT DO UPDATE executemany, which adds counts and sums,
+widens min/max and keeps first/last by timestamp, so late or out-of-order
+readings land in the right bucket.
+
+Readings stored before the rollups existed are folded in after startup by a
+background task, one chunk of reading ids per transaction, with its progress
+kept in the rollup_backfill table; `python -m services.rollup_service
+--backfill` does the same offline.
+
+The upsert is built for SQLite and PostgreSQL. On other databases no rollups
+are maintained (ROLLUPS_ENABLED is False) and readers aggregate the raw
+readings instead.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import argparse
+import asyncio
+import logging
+import os
+import time
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models.database import RollupBackfill, SensorReading, SensorRollup, SessionLocal, engine, init_db
+from services.shared_state import shared_lease
+
+logger = logging.getLogger(__name__)
+
+# Bucket widths maintained on ingest (1 minute, 1 hour, 1 day)
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+
+# Non-nullable metrics: sum/min/max/first/last per bucket
+ROLLUP_METRICS = ("temperature", "humidity", "soil_moisture")
+
+# Configuration
+# Readings folded into the rollups per transaction during backfill
+ROLLUP_BACKFILL_CHUNK_SIZE = int(os.getenv("ROLLUP_BACKFILL_CHUNK_SIZE", "5000"))
+# Pause between backfill chunks so ingest writes get the lock
+ROLLUP_BACKFILL_PAUSE_SECONDS = float(os.getenv("ROLLUP_BACKFILL_PAUSE_SECONDS", "0.05"))
+
+# Primary key of the single rollup_backfill row
+_BACKFILL_ID = 1
+# Delay before a failed or lease-less backfill worker tries again
+_BACKFILL_RETRY_SECONDS = 5
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE, and their scalar min/max
+# (SQLite's two-argument min()/max(); LEAST/GREATEST elsewhere)
+_UPSERT_DIALECTS = {
+    "sqlite": (sqlite_insert, func.min, func.max),
+    "postgresql": (postgresql_insert, func.least, func.greatest),
+}
+
+# False on databases without a supported upsert; readers then use the raw table
+ROLLUPS_ENABLED = engine.dialect.name in _UPSERT_DIALECTS
+
+
+def bucket_start(timestamp: datetime, bucket_seconds: int) -> datetime:
+    """Start of the bucket of the given width that contains timestamp."""
+    seconds = int((timestamp - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % bucket_seconds)
+
+
+class RollupService:
+    """Service for maintaining and reading pre-aggregated sensor data."""
+
+    @staticmethod
+    def aggregate(rows: Iterable[dict]) -> List[dict]:
+        """Pre-aggregate readings into one partial rollup per node and bucket.
+
+        Args:
+            rows: Reading column values (node_id, timestamp and the metrics)
+
+        Returns:
+            Rollup rows ready for the upsert in apply()
+        """
+        buckets: Dict[Tuple[str, int, datetime], dict] = {}
+        for row in rows:
+            timestamp = row["timestamp"]
+            light = row.get("light_level")
+            for bucket_seconds in ROLLUP_RESOLUTIONS:
+                key = (row["node_id"], bucket_seconds, bucket_start(timestamp, bucket_seconds))
+                item = buckets.get(key)
+                if item is None:
+                    item = {
+                        "node_id": key[0],
+                        "bucket_seconds": bucket_seconds,
+                        "bucket_start": key[2],
+                        "count": 0,
+                        "first_ts": timestamp,
+                        "last_ts": timestamp,
+                        "light_level_count": 0,
+                        "light_level_sum": None,
+                        "light_level_min": None,
+                        "light_level_max": None,
+                    }
+                    for metric in ROLLUP_METRICS:
+                        value = row[metric]
+                        item[f"{metric}_sum"] = 0.0
+                        item[f"{metric}_min"] = value
+                        item[f"{metric}_max"] = value
+                        item[f"{metric}_first"] = value
+                        item[f"{metric}_last"] = value
+                    buckets[key] = item
+
+                item["count"] += 1
+                for metric in ROLLUP_METRICS:
+                    value = row[metric]
+                    item[f"{metric}_sum"] += value
+                    if value < item[f"{metric}_min"]:
+                        item[f"{metric}_min"] = value
+                    if value > item[f"{metric}_max"]:
+                        item[f"{metric}_max"] = value
+                    if timestamp < item["first_ts"]:
+                        item[f"{metric}_first"] = value
+                    if timestamp >= item["last_ts"]:
+                        item[f"{metric}_last"] = value
+                if timestamp < item["first_ts"]:
+                    item["first_ts"] = timestamp
+                if timestamp >= item["last_ts"]:
+                    item["last_ts"] = timestamp
+
+                if light is not None:
+                    item["light_level_count"] += 1
+                    item["light_level_sum"] = (item["light_level_sum"] or 0.0) + light
+                    item["light_level_min"] = light if item["light_level_min"] is None else min(item["light_level_min"], light)
+                    item["light_level_max"] = light if item["light_level_max"] is None else max(item["light_level_max"], light)
+        return list(buckets.values())
+
+    @staticmethod
+    def apply(db: Session, rows: List[dict]) -> None:
+        """Fold readings into the rollups as part of the caller's transaction.
+
+        Args:
+            db: Database session (the caller commits)
+            rows: Reading column values (node_id, timestamp and the metrics)
+        """
+        if not ROLLUPS_ENABLED:
+            return
+        rollups = RollupService.aggregate(rows)
+        if not rollups:
+            return
+
+        upsert, least, greatest = _UPSERT_DIALECTS[engine.dialect.name]
+        table = SensorRollup.__table__
+        stmt = upsert(table)
+        new = stmt.excluded
+        values = {
+            "count": table.c.count + new.count,
+            "first_ts": least(table.c.first_ts, new.first_ts),
+            "last_ts": greatest(table.c.last_ts, new.last_ts),
+            "light_level_count": table.c.light_level_count + new.light_level_count,
+            "light_level_sum": func.coalesce(
+                table.c.light_level_sum + new.light_level_sum, table.c.light_level_sum, new.light_level_sum
+            ),
+            "light_level_min": func.coalesce(
+                least(table.c.light_level_min, new.light_level_min), table.c.light_level_min, new.light_level_min
+            ),
+            "light_level_max": func.coalesce(
+                greatest(table.c.light_level_max, new.light_level_max), table.c.light_level_max, new.light_level_max
+            ),
+        }
+        for metric in ROLLUP_METRICS:
+            values[f"{metric}_sum"] = table.c[f"{metric}_sum"] + new[f"{metric}_sum"]
+            values[f"{metric}_min"] = least(table.c[f"{metric}_min"], new[f"{metric}_min"])
+            values[f"{metric}_max"] = greatest(table.c[f"{metric}_max"], new[f"{metric}_max"])
+            values[f"{metric}_first"] = case(
+                (new.first_ts < table.c.first_ts, new[f"{metric}_first"]), else_=table.c[f"{metric}_first"]
+            )
+            values[f"{metric}_last"] = case(
+                (new.last_ts >= table.c.last_ts, new[f"{metric}_last"]), else_=table.c[f"{metric}_last"]
+            )
+
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[table.c.node_id, table.c.bucket_seconds, table.c.bucket_start],
+                set_=values
+            ),
+            rollups
+        )
+
+    @staticmethod
+    def plan_backfill(db: Session) -> int:
+        """Record which stored readings predate rollup maintenance (once per database).
+
+        Must run before this process ingests anything: readings up to the
+        current highest id are left to backfill_chunk(), later ones are folded
+        on ingest. A database whose rollups are already populated has nothing
+        to backfill.
+
+        Returns:
+            Highest reading id to backfill (0 if nothing to do or already planned)
+        """
+        if not ROLLUPS_ENABLED or db.get(RollupBackfill, _BACKFILL_ID) is not None:
+            return 0
+        end_reading_id = 0
+        if db.query(SensorRollup.node_id).first() is None:
+            end_reading_id = db.query(func.max(SensorReading.id)).scalar() or 0
+        db.add(RollupBackfill(
+            id=_BACKFILL_ID,
+            last_reading_id=0,
+            end_reading_id=end_reading_id,
+            finished_at=None if end_reading_id else datetime.utcnow()
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker planned it first
+            db.rollback()
+            return 0
+        return end_reading_id
+
+    @staticmethod
+    def backfill_pending(db: Session) -> bool:
+        """Whether planned readings are still waiting to be folded into the rollups."""
+        progress = db.execute(
+            select(RollupBackfill.last_reading_id, RollupBackfill.end_reading_id)
+            .where(RollupBackfill.id == _BACKFILL_ID)
+        ).one_or_none()
+        return progress is not None and progress.last_reading_id < progress.end_reading_id
+
+    @staticmethod
+    def backfill_chunk(db: Session) -> Optional[int]:
+        """Fold the next ROLLUP_BACKFILL_CHUNK_SIZE pre-rollup readings into the rollups.
+
+        The chunk and the advanced progress marker commit together, and the
+        marker only moves if nobody else moved it meanwhile, so a crash or a
+        concurrent run never folds a reading twice.
+
+        Returns:
+            Readings folded, or None when the backfill is complete
+        """
+        progress = db.execute(
+            select(RollupBackfill.last_reading_id, RollupBackfill.end_reading_id)
+            .where(RollupBackfill.id == _BACKFILL_ID)
+        ).one_or_none()
+        if progress is None or progress.last_reading_id >= progress.end_reading_id:
+            return None
+
+        columns = ("id", "node_id", "timestamp", "light_level") + ROLLUP_METRICS
+        chunk = [dict(row._mapping) for row in db.execute(
+            select(*(getattr(SensorReading, column) for column in columns))
+            .where(SensorReading.id > progress.last_reading_id, SensorReading.id <= progress.end_reading_id)
+            .order_by(SensorReading.id)
+            .limit(ROLLUP_BACKFILL_CHUNK_SIZE)
+        )]
+        RollupService.apply(db, chunk)
+        last_reading_id = chunk[-1]["id"] if len(chunk) == ROLLUP_BACKFILL_CHUNK_SIZE else progress.end_reading_id
+        values = {"last_reading_id": last_reading_id}
+        if last_reading_id >= progress.end_reading_id:
+            values["finished_at"] = datetime.utcnow()
+        moved = db.execute(
+            update(RollupBackfill)
+            .where(RollupBackfill.id == _BACKFILL_ID, RollupBackfill.last_reading_id == progress.last_reading_id)
+            .values(**values)
+        ).rowcount
+        if moved != 1:
+            db.rollback()
+            return 0
+        db.commit()
+        return len(chunk)
+
+
+def plan_rollup_backfill() -> None:
+    """Record the readings to backfill (application startup, before ingest begins)."""
+    db = SessionLocal()
+    try:
+        end_reading_id = RollupService.plan_backfill(db)
+        if end_reading_id:
+            logger.info(f"Sensor rollups will be backfilled from readings up to id {end_reading_id}")
+    finally:
+        db.close()
+
+
+def _backfill_step() -> Optional[int]:
+    db = SessionLocal()
+    try:
+        return RollupService.backfill_chunk(db)
+    finally:
+        db.close()
+
+
+def backfill_rollups() -> int:
+    """Run the planned backfill to completion in this thread (offline maintenance command).
+
+    Returns:
+        Number of readings folded into the rollups
+    """
+    plan_rollup_backfill()
+    total = 0
+    while (folded := _backfill_step()) is not None:
+        total += folded
+        time.sleep(ROLLUP_BACKFILL_PAUSE_SECONDS)
+    return total
+
+
+async def run_rollup_backfill() -> None:
+    """Background task: fold the planned readings chunk by chunk, then exit.
+
+    With workers sharing state only the holder of the "rollup-backfill" lease
+    works on it; the others wait and take over if the holder goes away.
+    Older history fills in as the backfill proceeds.
+    """
+    lease = shared_lease("rollup-backfill")
+    total = 0
+    while True:
+        try:
+            if not await asyncio.to_thread(lease.acquire):
+                await asyncio.sleep(_BACKFILL_RETRY_SECONDS)
+                continue
+            folded = await asyncio.to_thread(_backfill_step)
+        except Exception as e:
+            logger.error(f"Rollup backfill failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(_BACKFILL_RETRY_SECONDS)
+            continue
+        if folded is None:
+            break
+        total += folded
+        await asyncio.sleep(ROLLUP_BACKFILL_PAUSE_SECONDS)
+    await asyncio.to_thread(lease.release)
+    if total:
+        logger.info(f"Sensor rollups backfilled from {total} readings")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rollup maintenance tasks")
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Fold readings stored before rollups existed into sensor_rollups now "
+             "(otherwise the application does it in the background)"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.backfill:
+        init_db()
+        logger.info(f"Sensor rollups backfilled from {backfill_rollups()} readings")
+    else:
+        parser.print_help()
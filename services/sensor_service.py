@@ -1,18 +1,74 @@
 """Service layer for sensor data operations."""
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List, Optional
+from sqlalchemy import Integer, and_, cast, desc, extract, func, insert, select, type_coerce
+from typing import Dict, Iterator, List, Optional, Tuple
 from datetime import datetime, timedelta
-from models.database import SensorReading
+from time import perf_counter
+import bisect
+import logging
+from models.database import IS_SQLITE, SensorReading, SensorRollup
 from models.schemas import SensorDataInput, SensorReadingResponse
+from services.downsampling import lttb
 from services.gateway_service import GatewayService
+from services.insight_cache import insight_cache
+from services.insight_scheduler import insight_scheduler
+from services.dedup_index import recent_timestamps, NEW, DUPLICATE
+from services.latest_snapshot import latest_readings
+from services.metrics import ingest_readings_total, ingest_stage_seconds
+from services.rollup_service import ROLLUP_RESOLUTIONS, ROLLUPS_ENABLED, RollupService, bucket_start
+from services.shared_state import PROCESS_LOCAL
+from services.system_stats import increment_message_count
+from services.trend_engine import trend_engine
+
+logger = logging.getLogger(__name__)
+
+# Window used to treat two readings from the same node as the same message
+DUPLICATE_WINDOW_SECONDS = 5
+
+# Metrics aggregated by bucketed history queries
+BUCKET_METRICS = ("temperature", "humidity", "soil_moisture", "light_level")
+
+# Columns of SensorReading returned by history exports, in output order
+HISTORY_COLUMNS = (
+    "id", "node_id", "gateway_id", "temperature", "humidity", "soil_moisture",
+    "light_level", "battery_level", "rssi", "timestamp",
+)
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Ingest metric series, bound once
+_DEDUP_STAGE = ingest_stage_seconds.labels("dedup")
+_REGISTRY_STAGE = ingest_stage_seconds.labels("registry")
+_INSERT_STAGE = ingest_stage_seconds.labels("insert")
+_COMMIT_STAGE = ingest_stage_seconds.labels("commit")
+_POST_COMMIT_STAGE = ingest_stage_seconds.labels("post_commit")
+_CREATED_READINGS = ingest_readings_total.labels("created")
+_DUPLICATE_READINGS = ingest_readings_total.labels("duplicate")
+
+
+def _whole_epoch_seconds(column):
+    """SQL expression for the whole Unix seconds of a naive UTC DateTime column.
+
+    Renders as CAST(STRFTIME('%s', ...) AS INTEGER) on SQLite and as
+    FLOOR(EXTRACT(EPOCH FROM ...)) on PostgreSQL, whose EXTRACT keeps fractions.
+    """
+    epoch = extract("epoch", column)
+    if IS_SQLITE:
+        return epoch
+    return cast(func.floor(epoch), Integer)
 
 
 class SensorService:
     """Service for managing sensor data operations."""
 
     @staticmethod
-    def create_reading(db: Session, sensor_data: SensorDataInput) -> SensorReading:
+    def create_reading(
+        db: Session,
+        sensor_data: SensorDataInput,
+        reading_timestamp: Optional[datetime] = None,
+        local_ip: Optional[str] = None,
+        client_ip: Optional[str] = None
+    ) -> SensorReading:
         """Create a new sensor reading in the database.
         
         This method:
@@ -20,28 +76,36 @@ class SensorService:
         2. Registers/updates the sensor node (if not exists)
         3. Creates the sensor reading with proper foreign key relationships
         
+        All three writes happen in one transaction with a single commit.
         Works with both real and simulated data.
+        
+        Args:
+            db: Database session
+            sensor_data: Validated sensor payload
+            reading_timestamp: Resolved reading timestamp (see resolve_timestamp).
+                Resolved from the payload if not provided.
+            local_ip: ESP32's self-reported local IP address
+            client_ip: IP address seen by backend (for diagnostics)
         """
         # Get gateway and node IDs
         gateway_id = sensor_data.get_gateway_id()
         node_id = sensor_data.get_sensor_id()
+        started = perf_counter()
         
         # Register/update gateway and node (creates if doesn't exist)
-        # This allows the system to work with data from unknown gateways/nodes
-        GatewayService.register_or_update_gateway(db, gateway_id)
+        # This allows the system to work with data from unknown gateways/nodes.
+        # Known IDs are only updated in the in-process registry.
+        GatewayService.touch_gateway(db, gateway_id, local_ip=local_ip, client_ip=client_ip)
         
         # Determine if node is simulated (for now, assume simulated if gateway is 'gateway-01'
         # and node_id matches common simulation patterns)
         is_simulated = gateway_id == "gateway-01" and ("sim" in node_id.lower() or "test" in node_id.lower())
-        GatewayService.register_or_update_node(db, node_id, gateway_id, is_simulated=is_simulated)
+        GatewayService.touch_node(db, node_id, gateway_id, is_simulated=is_simulated)
+        started = _REGISTRY_STAGE.observe_since(started)
         
         # Use timestamp from ESP32 if provided, otherwise use current time
-        reading_timestamp = datetime.utcnow()
-        if sensor_data.timestamp:
-            try:
-                reading_timestamp = datetime.fromtimestamp(sensor_data.timestamp)
-            except (ValueError, OSError):
-                reading_timestamp = datetime.utcnow()
+        if reading_timestamp is None:
+            reading_timestamp = SensorService.resolve_timestamp(sensor_data)
         
         db_reading = SensorReading(
             node_id=node_id,
@@ -55,10 +119,225 @@ class SensorService:
             timestamp=reading_timestamp
         )
         db.add(db_reading)
+        db.flush()
+        row = {
+            "id": db_reading.id,
+            "node_id": node_id,
+            "gateway_id": gateway_id,
+            "temperature": db_reading.temperature,
+            "humidity": db_reading.humidity,
+            "soil_moisture": db_reading.soil_moisture,
+            "light_level": db_reading.light_level,
+            "battery_level": db_reading.battery_level,
+            "rssi": db_reading.rssi,
+            "timestamp": reading_timestamp,
+        }
+        RollupService.apply(db, [row])
+        started = _INSERT_STAGE.observe_since(started)
         db.commit()
-        db.refresh(db_reading)
+        started = _COMMIT_STAGE.observe_since(started)
+        SensorService._after_commit([row])
+        _POST_COMMIT_STAGE.observe_since(started)
+        _CREATED_READINGS.inc()
         return db_reading
 
+    @staticmethod
+    def _after_commit(rows: List[dict]) -> None:
+        """Update in-memory state for newly committed readings.
+        
+        Args:
+            rows: Column values of each stored reading, including its id
+        """
+        for row in rows:
+            recent_timestamps.record(row["node_id"], row["gateway_id"], row["timestamp"], row["id"])
+            latest_readings.update(row)
+            trend_engine.record(
+                row["node_id"], row["timestamp"], (row["temperature"], row["humidity"], row["soil_moisture"])
+            )
+        node_ids = {row["node_id"] for row in rows}
+        insight_cache.invalidate_nodes(node_ids)
+        insight_scheduler.mark_dirty(node_ids)
+        increment_message_count(len(rows))
+
+    @staticmethod
+    def resolve_timestamp(sensor_data: SensorDataInput) -> datetime:
+        """Resolve the timestamp to store for an incoming reading.
+        
+        Uses the ESP32 timestamp when it is valid. Late data (older than 24 hours)
+        is accepted with a warning; timestamps more than 60 seconds in the future
+        and unparsable timestamps are replaced with the current time. Unix
+        timestamps are converted to naive UTC like datetime.utcnow(), whatever
+        the host's time zone.
+        """
+        log_extra = {"gateway_id": sensor_data.get_gateway_id(), "node_id": sensor_data.get_sensor_id()}
+        reading_timestamp = datetime.utcnow()
+        if sensor_data.timestamp:
+            try:
+                reading_timestamp = _EPOCH + timedelta(seconds=sensor_data.timestamp)
+                # Check if data is too old (more than 24 hours)
+                age = datetime.utcnow() - reading_timestamp
+                if age > timedelta(hours=24):
+                    logger.warning(
+                        f"Late data received: {age.total_seconds() / 3600:.1f} hours old",
+                        extra=log_extra
+                    )
+                    # Still accept it but log warning
+                elif age < timedelta(seconds=-60):
+                    logger.warning(
+                        f"Future timestamp detected: {abs(age.total_seconds())} seconds in future",
+                        extra=log_extra
+                    )
+                    # Use current time instead
+                    reading_timestamp = datetime.utcnow()
+            except (ValueError, OverflowError):
+                logger.warning(
+                    f"Invalid timestamp: {sensor_data.timestamp}, using current time",
+                    extra=log_extra
+                )
+                reading_timestamp = datetime.utcnow()
+        return reading_timestamp
+
+    @staticmethod
+    def create_readings_batch(
+        db: Session,
+        items: List[Tuple[SensorDataInput, datetime]],
+        local_ips: Optional[Dict[str, str]] = None,
+        client_ip: Optional[str] = None,
+        window_seconds: int = DUPLICATE_WINDOW_SECONDS,
+        client_ips: Optional[Dict[str, str]] = None
+    ) -> List[Tuple[str, int]]:
+        """Store a batch of validated readings in a single transaction.
+        
+        This method:
+        1. Checks every item for duplicates with one range query (plus the
+           items earlier in the same batch)
+        2. Registers/updates each distinct gateway and node once
+        3. Inserts all new readings with one bulk INSERT and commits once
+        
+        Args:
+            db: Database session
+            items: (validated payload, resolved timestamp) pairs
+            local_ips: Self-reported local IP per gateway_id
+            client_ip: IP address seen by backend (for diagnostics)
+            window_seconds: Time window in seconds to consider as duplicate
+            client_ips: Client IP per gateway_id, overriding client_ip (used when
+                the batch combines requests from several gateways)
+            
+        Returns:
+            One (status, reading_id) pair per item, in input order. Status is
+            "created" or "duplicate"; for duplicates the id is the existing reading.
+        """
+        if not items:
+            return []
+        local_ips = local_ips or {}
+        client_ips = client_ips or {}
+        window = timedelta(seconds=window_seconds)
+        started = perf_counter()
+        
+        # Most items are settled by the in-memory index; the rest share one range query
+        known = [
+            recent_timestamps.lookup(data.get_sensor_id(), data.get_gateway_id(), ts, window_seconds)
+            for data, ts in items
+        ]
+        unknown = [item for item, (state, _) in zip(items, known) if state not in (NEW, DUPLICATE)]
+        existing_rows = []
+        if unknown:
+            timestamps = [ts for _, ts in unknown]
+            existing_rows = (
+                db.query(SensorReading.node_id, SensorReading.gateway_id, SensorReading.timestamp, SensorReading.id)
+                .filter(SensorReading.node_id.in_({data.get_sensor_id() for data, _ in unknown}))
+                .filter(SensorReading.timestamp >= min(timestamps) - window)
+                .filter(SensorReading.timestamp <= max(timestamps) + window)
+                .order_by(SensorReading.timestamp)
+                .all()
+            )
+        # (node_id, gateway_id) -> parallel sorted lists of timestamps and reading ids.
+        # Readings accepted earlier in this batch have no id yet and are stored as
+        # -(row index + 1) until the bulk insert returns their ids.
+        seen: Dict[Tuple[str, str], Tuple[List[datetime], List[int]]] = {}
+        for row_node_id, row_gateway_id, row_timestamp, row_id in existing_rows:
+            stamps, ids = seen.setdefault((row_node_id, row_gateway_id), ([], []))
+            stamps.append(row_timestamp)
+            ids.append(row_id)
+        
+        results: List[Optional[Tuple[str, int]]] = []
+        new_rows = []
+        new_positions = []
+        gateways: Dict[str, None] = {}
+        nodes: Dict[str, str] = {}
+        for position, (sensor_data, reading_timestamp) in enumerate(items):
+            gateway_id = sensor_data.get_gateway_id()
+            node_id = sensor_data.get_sensor_id()
+            state, existing_id = known[position]
+            if state == DUPLICATE:
+                results.append(("duplicate", existing_id))
+                continue
+            stamps, ids = seen.setdefault((node_id, gateway_id), ([], []))
+            
+            index = bisect.bisect_left(stamps, reading_timestamp - window)
+            if index < len(stamps) and stamps[index] <= reading_timestamp + window:
+                results.append(("duplicate", ids[index]))
+                continue
+            
+            insert_at = bisect.bisect_right(stamps, reading_timestamp)
+            stamps.insert(insert_at, reading_timestamp)
+            ids.insert(insert_at, -len(new_rows) - 1)
+            gateways[gateway_id] = None
+            nodes[node_id] = gateway_id
+            new_positions.append(position)
+            results.append(None)
+            new_rows.append({
+                "node_id": node_id,
+                "gateway_id": gateway_id,
+                "temperature": sensor_data.temperature,
+                "humidity": sensor_data.humidity,
+                "soil_moisture": sensor_data.get_soil_moisture(),
+                "light_level": sensor_data.light_level,
+                "battery_level": sensor_data.batteryLevel,
+                "rssi": sensor_data.rssi,
+                "timestamp": reading_timestamp,
+            })
+        
+        started = _DEDUP_STAGE.observe_since(started)
+        new_ids: List[int] = []
+        if new_rows:
+            # Register each distinct gateway and node once, inside the same transaction
+            for gateway_id in gateways:
+                GatewayService.touch_gateway(
+                    db,
+                    gateway_id,
+                    local_ip=local_ips.get(gateway_id),
+                    client_ip=client_ips.get(gateway_id, client_ip)
+                )
+            for node_id, gateway_id in nodes.items():
+                is_simulated = gateway_id == "gateway-01" and ("sim" in node_id.lower() or "test" in node_id.lower())
+                GatewayService.touch_node(db, node_id, gateway_id, is_simulated=is_simulated)
+            started = _REGISTRY_STAGE.observe_since(started)
+            
+            new_ids = db.execute(
+                insert(SensorReading).returning(SensorReading.id, sort_by_parameter_order=True),
+                new_rows
+            ).scalars().all()
+            RollupService.apply(db, new_rows)
+            started = _INSERT_STAGE.observe_since(started)
+            db.commit()
+            started = _COMMIT_STAGE.observe_since(started)
+            for position, reading_id, row in zip(new_positions, new_ids, new_rows):
+                results[position] = ("created", reading_id)
+                row["id"] = reading_id
+            SensorService._after_commit(new_rows)
+            _POST_COMMIT_STAGE.observe_since(started)
+        _CREATED_READINGS.inc(len(new_rows))
+        _DUPLICATE_READINGS.inc(len(items) - len(new_rows))
+        
+        # Point in-batch duplicates at the reading that was actually stored
+        resolved = []
+        for status, reading_id in results:
+            if reading_id < 0:
+                reading_id = new_ids[-reading_id - 1]
+            resolved.append((status, reading_id))
+        return resolved
+
     @staticmethod
     def get_latest_readings(
         db: Session,
@@ -94,21 +373,42 @@ class SensorService:
 
     @staticmethod
     def get_latest_per_node(db: Session) -> List[SensorReading]:
-        """Get the latest reading for each sensor node."""
-        node_ids = SensorService.get_all_node_ids(db)
-        latest_readings = []
-
-        for node_id in node_ids:
-            latest = (
-                db.query(SensorReading)
-                .filter(SensorReading.node_id == node_id)
-                .order_by(desc(SensorReading.timestamp))
-                .first()
-            )
-            if latest:
-                latest_readings.append(latest)
+        """Get the latest reading for each sensor node.
+        
+        Served from the in-memory snapshot maintained on ingest once it has
+        been loaded at startup; otherwise computed with a single query. The
+        snapshot only sees this worker's ingest, so with a multi-process
+        shared-state backend the query is always used.
+        """
+        if PROCESS_LOCAL and latest_readings.loaded:
+            return latest_readings.all()
+        return SensorService.query_latest_per_node(db)
 
-        return latest_readings
+    @staticmethod
+    def query_latest_per_node(db: Session) -> List[SensorReading]:
+        """Get the latest reading for each sensor node with one grouped-max query.
+        
+        The per-node MAX(timestamp) is resolved from the (node_id, timestamp) index.
+        """
+        latest = (
+            select(SensorReading.node_id, func.max(SensorReading.timestamp).label("max_timestamp"))
+            .group_by(SensorReading.node_id)
+            .subquery()
+        )
+        readings = (
+            db.query(SensorReading)
+            .join(latest, and_(
+                SensorReading.node_id == latest.c.node_id,
+                SensorReading.timestamp == latest.c.max_timestamp
+            ))
+            .order_by(SensorReading.node_id, desc(SensorReading.id))
+            .all()
+        )
+        # Keep one reading per node if several share the latest timestamp
+        per_node = {}
+        for reading in readings:
+            per_node.setdefault(reading.node_id, reading)
+        return list(per_node.values())
 
     @staticmethod
     def get_history(
@@ -140,6 +440,163 @@ class SensorService:
 
         return query.order_by(SensorReading.timestamp).all()
     
+    @staticmethod
+    def get_history_buckets(
+        db: Session,
+        hours: int,
+        resolution_seconds: int,
+        node_id: Optional[str] = None,
+        gateway_id: Optional[str] = None
+    ) -> List[dict]:
+        """Get min/avg/max of each metric per node and time bucket.
+        
+        When the bucket width is a multiple of a rollup resolution (no
+        gateway filter is given and the database maintains rollups) the
+        buckets are merged from sensor_rollups; the oldest bucket then covers
+        its whole rollup period even if that starts slightly before the
+        cutoff. Otherwise aggregation runs over the
+        raw readings with a GROUP BY on the timestamp truncated to the bucket
+        width. Either way only one row per node and bucket is returned.
+        
+        Args:
+            db: Database session
+            hours: Number of hours of history to aggregate
+            resolution_seconds: Bucket width in seconds
+            node_id: Optional filter by node ID
+            gateway_id: Optional filter by gateway ID
+            
+        Returns:
+            Dicts matching HistoryBucket, ordered by bucket start then node
+        """
+        cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+        rollup_seconds = next(
+            (r for r in reversed(ROLLUP_RESOLUTIONS) if resolution_seconds % r == 0),
+            None
+        ) if ROLLUPS_ENABLED and not gateway_id else None
+
+        if rollup_seconds:
+            source = SensorRollup
+            epoch_seconds = _whole_epoch_seconds(SensorRollup.bucket_start)
+            columns = [func.sum(SensorRollup.count)]
+            for metric in BUCKET_METRICS:
+                count = SensorRollup.light_level_count if metric == "light_level" else SensorRollup.count
+                columns += [
+                    func.min(getattr(SensorRollup, f"{metric}_min")),
+                    func.sum(getattr(SensorRollup, f"{metric}_sum")) / func.nullif(func.sum(count), 0),
+                    func.max(getattr(SensorRollup, f"{metric}_max")),
+                ]
+            filters = [
+                SensorRollup.bucket_seconds == rollup_seconds,
+                SensorRollup.bucket_start >= bucket_start(cutoff_time, rollup_seconds),
+            ]
+        else:
+            source = SensorReading
+            epoch_seconds = _whole_epoch_seconds(SensorReading.timestamp)
+            columns = [func.count(SensorReading.id)]
+            for metric in BUCKET_METRICS:
+                column = getattr(SensorReading, metric)
+                columns += [func.min(column), func.avg(column), func.max(column)]
+            filters = [SensorReading.timestamp >= cutoff_time]
+            if gateway_id:
+                filters.append(SensorReading.gateway_id == gateway_id)
+        if node_id:
+            filters.append(source.node_id == node_id)
+
+        bucket = type_coerce((epoch_seconds // resolution_seconds) * resolution_seconds, Integer)
+        stmt = (
+            select(source.node_id, bucket.label("bucket"), *columns)
+            .where(*filters)
+            .group_by(source.node_id, "bucket")
+            .order_by("bucket", source.node_id)
+        )
+
+        buckets = []
+        for row in db.execute(stmt):
+            item = {
+                "node_id": row[0],
+                "bucket_start": _EPOCH + timedelta(seconds=row[1]),
+                "count": row[2],
+            }
+            for i, metric in enumerate(BUCKET_METRICS):
+                item[f"{metric}_min"], item[f"{metric}_avg"], item[f"{metric}_max"] = row[3 + 3 * i:6 + 3 * i]
+            buckets.append(item)
+        return buckets
+
+    @staticmethod
+    def get_history_lttb(
+        db: Session,
+        hours: int,
+        max_points: int,
+        metric: str = "temperature",
+        node_id: Optional[str] = None,
+        gateway_id: Optional[str] = None
+    ) -> List[SensorReadingResponse]:
+        """Get at most max_points raw readings per node, chosen with LTTB on one metric.
+        
+        Args:
+            db: Database session
+            hours: Number of hours of history to retrieve
+            max_points: Maximum readings returned per node
+            metric: Metric whose shape the selection preserves
+            node_id: Optional filter by node ID
+            gateway_id: Optional filter by gateway ID
+            
+        Returns:
+            Selected readings ordered by node, then timestamp
+        """
+        metric_index = HISTORY_COLUMNS.index(metric)
+        timestamp_index = HISTORY_COLUMNS.index("timestamp")
+        rows_by_node: Dict[str, List[tuple]] = {}
+        for row in SensorService.iter_history_rows(db, hours=hours, node_id=node_id, gateway_id=gateway_id):
+            rows_by_node.setdefault(row[1], []).append(row)
+
+        readings = []
+        for rows in rows_by_node.values():
+            points = [
+                ((row[timestamp_index] - _EPOCH).total_seconds(), row[metric_index] or 0.0)
+                for row in rows
+            ]
+            for index in lttb(points, max_points):
+                readings.append(SensorReadingResponse(**dict(zip(HISTORY_COLUMNS, rows[index]))))
+        return readings
+
+    @staticmethod
+    def iter_history_rows(
+        db: Session,
+        hours: int = 24,
+        node_id: Optional[str] = None,
+        gateway_id: Optional[str] = None,
+        batch_size: int = 1000
+    ) -> Iterator[tuple]:
+        """Stream sensor readings from the last N hours as plain tuples.
+        
+        Rows are fetched from the cursor batch_size at a time without building
+        ORM objects, so memory use does not grow with the size of the window.
+        
+        Args:
+            db: Database session (must stay open while the iterator is consumed)
+            hours: Number of hours of history to retrieve
+            node_id: Optional filter by node ID
+            gateway_id: Optional filter by gateway ID
+            batch_size: Rows fetched from the database per round trip
+            
+        Yields:
+            Tuples of HISTORY_COLUMNS values ordered by timestamp
+        """
+        cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+        stmt = (
+            select(*(getattr(SensorReading, column) for column in HISTORY_COLUMNS))
+            .where(SensorReading.timestamp >= cutoff_time)
+        )
+        if node_id:
+            stmt = stmt.where(SensorReading.node_id == node_id)
+        if gateway_id:
+            stmt = stmt.where(SensorReading.gateway_id == gateway_id)
+        stmt = stmt.order_by(SensorReading.timestamp).execution_options(yield_per=batch_size)
+
+        for row in db.execute(stmt):
+            yield tuple(row)
+
     @staticmethod
     def check_duplicate(
         db: Session,
@@ -159,7 +616,18 @@ class SensorService:
             
         Returns:
             Existing SensorReading if duplicate found, None otherwise
+        
+        Most checks are answered by the in-memory recent timestamp index; the
+        database is only queried for readings older than what the index covers.
         """
+        state, reading_id = recent_timestamps.lookup(node_id, gateway_id, timestamp, window_seconds)
+        if state == NEW:
+            return None
+        if state == DUPLICATE:
+            existing = db.get(SensorReading, reading_id)
+            if existing is not None:
+                return existing
+        
         window_start = timestamp - timedelta(seconds=window_seconds)
         window_end = timestamp + timedelta(seconds=window_seconds)
         
@@ -0,0 +1,451 @@
+"""Pluggable backend for state that must agree across worker processes.
+
+Gateway IP/status caches and the stored-message counter used to be plain
+module globals, so under `uvicorn --workers N` every worker answered status
+requests from its own copy. They now live behind a small backend:
+
+- memory (default): in-process dicts, exactly the previous behaviour for a
+  single worker
+- sqlite: a separate SQLite file (SHARED_STATE_SQLITE_PATH) in WAL mode that
+  all workers on the host open; values are stored as JSON
+
+Select the backend with SHARED_STATE_BACKEND. Only small, low-rate state
+belongs here; per-process caches that merely speed up reads (insight cache,
+trend engine, latest-reading snapshot) stay local, and are only used while
+PROCESS_LOCAL is true.
+
+Async code reaches the backend through run_shared(), which moves sqlite
+reads and writes off the event loop.
+
+Leases (shared_lease) let background tasks that must run once per host,
+such as retention or the gateway poller, pick a single worker: the holder
+renews its lease row while it runs, and another worker takes over once the
+lease has not been renewed for its TTL.
+"""
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "memory").lower()
+SHARED_STATE_SQLITE_PATH = os.getenv("SHARED_STATE_SQLITE_PATH", "./shared_state.db")
+SHARED_STATE_BUSY_TIMEOUT_MS = int(os.getenv("SHARED_STATE_BUSY_TIMEOUT_MS", "2000"))
+SHARED_STATE_LEASE_SECONDS = float(os.getenv("SHARED_STATE_LEASE_SECONDS", "30"))
+
+# Map namespace holding one lease row per singleton task
+_LEASE_NAMESPACE = "lease"
+
+# Identifies this process as a lease holder (PIDs alone may be reused)
+_HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class MemoryBackend:
+    """In-process storage; state is private to the current worker."""
+
+    process_local = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._maps: Dict[str, Dict[str, Any]] = {}
+        self._counters: Dict[str, int] = {}
+
+    def map_get(self, namespace: str, key: str) -> Any:
+        return self._maps.get(namespace, {}).get(key)
+
+    def map_set(self, namespace: str, key: str, value: Any) -> None:
+        with self._lock:
+            self._maps.setdefault(namespace, {})[key] = value
+
+    def map_delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._maps.get(namespace, {}).pop(key, None) is not None
+
+    def map_pop(self, namespace: str, key: str) -> Any:
+        with self._lock:
+            return self._maps.get(namespace, {}).pop(key, None)
+
+    def map_update(self, namespace: str, key: str, update: Callable[[Any], Any]) -> Any:
+        with self._lock:
+            entries = self._maps.setdefault(namespace, {})
+            value = update(entries.get(key))
+            entries[key] = value
+            return value
+
+    def map_keys(self, namespace: str) -> List[str]:
+        return list(self._maps.get(namespace, {}))
+
+    def map_items(self, namespace: str) -> Dict[str, Any]:
+        return dict(self._maps.get(namespace, {}))
+
+    def map_len(self, namespace: str) -> int:
+        return len(self._maps.get(namespace, {}))
+
+    def counter_get(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def counter_set(self, name: str, value: int) -> None:
+        with self._lock:
+            self._counters[name] = value
+
+    def counter_setdefault(self, name: str, value: int) -> int:
+        with self._lock:
+            return self._counters.setdefault(name, value)
+
+    def counter_incr(self, name: str, amount: int) -> int:
+        with self._lock:
+            value = self._counters.get(name, 0) + amount
+            self._counters[name] = value
+            return value
+
+
+class SqliteBackend:
+    """State in a SQLite file shared by every worker process on the host.
+
+    Each thread gets its own connection. Read-modify-write operations run in
+    BEGIN IMMEDIATE transactions so concurrent workers serialise on them.
+    """
+
+    process_local = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_map ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_counter ("
+            "name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly where needed
+            conn = sqlite3.connect(
+                self.path, timeout=SHARED_STATE_BUSY_TIMEOUT_MS / 1000, isolation_level=None
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, work: Callable[[sqlite3.Connection], Any]) -> Any:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def map_get(self, namespace: str, key: str) -> Any:
+        row = self._conn().execute(
+            "SELECT value FROM shared_map WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def map_set(self, namespace: str, key: str, value: Any) -> None:
+        encoded = json.dumps(value)
+        conn = self._conn()
+        # Ingest re-reports the same gateway IP on every request; skip the write lock then
+        row = conn.execute(
+            "SELECT value FROM shared_map WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row and row[0] == encoded:
+            return
+        conn.execute(
+            "INSERT INTO shared_map (namespace, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value",
+            (namespace, key, encoded)
+        )
+
+    def map_delete(self, namespace: str, key: str) -> bool:
+        cursor = self._conn().execute(
+            "DELETE FROM shared_map WHERE namespace = ? AND key = ?", (namespace, key)
+        )
+        return cursor.rowcount > 0
+
+    def map_pop(self, namespace: str, key: str) -> Any:
+        row = self._conn().execute(
+            "DELETE FROM shared_map WHERE namespace = ? AND key = ? RETURNING value", (namespace, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def map_update(self, namespace: str, key: str, update: Callable[[Any], Any]) -> Any:
+        def work(conn: sqlite3.Connection) -> Any:
+            row = conn.execute(
+                "SELECT value FROM shared_map WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            value = update(json.loads(row[0]) if row else None)
+            conn.execute(
+                "INSERT INTO shared_map (namespace, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value",
+                (namespace, key, json.dumps(value))
+            )
+            return value
+        return self._transaction(work)
+
+    def map_keys(self, namespace: str) -> List[str]:
+        # rowid order keeps first-insertion order, like a dict
+        rows = self._conn().execute(
+            "SELECT key FROM shared_map WHERE namespace = ? ORDER BY rowid", (namespace,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def map_items(self, namespace: str) -> Dict[str, Any]:
+        rows = self._conn().execute(
+            "SELECT key, value FROM shared_map WHERE namespace = ? ORDER BY rowid", (namespace,)
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def map_len(self, namespace: str) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM shared_map WHERE namespace = ?", (namespace,)
+        ).fetchone()[0]
+
+    def counter_get(self, name: str) -> int:
+        row = self._conn().execute("SELECT value FROM shared_counter WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def counter_set(self, name: str, value: int) -> None:
+        self._conn().execute(
+            "INSERT INTO shared_counter (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+            (name, value)
+        )
+
+    def counter_setdefault(self, name: str, value: int) -> int:
+        # The no-op update makes RETURNING yield the existing value on conflict
+        return self._conn().execute(
+            "INSERT INTO shared_counter (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value "
+            "RETURNING value",
+            (name, value)
+        ).fetchone()[0]
+
+    def counter_incr(self, name: str, amount: int) -> int:
+        return self._conn().execute(
+            "INSERT INTO shared_counter (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value "
+            "RETURNING value",
+            (name, amount)
+        ).fetchone()[0]
+
+
+class SharedMap(MutableMapping):
+    """Dict-like view of one namespace in the shared-state backend.
+
+    Values are returned as copies (JSON round trip on the sqlite backend), so
+    mutating a returned value does not change the stored one; use merge().
+    """
+
+    def __init__(self, backend, namespace: str):
+        self._backend = backend
+        self._namespace = namespace
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._backend.map_get(self._namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._backend.map_set(self._namespace, key, value)
+
+    def __delitem__(self, key: str) -> None:
+        if not self._backend.map_delete(self._namespace, key):
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._backend.map_keys(self._namespace))
+
+    def __len__(self) -> int:
+        return self._backend.map_len(self._namespace)
+
+    def __contains__(self, key: object) -> bool:
+        return self._backend.map_get(self._namespace, key) is not None
+
+    def __repr__(self) -> str:
+        return repr(self.snapshot())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """All entries in one backend read (items() reads each value separately)."""
+        return self._backend.map_items(self._namespace)
+
+    def pop(self, key: str, *default: Any) -> Any:
+        """Atomically remove key and return its value (or default if given)."""
+        value = self._backend.map_pop(self._namespace, key)
+        if value is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return value
+
+    def merge(self, key: str, fields: dict) -> dict:
+        """Atomically merge fields into the dict stored at key and return the result."""
+        def update(current: Optional[dict]) -> dict:
+            merged = dict(current or {})
+            merged.update(fields)
+            return merged
+        return self.update_item(key, update)
+
+    def update_item(self, key: str, update: Callable[[Any], Any]) -> Any:
+        """Atomically replace the value at key with update(current value or None).
+
+        Returns:
+            The stored value
+        """
+        return self._backend.map_update(self._namespace, key, update)
+
+
+class SharedCounter:
+    """Integer counter in the shared-state backend."""
+
+    def __init__(self, backend, name: str):
+        self._backend = backend
+        self._name = name
+
+    def get(self) -> int:
+        return self._backend.counter_get(self._name)
+
+    def set(self, value: int) -> None:
+        self._backend.counter_set(self._name, value)
+
+    def setdefault(self, value: int) -> int:
+        """Set the counter only if it does not exist yet and return its value."""
+        return self._backend.counter_setdefault(self._name, value)
+
+    def incr(self, amount: int = 1) -> int:
+        return self._backend.counter_incr(self._name, amount)
+
+
+class SharedLease:
+    """Lease that lets one worker process run a singleton background task.
+
+    acquire() takes the lease if it is free or expired, or renews it if this
+    process already holds it. A holder that stops renewing (crashed, shut
+    down without release) loses it ttl_seconds after its last renewal. With
+    the memory backend there is only one process, which always holds it.
+    """
+
+    def __init__(self, backend, name: str, ttl_seconds: float):
+        self._backend = backend
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self._renewed_at: Optional[float] = None
+
+    def acquire(self) -> bool:
+        """Take or renew the lease.
+
+        Returns:
+            True if this process holds the lease and should run the task
+        """
+        if self._backend.process_local:
+            return True
+        now = time.time()
+        # A lease renewed recently is still ours; skip the write
+        if self._renewed_at is not None and now - self._renewed_at < self.ttl_seconds / 3:
+            return True
+        current = self._backend.map_get(_LEASE_NAMESPACE, self.name)
+        if current and current["holder"] != _HOLDER_ID and current["expires_at"] > now:
+            self._renewed_at = None
+            return False
+
+        def update(current: Optional[dict]) -> dict:
+            if current and current["holder"] != _HOLDER_ID and current["expires_at"] > now:
+                return current
+            return {"holder": _HOLDER_ID, "expires_at": now + self.ttl_seconds}
+        held = self._backend.map_update(_LEASE_NAMESPACE, self.name, update)["holder"] == _HOLDER_ID
+        if held and self._renewed_at is None:
+            logger.info(f"Acquired lease '{self.name}'; this worker runs it")
+        self._renewed_at = now if held else None
+        return held
+
+    def wait(self, poll_seconds: float = 0.2) -> None:
+        """Block until this process holds the lease."""
+        while not self.acquire():
+            time.sleep(poll_seconds)
+
+    def release(self) -> None:
+        """Give the lease up (if held) so another worker can take over at once."""
+        if self._backend.process_local or self._renewed_at is None:
+            return
+
+        def update(current: Optional[dict]) -> dict:
+            if current and current["holder"] == _HOLDER_ID:
+                return {**current, "expires_at": 0}
+            return current or {"holder": None, "expires_at": 0}
+        self._backend.map_update(_LEASE_NAMESPACE, self.name, update)
+        self._renewed_at = None
+
+
+def _create_backend():
+    if SHARED_STATE_BACKEND == "sqlite":
+        logger.info(f"Shared state backend: sqlite ({SHARED_STATE_SQLITE_PATH})")
+        return SqliteBackend(SHARED_STATE_SQLITE_PATH)
+    if SHARED_STATE_BACKEND != "memory":
+        logger.warning(f"Unknown SHARED_STATE_BACKEND '{SHARED_STATE_BACKEND}', using memory")
+    return MemoryBackend()
+
+
+# Process-wide backend selected by SHARED_STATE_BACKEND
+shared_state = _create_backend()
+
+# False when state is shared between worker processes. In-process indexes
+# that assume this worker sees every write (e.g. the dedup fast path) must
+# then defer to the database.
+PROCESS_LOCAL = shared_state.process_local
+
+
+async def run_shared(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Call a function that reads or writes shared state from async code.
+
+    With the memory backend it runs inline (plain dict operations); otherwise
+    in a worker thread, so sqlite I/O and lock waits never block the event loop.
+    """
+    if PROCESS_LOCAL:
+        return func(*args, **kwargs)
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+def shared_map(namespace: str) -> SharedMap:
+    return SharedMap(shared_state, namespace)
+
+
+def shared_counter(name: str) -> SharedCounter:
+    return SharedCounter(shared_state, name)
+
+
+# Leases created in this process, released on shutdown
+_leases: List[SharedLease] = []
+
+
+def shared_lease(name: str, ttl_seconds: float = SHARED_STATE_LEASE_SECONDS) -> SharedLease:
+    lease = SharedLease(shared_state, name, ttl_seconds)
+    _leases.append(lease)
+    return lease
+
+
+def release_leases() -> None:
+    """Release every lease this process holds (called on shutdown)."""
+    for lease in _leases:
+        try:
+            lease.release()
+        except Exception as e:
+            logger.warning(f"Could not release lease '{lease.name}': {str(e)}")
@@ -2,91 +2,97 @@
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from models.database import SensorReading
-import httpx
+from models.database import SensorReading, SessionLocal
+from services.latest_snapshot import latest_readings
+from services.metrics import system_stats_query_seconds
+from services.shared_state import PROCESS_LOCAL, shared_counter
+from time import perf_counter
 import logging
 
 logger = logging.getLogger(__name__)
 
 # System startup time for uptime calculation
 _system_start_time = datetime.utcnow()
-_total_messages = 0
+
+# Running total of stored readings, seeded from the database at startup
+# (see seed_system_stats) and incremented on ingest. Kept in the shared-state
+# backend so every worker process reports the same total.
+_total_messages = shared_counter("total_messages")
+_total_messages_seeded = False
+
+# Timing series of one get_system_stats lookup: _query_series(query, source)
+_query_series = system_stats_query_seconds.labels
 
 # Note: Gateway IP cache is managed in routes/sensors.py
 # We'll pass gateway_ip as parameter instead
 
 
-def increment_message_count():
+def increment_message_count(count: int = 1):
     """Increment the total message counter."""
-    global _total_messages
-    _total_messages += 1
+    _total_messages.incr(count)
 
 
-async def fetch_gateway_active_nodes(gateway_ip: str = None) -> int | None:
-    """Fetch active node count from gateway if available."""
-    # IPs to try: provided IP, common AP IP
-    ips_to_try = []
-    
-    if gateway_ip:
-        ips_to_try.append(gateway_ip)
+def seed_system_stats() -> None:
+    """Seed the total message counter with the number of stored readings.
     
-    # Try common AP IP as fallback
-    if '192.168.4.1' not in ips_to_try:
-        ips_to_try.append('192.168.4.1')
-    
-    # Use shorter timeout to avoid blocking the API response
-    async with httpx.AsyncClient(timeout=httpx.Timeout(0.5)) as client:
-        for ip in ips_to_try:
-            try:
-                url = f"http://{ip}/nodes"
-                response = await client.get(url)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if "active_nodes" in data:
-                        logger.info(f"Fetched active nodes from gateway {ip}: {data['active_nodes']}")
-                        return data["active_nodes"]
-            except (httpx.TimeoutException, httpx.ConnectError, httpx.RequestError):
-                continue
-            except Exception as e:
-                logger.debug(f"Error fetching from gateway {ip}: {str(e)}")
-                continue
-    
-    return None
+    Called once at startup, before this worker ingests any reading. The
+    counter is only written if it does not exist yet: with several workers
+    the first one seeds it, and later ones must not overwrite the readings
+    counted since. A counter in the sqlite backend survives restarts (it is
+    kept in step by ingest and retention); delete its shared_counter row to
+    re-seed it from the database.
+    """
+    global _total_messages_seeded
+    db = SessionLocal()
+    try:
+        total = db.query(func.count(SensorReading.id)).scalar() or 0
+    finally:
+        db.close()
+    current = _total_messages.setdefault(total)
+    _total_messages_seeded = True
+    logger.info(f"System stats seeded: message counter at {current} ({total} stored readings)")
 
 
 def get_system_stats(db: Session, gateway_ip: str = None) -> dict:
-    """Get system statistics for status endpoint."""
-    global _total_messages
+    """Get system statistics for status endpoint.
     
-    # Calculate uptime
-    uptime_seconds = int((datetime.utcnow() - _system_start_time).total_seconds())
+    Served from the message counter and latest-reading snapshot once they
+    have been seeded at startup; otherwise falls back to database queries.
+    The snapshot only sees this worker's ingest, so with a multi-process
+    shared-state backend the last timestamp and active nodes come from the
+    database.
+    """
+    now = datetime.utcnow()
     
-    # Get last data received time
-    last_reading = (
-        db.query(SensorReading)
-        .order_by(SensorReading.timestamp.desc())
-        .first()
-    )
+    # Calculate uptime
+    uptime_seconds = int((now - _system_start_time).total_seconds())
+    one_hour_ago = now - timedelta(hours=1)
     
-    last_data_received_seconds = None
-    if last_reading:
-        last_data_received_seconds = int(
-            (datetime.utcnow() - last_reading.timestamp).total_seconds()
+    started = perf_counter()
+    if PROCESS_LOCAL and latest_readings.loaded:
+        last_timestamp = latest_readings.latest_timestamp()
+        started = _query_series("last_timestamp", "memory").observe_since(started)
+        active_nodes = latest_readings.count_active_since(one_hour_ago)
+        started = _query_series("active_nodes", "memory").observe_since(started)
+    else:
+        last_timestamp = db.query(func.max(SensorReading.timestamp)).scalar()
+        started = _query_series("last_timestamp", "database").observe_since(started)
+        active_nodes = (
+            db.query(func.count(func.distinct(SensorReading.node_id)))
+            .filter(SensorReading.timestamp >= one_hour_ago)
+            .scalar() or 0
         )
+        started = _query_series("active_nodes", "database").observe_since(started)
+    if _total_messages_seeded:
+        total_messages = _total_messages.get()
+        _query_series("total_messages", "counter").observe_since(started)
+    else:
+        total_messages = db.query(func.count(SensorReading.id)).scalar() or 0
+        _query_series("total_messages", "database").observe_since(started)
     
-    # Get total messages from database (more accurate than counter)
-    total_messages = db.query(func.count(SensorReading.id)).scalar() or 0
-    
-    # Try to get active nodes from gateway first, fallback to database
-    # Note: This is a sync function, so we'll calculate from DB for now
-    # The gateway active nodes will be fetched in the async endpoint
-    one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-    active_nodes = (
-        db.query(func.count(func.distinct(SensorReading.node_id)))
-        .filter(SensorReading.timestamp >= one_hour_ago)
-        .scalar() or 0
-    )
+    last_data_received_seconds = None
+    if last_timestamp:
+        last_data_received_seconds = int((now - last_timestamp).total_seconds())
     
     return {
         "backend": "online",
@@ -95,4 +101,3 @@ def get_system_stats(db: Session, gateway_ip: str = None) -> dict:
         "nodes_active": active_nodes,
         "system_uptime_seconds": uptime_seconds
     }
-
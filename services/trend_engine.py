@@ -0,0 +1,337 @@
+"""Streaming per-node rolling-window statistics for trend detection.
+
+TrendInsightService.analyze_trends used to re-query and recompute its whole
+N-minute window on every call. The engine instead keeps, for every node, the
+readings of the largest configured window in memory and, for each configured
+window length, running aggregates updated as readings are committed:
+
+- count, mean and variance per metric (Welford's algorithm, with the inverse
+  update when a reading slides out of the window)
+- min and max per metric (monotonic deques)
+- first and last reading in the window
+
+A summary for (node, window) is therefore O(1) and never touches the
+database. Summaries expose the same interface as ReadingWindow, so the
+detectors run on either.
+
+The engine is seeded from the database at startup; readings arriving out of
+order trigger a rebuild of that node's aggregates from its in-memory readings.
+With a multi-process shared-state backend it only sees this worker's ingest,
+so it is not seeded and analysis reads its windows from the database.
+"""
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+import bisect
+import logging
+import math
+import os
+import threading
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from models.database import SensorReading, SessionLocal
+from services.reading_window import epoch_seconds as sql_epoch_seconds
+from services.shared_state import PROCESS_LOCAL
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+TREND_ENGINE_ENABLED = os.getenv("TREND_ENGINE_ENABLED", "true").lower() in ("1", "true", "yes")
+TREND_ENGINE_WINDOWS = tuple(sorted({
+    int(minutes) for minutes in os.getenv("TREND_ENGINE_WINDOWS", "5,15,30,60,120,360,720,1440").split(",")
+}))
+
+# Metrics tracked per reading, in tuple order after the timestamp
+ENGINE_METRICS = ("temperature", "humidity", "soil_moisture")
+_METRIC_INDEX = {metric: i for i, metric in enumerate(ENGINE_METRICS)}
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch_seconds(timestamp: datetime) -> float:
+    return (timestamp - _EPOCH).total_seconds()
+
+
+class WindowSummary:
+    """Snapshot of one node's rolling window with the ReadingWindow summary interface."""
+
+    __slots__ = ("count", "_first_ts", "_last_ts", "_first", "_last", "_mean", "_stdev", "_min", "_max")
+
+    def __init__(self, count, first_ts, last_ts, first, last, mean, stdev, minimum, maximum):
+        self.count = count
+        self._first_ts = first_ts
+        self._last_ts = last_ts
+        self._first = first
+        self._last = last
+        self._mean = mean
+        self._stdev = stdev
+        self._min = minimum
+        self._max = maximum
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def first_timestamp(self) -> datetime:
+        return _EPOCH + timedelta(seconds=self._first_ts)
+
+    @property
+    def last_timestamp(self) -> datetime:
+        return _EPOCH + timedelta(seconds=self._last_ts)
+
+    @property
+    def span_hours(self) -> float:
+        return (self._last_ts - self._first_ts) / 3600
+
+    def first(self, metric: str) -> float:
+        return self._first[_METRIC_INDEX[metric]]
+
+    def last(self, metric: str) -> float:
+        return self._last[_METRIC_INDEX[metric]]
+
+    def mean(self, metric: str) -> float:
+        return self._mean[_METRIC_INDEX[metric]]
+
+    def stdev(self, metric: str) -> float:
+        return self._stdev[_METRIC_INDEX[metric]]
+
+    def min(self, metric: str) -> float:
+        return self._min[_METRIC_INDEX[metric]]
+
+    def max(self, metric: str) -> float:
+        return self._max[_METRIC_INDEX[metric]]
+
+
+# Summary of a window without readings
+EMPTY_SUMMARY = WindowSummary(0, 0.0, 0.0, (), (), (), (), (), ())
+
+
+class _Window:
+    """Running aggregates of one window length over a node's readings."""
+
+    __slots__ = ("seconds", "start", "count", "mean", "m2", "min_queues", "max_queues", "removed")
+
+    def __init__(self, seconds: float, start: int):
+        self.seconds = seconds
+        self.reset(start)
+
+    def reset(self, start: int) -> None:
+        self.start = start  # Sequence number of the oldest reading in the window
+        self.count = 0
+        self.mean = [0.0] * len(ENGINE_METRICS)
+        self.m2 = [0.0] * len(ENGINE_METRICS)
+        # Sequence numbers with increasing (min) / decreasing (max) values
+        self.min_queues = [deque() for _ in ENGINE_METRICS]
+        self.max_queues = [deque() for _ in ENGINE_METRICS]
+        self.removed = 0  # Removals since the last reset (bounds floating-point drift)
+
+    def add(self, seq: int, entry: tuple, value_at) -> None:
+        self.count += 1
+        for i in range(len(ENGINE_METRICS)):
+            x = entry[i + 1]
+            delta = x - self.mean[i]
+            self.mean[i] += delta / self.count
+            self.m2[i] += delta * (x - self.mean[i])
+            min_queue = self.min_queues[i]
+            while min_queue and value_at(min_queue[-1], i) >= x:
+                min_queue.pop()
+            min_queue.append(seq)
+            max_queue = self.max_queues[i]
+            while max_queue and value_at(max_queue[-1], i) <= x:
+                max_queue.pop()
+            max_queue.append(seq)
+
+    def remove_oldest(self, entry: tuple) -> None:
+        seq = self.start
+        self.start += 1
+        self.count -= 1
+        self.removed += 1
+        for i in range(len(ENGINE_METRICS)):
+            if self.count == 0:
+                self.mean[i] = 0.0
+                self.m2[i] = 0.0
+            else:
+                x = entry[i + 1]
+                delta = x - self.mean[i]
+                self.mean[i] -= delta / self.count
+                self.m2[i] = max(self.m2[i] - delta * (x - self.mean[i]), 0.0)
+            if self.min_queues[i] and self.min_queues[i][0] == seq:
+                self.min_queues[i].popleft()
+            if self.max_queues[i] and self.max_queues[i][0] == seq:
+                self.max_queues[i].popleft()
+
+
+class _NodeSeries:
+    """A node's readings within the largest window plus one _Window per window length."""
+
+    __slots__ = ("entries", "base", "windows")
+
+    def __init__(self, window_seconds: List[float]):
+        # (epoch_seconds, temperature, humidity, soil_moisture), sorted by time
+        self.entries: List[tuple] = []
+        self.base = 0  # Sequence number of entries[0]
+        self.windows = [_Window(seconds, 0) for seconds in window_seconds]
+
+    def _value_at(self, seq: int, metric_index: int) -> float:
+        return self.entries[seq - self.base][metric_index + 1]
+
+    def _end(self) -> int:
+        return self.base + len(self.entries)
+
+    def append(self, entry: tuple, now: float) -> None:
+        if self.entries and entry[0] < self.entries[-1][0]:
+            # Out of order: insert in place and rebuild the aggregates
+            bisect.insort(self.entries, entry)
+            self.rebuild(now)
+            return
+        seq = self._end()
+        self.entries.append(entry)
+        for window in self.windows:
+            window.add(seq, entry, self._value_at)
+        self.evict(now)
+
+    def rebuild(self, now: float) -> None:
+        for window in self.windows:
+            cutoff = now - window.seconds
+            first = bisect.bisect_left(self.entries, (cutoff,))
+            window.reset(self.base + first)
+            for offset in range(first, len(self.entries)):
+                window.add(self.base + offset, self.entries[offset], self._value_at)
+        self._compact()
+
+    def evict(self, now: float) -> None:
+        end = self._end()
+        for window in self.windows:
+            cutoff = now - window.seconds
+            while window.start < end and self.entries[window.start - self.base][0] < cutoff:
+                window.remove_oldest(self.entries[window.start - self.base])
+            if window.removed > max(window.count, 1024):
+                # Re-derive mean/variance exactly after many inverse updates
+                window.reset(window.start)
+                for seq in range(window.start, end):
+                    window.add(seq, self.entries[seq - self.base], self._value_at)
+        self._compact()
+
+    def _compact(self) -> None:
+        # The largest window starts earliest; readings before it are no longer needed
+        oldest = self.windows[-1].start - self.base
+        if oldest > 0 and oldest * 2 >= len(self.entries):
+            del self.entries[:oldest]
+            self.base += oldest
+
+    def summary(self, window: _Window) -> WindowSummary:
+        if window.count == 0:
+            return EMPTY_SUMMARY
+        first_entry = self.entries[window.start - self.base]
+        last_entry = self.entries[-1]
+        metrics = range(len(ENGINE_METRICS))
+        return WindowSummary(
+            count=window.count,
+            first_ts=first_entry[0],
+            last_ts=last_entry[0],
+            first=first_entry[1:],
+            last=last_entry[1:],
+            mean=tuple(window.mean),
+            stdev=tuple(
+                math.sqrt(window.m2[i] / (window.count - 1)) if window.count > 1 else 0.0 for i in metrics
+            ),
+            minimum=tuple(self._value_at(window.min_queues[i][0], i) for i in metrics),
+            maximum=tuple(self._value_at(window.max_queues[i][0], i) for i in metrics),
+        )
+
+
+class TrendEngine:
+    """Thread-safe rolling-window statistics for every node."""
+
+    def __init__(self, windows_minutes: Tuple[int, ...] = TREND_ENGINE_WINDOWS):
+        self.windows_minutes = windows_minutes
+        self._window_seconds = [minutes * 60.0 for minutes in windows_minutes]
+        self._window_index = {minutes: i for i, minutes in enumerate(windows_minutes)}
+        self._lock = threading.Lock()
+        self._nodes: Dict[str, _NodeSeries] = {}
+        self.ready = False
+
+    def supports(self, minutes: int) -> bool:
+        """True if summaries for this window length can be served from memory."""
+        return self.ready and minutes in self._window_index
+
+    def seed(self, db: Session) -> None:
+        """Load the readings of the largest window for every node."""
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=self._window_seconds[-1])
+        stmt = (
+            select(SensorReading.node_id, sql_epoch_seconds(SensorReading.timestamp), *(getattr(SensorReading, m) for m in ENGINE_METRICS))
+            .where(SensorReading.timestamp >= cutoff)
+            .order_by(SensorReading.node_id, SensorReading.timestamp)
+        )
+        entries_by_node: Dict[str, List[tuple]] = {}
+        for row in db.connection().execute(stmt):
+            entries_by_node.setdefault(row[0], []).append(tuple(row[1:]))
+
+        now_seconds = _epoch_seconds(now)
+        with self._lock:
+            for node_id, entries in entries_by_node.items():
+                series = _NodeSeries(self._window_seconds)
+                series.entries = entries
+                series.rebuild(now_seconds)
+                self._nodes[node_id] = series
+            self.ready = True
+        logger.info(
+            f"Trend engine seeded with {sum(len(e) for e in entries_by_node.values())} readings "
+            f"from {len(entries_by_node)} nodes (windows: {', '.join(map(str, self.windows_minutes))} min)"
+        )
+
+    def record(self, node_id: str, timestamp: datetime, values: Tuple[float, ...]) -> None:
+        """Add a committed reading (values in ENGINE_METRICS order)."""
+        if not self.ready:
+            return
+        now = _epoch_seconds(datetime.utcnow())
+        entry = (_epoch_seconds(timestamp),) + tuple(values)
+        if entry[0] < now - self._window_seconds[-1]:
+            return
+        with self._lock:
+            series = self._nodes.get(node_id)
+            if series is None:
+                series = self._nodes[node_id] = _NodeSeries(self._window_seconds)
+            series.append(entry, now)
+
+    def summary(self, node_id: str, minutes: int) -> WindowSummary:
+        """Summary of a node's last N minutes (count 0 if it has no readings in the window)."""
+        index = self._window_index[minutes]
+        now = _epoch_seconds(datetime.utcnow())
+        with self._lock:
+            series = self._nodes.get(node_id)
+            if series is None:
+                return EMPTY_SUMMARY
+            series.evict(now)
+            return series.summary(series.windows[index])
+
+    def node_ids(self) -> List[str]:
+        """IDs of nodes with readings in the engine."""
+        with self._lock:
+            return list(self._nodes)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "windows_minutes": list(self.windows_minutes),
+                "nodes": len(self._nodes),
+                "readings": sum(len(series.entries) for series in self._nodes.values()),
+            }
+
+
+# Process-wide engine updated by SensorService on ingest
+trend_engine = TrendEngine()
+
+
+def seed_trend_engine() -> None:
+    """Seed the process-wide trend engine from the database."""
+    if not PROCESS_LOCAL:
+        logger.info("Trend engine disabled: workers share state, trend windows come from the database")
+        return
+    db = SessionLocal()
+    try:
+        trend_engine.seed(db)
+    finally:
+        db.close()
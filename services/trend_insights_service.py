@@ -14,8 +14,26 @@ from sqlalchemy import and_
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 from enum import Enum
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import os
+import threading
 from models.database import SensorReading
-import statistics
+from services.metrics import trend_detector_findings_total, trend_detector_seconds
+from services.reading_window import ReadingWindow
+from services.registry import device_registry
+from services.shared_state import PROCESS_LOCAL
+from services.trend_engine import trend_engine
+
+# Worker processes for fleet analysis (0 runs the detectors in-process)
+FLEET_ANALYSIS_WORKERS = int(os.getenv("FLEET_ANALYSIS_WORKERS", "0"))
+
+_fleet_pool: Optional[ProcessPoolExecutor] = None
+_fleet_pool_lock = threading.Lock()
+
+# Detector observations (name, seconds, found) gathered while a fleet pool
+# worker analyzes a chunk; None records straight into the metrics registry
+_collected_observations: Optional[List[Tuple[str, float, bool]]] = None
 
 
 class RiskLevel(str, Enum):
@@ -80,7 +98,25 @@ class TrendInsightService:
         return query.order_by(SensorReading.timestamp).all()
     
     @staticmethod
-    def detect_drought_risk(readings: List[SensorReading]) -> Optional[Dict]:
+    def load_window(
+        db: Session,
+        node_id: Optional[str] = None,
+        minutes: int = 60
+    ) -> ReadingWindow:
+        """Load the readings of the last N minutes as column arrays.
+        
+        Args:
+            db: Database session
+            node_id: Optional filter by node ID
+            minutes: Number of minutes of history to retrieve (default: 60)
+            
+        Returns:
+            ReadingWindow ordered by timestamp (oldest first)
+        """
+        return ReadingWindow.load(db, node_id=node_id, minutes=minutes)
+    
+    @staticmethod
+    def detect_drought_risk(window: ReadingWindow) -> Optional[Dict]:
         """Detect drought risk from soil moisture trends.
         
         Drought risk indicators:
@@ -89,24 +125,20 @@ class TrendInsightService:
         - Rapid drop rate
         
         Args:
-            readings: List of sensor readings (ordered by timestamp)
+            window: Readings of the analysis window (ReadingWindow or any object
+                with the same summary interface)
             
         Returns:
             Dictionary with insight data if drought risk detected, None otherwise
         """
-        if not readings or len(readings) < 2:
+        if window.count < 2:
             return None
         
-        # Get soil moisture values
-        soil_values = [r.soil_moisture for r in readings if r.soil_moisture is not None]
-        if not soil_values:
-            return None
-        
-        latest_moisture = soil_values[-1]
-        first_moisture = soil_values[0]
+        latest_moisture = window.last("soil_moisture")
+        first_moisture = window.first("soil_moisture")
         
         # Calculate drop rate (% per hour)
-        time_span_hours = (readings[-1].timestamp - readings[0].timestamp).total_seconds() / 3600
+        time_span_hours = window.span_hours
         if time_span_hours <= 0:
             return None
         
@@ -171,7 +203,7 @@ class TrendInsightService:
         }
     
     @staticmethod
-    def detect_overwatering_risk(readings: List[SensorReading]) -> Optional[Dict]:
+    def detect_overwatering_risk(window: ReadingWindow) -> Optional[Dict]:
         """Detect overwatering risk from soil moisture trends.
         
         Overwatering risk indicators:
@@ -179,28 +211,24 @@ class TrendInsightService:
         - Soil moisture not decreasing (poor drainage)
         
         Args:
-            readings: List of sensor readings (ordered by timestamp)
+            window: Readings of the analysis window (ReadingWindow or any object
+                with the same summary interface)
             
         Returns:
             Dictionary with insight data if overwatering risk detected, None otherwise
         """
-        if not readings or len(readings) < 3:
-            return None
-        
-        # Get soil moisture values
-        soil_values = [r.soil_moisture for r in readings if r.soil_moisture is not None]
-        if not soil_values:
+        if window.count < 3:
             return None
         
-        latest_moisture = soil_values[-1]
-        avg_moisture = statistics.mean(soil_values)
+        latest_moisture = window.last("soil_moisture")
+        avg_moisture = window.mean("soil_moisture")
         
         # Calculate change rate
-        time_span_hours = (readings[-1].timestamp - readings[0].timestamp).total_seconds() / 3600
+        time_span_hours = window.span_hours
         if time_span_hours <= 0:
             return None
         
-        change_rate = (soil_values[-1] - soil_values[0]) / time_span_hours
+        change_rate = (latest_moisture - window.first("soil_moisture")) / time_span_hours
         
         # Check for overwatering conditions
         risk_level = RiskLevel.LOW
@@ -265,7 +293,7 @@ class TrendInsightService:
         }
     
     @staticmethod
-    def detect_temperature_stress(readings: List[SensorReading]) -> Optional[Dict]:
+    def detect_temperature_stress(window: ReadingWindow) -> Optional[Dict]:
         """Detect temperature stress from temperature trends.
         
         Temperature stress indicators:
@@ -274,30 +302,26 @@ class TrendInsightService:
         - Sustained high/low temperatures
         
         Args:
-            readings: List of sensor readings (ordered by timestamp)
+            window: Readings of the analysis window (ReadingWindow or any object
+                with the same summary interface)
             
         Returns:
             Dictionary with insight data if temperature stress detected, None otherwise
         """
-        if not readings or len(readings) < 2:
-            return None
-        
-        # Get temperature values
-        temp_values = [r.temperature for r in readings if r.temperature is not None]
-        if not temp_values:
+        if window.count < 2:
             return None
         
-        latest_temp = temp_values[-1]
-        max_temp = max(temp_values)
-        min_temp = min(temp_values)
-        avg_temp = statistics.mean(temp_values)
+        latest_temp = window.last("temperature")
+        max_temp = window.max("temperature")
+        min_temp = window.min("temperature")
+        avg_temp = window.mean("temperature")
         
         # Calculate temperature change rate
-        time_span_hours = (readings[-1].timestamp - readings[0].timestamp).total_seconds() / 3600
+        time_span_hours = window.span_hours
         if time_span_hours <= 0:
             return None
         
-        temp_rate = (temp_values[-1] - temp_values[0]) / time_span_hours
+        temp_rate = (latest_temp - window.first("temperature")) / time_span_hours
         
         risk_level = RiskLevel.LOW
         explanation_parts = []
@@ -409,7 +433,7 @@ class TrendInsightService:
         }
     
     @staticmethod
-    def detect_sensor_failure(readings: List[SensorReading], node_id: Optional[str] = None) -> Optional[Dict]:
+    def detect_sensor_failure(window: ReadingWindow, node_id: Optional[str] = None) -> Optional[Dict]:
         """Detect sensor failure patterns.
         
         Sensor failure indicators:
@@ -419,13 +443,14 @@ class TrendInsightService:
         - Unrealistic values
         
         Args:
-            readings: List of sensor readings (ordered by timestamp)
+            window: Readings of the analysis window (ReadingWindow or any object
+                with the same summary interface)
             node_id: Optional node ID for context
             
         Returns:
             Dictionary with insight data if sensor failure detected, None otherwise
         """
-        if not readings:
+        if window.count == 0:
             # No data at all - potential sensor failure
             return {
                 "type": InsightType.SENSOR_FAILURE,
@@ -438,9 +463,8 @@ class TrendInsightService:
                 "failure_pattern": "no_data"
             }
         
-        latest_reading = readings[-1]
         current_time = datetime.utcnow()
-        data_age_seconds = (current_time - latest_reading.timestamp).total_seconds()
+        data_age_seconds = (current_time - window.last_timestamp).total_seconds()
         
         # Check for stale data
         if data_age_seconds > TrendInsightService.SENSOR_FAILURE_STALE_THRESHOLD:
@@ -462,84 +486,80 @@ class TrendInsightService:
                 "data_age_seconds": int(data_age_seconds)
             }
         
+        latest_temp = window.last("temperature")
+        latest_moisture = window.last("soil_moisture")
+        
         # Check for constant values (sensor stuck)
-        if len(readings) >= 5:  # Need enough data points
-            temp_values = [r.temperature for r in readings if r.temperature is not None]
-            soil_values = [r.soil_moisture for r in readings if r.soil_moisture is not None]
-            
+        if window.count >= 5:  # Need enough data points
             # Check temperature variation
-            if len(temp_values) >= 5:
-                temp_std = statistics.stdev(temp_values) if len(temp_values) > 1 else 0
-                if temp_std < TrendInsightService.SENSOR_FAILURE_CONSTANT_VALUES_THRESHOLD:
-                    return {
-                        "type": InsightType.SENSOR_FAILURE,
-                        "risk_level": RiskLevel.MEDIUM.value,
-                        "explanation": (
-                            f"Temperature sensor appears stuck: constant value {temp_values[-1]:.1f}°C "
-                            f"(variation: {temp_std:.3f}°C)" + (f" (node: {node_id})" if node_id else "")
-                        ),
-                        "recommended_action": (
-                            "Temperature sensor may be malfunctioning. Check sensor hardware. "
-                            "Verify sensor is not disconnected or damaged. Replace sensor if needed."
-                        ),
-                        "failure_pattern": "constant_temperature",
-                        "constant_value": temp_values[-1]
-                    }
-            
-            # Check soil moisture variation
-            if len(soil_values) >= 5:
-                soil_std = statistics.stdev(soil_values) if len(soil_values) > 1 else 0
-                if soil_std < TrendInsightService.SENSOR_FAILURE_CONSTANT_VALUES_THRESHOLD:
-                    return {
-                        "type": InsightType.SENSOR_FAILURE,
-                        "risk_level": RiskLevel.MEDIUM.value,
-                        "explanation": (
-                            f"Soil moisture sensor appears stuck: constant value {soil_values[-1]:.1f}% "
-                            f"(variation: {soil_std:.3f}%)" + (f" (node: {node_id})" if node_id else "")
-                        ),
-                        "recommended_action": (
-                            "Soil moisture sensor may be malfunctioning. Check sensor placement and connections. "
-                            "Verify sensor is not damaged or disconnected. Clean sensor if needed."
-                        ),
-                        "failure_pattern": "constant_soil_moisture",
-                        "constant_value": soil_values[-1]
-                    }
-        
-        # Check for unrealistic values
-        if latest_reading.temperature is not None:
-            if latest_reading.temperature < -50 or latest_reading.temperature > 100:
+            temp_std = window.stdev("temperature")
+            if temp_std < TrendInsightService.SENSOR_FAILURE_CONSTANT_VALUES_THRESHOLD:
                 return {
                     "type": InsightType.SENSOR_FAILURE,
-                    "risk_level": RiskLevel.HIGH.value,
+                    "risk_level": RiskLevel.MEDIUM.value,
                     "explanation": (
-                        f"Unrealistic temperature value: {latest_reading.temperature:.1f}°C " +
-                        (f" (node: {node_id})" if node_id else "")
+                        f"Temperature sensor appears stuck: constant value {latest_temp:.1f}°C "
+                        f"(variation: {temp_std:.3f}°C)" + (f" (node: {node_id})" if node_id else "")
                     ),
                     "recommended_action": (
-                        "Temperature sensor reading is outside valid range. Check sensor calibration. "
-                        "Replace sensor if hardware issue is confirmed."
+                        "Temperature sensor may be malfunctioning. Check sensor hardware. "
+                        "Verify sensor is not disconnected or damaged. Replace sensor if needed."
                     ),
-                    "failure_pattern": "unrealistic_temperature",
-                    "invalid_value": latest_reading.temperature
+                    "failure_pattern": "constant_temperature",
+                    "constant_value": latest_temp
                 }
-        
-        if latest_reading.soil_moisture is not None:
-            if latest_reading.soil_moisture < 0 or latest_reading.soil_moisture > 100:
+            
+            # Check soil moisture variation
+            soil_std = window.stdev("soil_moisture")
+            if soil_std < TrendInsightService.SENSOR_FAILURE_CONSTANT_VALUES_THRESHOLD:
                 return {
                     "type": InsightType.SENSOR_FAILURE,
-                    "risk_level": RiskLevel.HIGH.value,
+                    "risk_level": RiskLevel.MEDIUM.value,
                     "explanation": (
-                        f"Unrealistic soil moisture value: {latest_reading.soil_moisture:.1f}% " +
-                        (f" (node: {node_id})" if node_id else "")
+                        f"Soil moisture sensor appears stuck: constant value {latest_moisture:.1f}% "
+                        f"(variation: {soil_std:.3f}%)" + (f" (node: {node_id})" if node_id else "")
                     ),
                     "recommended_action": (
-                        "Soil moisture sensor reading is outside valid range (0-100%). "
-                        "Check sensor calibration and connections. Replace sensor if needed."
+                        "Soil moisture sensor may be malfunctioning. Check sensor placement and connections. "
+                        "Verify sensor is not damaged or disconnected. Clean sensor if needed."
                     ),
-                    "failure_pattern": "unrealistic_soil_moisture",
-                    "invalid_value": latest_reading.soil_moisture
+                    "failure_pattern": "constant_soil_moisture",
+                    "constant_value": latest_moisture
                 }
         
+        # Check for unrealistic values
+        if latest_temp < -50 or latest_temp > 100:
+            return {
+                "type": InsightType.SENSOR_FAILURE,
+                "risk_level": RiskLevel.HIGH.value,
+                "explanation": (
+                    f"Unrealistic temperature value: {latest_temp:.1f}°C " +
+                    (f" (node: {node_id})" if node_id else "")
+                ),
+                "recommended_action": (
+                    "Temperature sensor reading is outside valid range. Check sensor calibration. "
+                    "Replace sensor if hardware issue is confirmed."
+                ),
+                "failure_pattern": "unrealistic_temperature",
+                "invalid_value": latest_temp
+            }
+        
+        if latest_moisture < 0 or latest_moisture > 100:
+            return {
+                "type": InsightType.SENSOR_FAILURE,
+                "risk_level": RiskLevel.HIGH.value,
+                "explanation": (
+                    f"Unrealistic soil moisture value: {latest_moisture:.1f}% " +
+                    (f" (node: {node_id})" if node_id else "")
+                ),
+                "recommended_action": (
+                    "Soil moisture sensor reading is outside valid range (0-100%). "
+                    "Check sensor calibration and connections. Replace sensor if needed."
+                ),
+                "failure_pattern": "unrealistic_soil_moisture",
+                "invalid_value": latest_moisture
+            }
+        
         return None  # No sensor failure detected
     
     @staticmethod
@@ -562,29 +582,54 @@ class TrendInsightService:
             - summary: Human-readable summary
             - analysis_period_minutes: Period analyzed
         """
-        readings = TrendInsightService.get_recent_readings(db, node_id, minutes)
+        if node_id and PROCESS_LOCAL and trend_engine.supports(minutes):
+            # Served from the streaming engine without touching the database
+            # (it only sees this worker's ingest when workers share state)
+            window = trend_engine.summary(node_id, minutes)
+        else:
+            window = TrendInsightService.load_window(db, node_id, minutes)
+        return TrendInsightService.analyze_window(window, node_id, minutes)
+    
+    @staticmethod
+    def analyze_window(window: ReadingWindow, node_id: Optional[str] = None, minutes: int = 60) -> Dict:
+        """Run every detector on one window and summarise the results.
         
+        Args:
+            window: Readings of the analysis window (ReadingWindow or any object
+                with the same summary interface)
+            node_id: Node the window belongs to (None for mixed readings)
+            minutes: Length of the window in minutes
+            
+        Returns:
+            Analysis result in the format of analyze_trends()
+        """
         insights = []
         
         # Detect various risks (only if we have readings, except sensor failure)
-        if readings:
+        if window.count:
             # Detect drought risk
-            drought_insight = TrendInsightService.detect_drought_risk(readings)
+            drought_insight = _run_detector("drought_risk", TrendInsightService.detect_drought_risk, window)
             if drought_insight:
                 insights.append(drought_insight)
             
             # Detect overwatering risk
-            overwatering_insight = TrendInsightService.detect_overwatering_risk(readings)
+            overwatering_insight = _run_detector(
+                "overwatering_risk", TrendInsightService.detect_overwatering_risk, window
+            )
             if overwatering_insight:
                 insights.append(overwatering_insight)
             
             # Detect temperature stress
-            temp_insight = TrendInsightService.detect_temperature_stress(readings)
+            temp_insight = _run_detector(
+                "temperature_stress", TrendInsightService.detect_temperature_stress, window
+            )
             if temp_insight:
                 insights.append(temp_insight)
         
         # Always check for sensor failure (even if no readings)
-        sensor_failure_insight = TrendInsightService.detect_sensor_failure(readings, node_id)
+        sensor_failure_insight = _run_detector(
+            "sensor_failure", TrendInsightService.detect_sensor_failure, window, node_id
+        )
         if sensor_failure_insight:
             insights.append(sensor_failure_insight)
         
@@ -613,7 +658,111 @@ class TrendInsightService:
             "overall_risk_level": overall_risk_level,
             "summary": summary,
             "analysis_period_minutes": minutes,
-            "readings_analyzed": len(readings),
+            "readings_analyzed": window.count,
             "node_id": node_id
         }
+    
+    @staticmethod
+    def analyze_fleet(db: Session, minutes: int = 60) -> Dict[str, Dict]:
+        """Analyze every node's trends separately in one pass.
+        
+        Windows come from the streaming trend engine when it serves this window
+        length, otherwise from a single query ordered by (node_id, timestamp)
+        that is partitioned per node in memory. With FLEET_ANALYSIS_WORKERS > 0
+        the detectors of database-loaded windows run in a process pool.
+        
+        Args:
+            db: Database session
+            minutes: Number of minutes to analyze per node (default: 60)
+            
+        Returns:
+            Analysis result per node ID (see analyze_trends), including known
+            nodes without readings in the window
+        """
+        if PROCESS_LOCAL and trend_engine.supports(minutes):
+            node_ids = set(trend_engine.node_ids()) | set(device_registry.node_ids())
+            return {
+                node_id: TrendInsightService.analyze_window(trend_engine.summary(node_id, minutes), node_id, minutes)
+                for node_id in sorted(node_ids)
+            }
+        
+        windows = ReadingWindow.load_by_node(db, minutes)
+        empty = ReadingWindow.empty()
+        for node_id in device_registry.node_ids():
+            windows.setdefault(node_id, empty)
+        items = sorted(windows.items())
+        
+        if FLEET_ANALYSIS_WORKERS > 0 and len(items) > 1:
+            # One chunk per worker keeps pickling overhead to a few round trips
+            chunks = [items[i::FLEET_ANALYSIS_WORKERS] for i in range(min(FLEET_ANALYSIS_WORKERS, len(items)))]
+            results = {}
+            pool_results = _get_fleet_pool().map(_analyze_fleet_chunk_in_worker, chunks, [minutes] * len(chunks))
+            for chunk_results, observations in pool_results:
+                results.update(chunk_results)
+                # Metrics updated in a pool worker would never reach /metrics
+                for name, seconds, found in observations:
+                    _record_detector(name, seconds, found)
+            return {node_id: results[node_id] for node_id, _ in items}
+        
+        return dict(_analyze_fleet_chunk(items, minutes))
+
+
+def _record_detector(name: str, seconds: float, found: bool) -> None:
+    trend_detector_seconds.labels(name).observe(seconds)
+    if found:
+        trend_detector_findings_total.labels(name).inc()
+
+
+def _run_detector(name: str, detector, *args) -> Optional[Dict]:
+    """Run one detector, recording its duration and whether it produced an insight."""
+    started = perf_counter()
+    insight = detector(*args)
+    seconds = perf_counter() - started
+    if _collected_observations is not None:
+        _collected_observations.append((name, seconds, bool(insight)))
+    else:
+        _record_detector(name, seconds, bool(insight))
+    return insight
+
+
+def _analyze_fleet_chunk(items: List[Tuple[str, ReadingWindow]], minutes: int) -> List[Tuple[str, Dict]]:
+    """Analyze a list of (node_id, window) pairs."""
+    return [
+        (node_id, TrendInsightService.analyze_window(window, node_id, minutes))
+        for node_id, window in items
+    ]
+
+
+def _analyze_fleet_chunk_in_worker(
+    items: List[Tuple[str, ReadingWindow]],
+    minutes: int
+) -> Tuple[List[Tuple[str, Dict]], List[Tuple[str, float, bool]]]:
+    """Analyze a chunk in a fleet pool worker.
+
+    Returns:
+        The chunk's results and its detector observations (name, seconds,
+        found), which the parent records into the metrics registry
+    """
+    global _collected_observations
+    _collected_observations = []
+    try:
+        return _analyze_fleet_chunk(items, minutes), _collected_observations
+    finally:
+        _collected_observations = None
+
+
+def _get_fleet_pool() -> ProcessPoolExecutor:
+    global _fleet_pool
+    with _fleet_pool_lock:
+        if _fleet_pool is None:
+            _fleet_pool = ProcessPoolExecutor(max_workers=FLEET_ANALYSIS_WORKERS)
+        return _fleet_pool
+
 
+def shutdown_fleet_pool() -> None:
+    """Stop the fleet analysis worker processes, if any were started."""
+    global _fleet_pool
+    with _fleet_pool_lock:
+        if _fleet_pool is not None:
+            _fleet_pool.shutdown()
+            _fleet_pool = None